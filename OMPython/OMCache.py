@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+"""
+Local caches for build artifacts of ModelicaSystem.
+
+BuildCache keeps compiled simulation executables together with their
+init XML, keyed by a hash of everything that influences the build, so
+an unchanged model does not have to be translated and compiled again.
+
+RunCache keeps result files of simulations, keyed by a hash of the
+build, the init XML, the inputs and the simulation flags, so a run that
+was done before is served from its stored result file.
+"""
+
+__license__ = """
+ This file is part of OpenModelica.
+
+ Copyright (c) 1998-CurrentYear, Open Source Modelica Consortium (OSMC),
+ c/o Linköpings universitet, Department of Computer and Information Science,
+ SE-58183 Linköping, Sweden.
+
+ All rights reserved.
+
+ THIS PROGRAM IS PROVIDED UNDER THE TERMS OF THE BSD NEW LICENSE OR THE
+ GPL VERSION 3 LICENSE OR THE OSMC PUBLIC LICENSE (OSMC-PL) VERSION 1.2.
+ ANY USE, REPRODUCTION OR DISTRIBUTION OF THIS PROGRAM CONSTITUTES
+ RECIPIENT'S ACCEPTANCE OF THE OSMC PUBLIC LICENSE OR THE GPL VERSION 3,
+ ACCORDING TO RECIPIENTS CHOICE.
+
+ The OpenModelica software and the OSMC (Open Source Modelica Consortium)
+ Public License (OSMC-PL) are obtained from OSMC, either from the above
+ address, from the URLs: http://www.openmodelica.org or
+ http://www.ida.liu.se/projects/OpenModelica, and in the OpenModelica
+ distribution. GNU version 3 is obtained from:
+ http://www.gnu.org/copyleft/gpl.html. The New BSD License is obtained from:
+ http://www.opensource.org/licenses/BSD-3-Clause.
+
+ This program is distributed WITHOUT ANY WARRANTY; without even the implied
+ warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE, EXCEPT AS
+ EXPRESSLY SET FORTH IN THE BY RECIPIENT SELECTED SUBSIDIARY LICENSE
+ CONDITIONS OF OSMC-PL.
+"""
+
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import logging
+
+logger = logging.getLogger('OMCSession')
+
+
+def hashModelFiles(fileName):
+    """
+    Returns the sha1 of the Modelica sources loaded from fileName. For a
+    package.mo the whole package directory is hashed.
+    """
+    digest = hashlib.sha1()
+    if os.path.basename(fileName) == 'package.mo':
+        root = os.path.dirname(os.path.abspath(fileName))
+        files = []
+        for (dirPath, dirNames, fileNames) in os.walk(root):
+            dirNames.sort()
+            files.extend(os.path.join(dirPath, f) for f in sorted(fileNames) if f.endswith(('.mo', '.order')))
+    else:
+        root = os.path.dirname(os.path.abspath(fileName))
+        files = [os.path.abspath(fileName)]
+    for f in files:
+        digest.update(os.path.relpath(f, root).replace(os.sep, '/').encode('utf-8'))
+        hashFile(f, digest)
+    return digest.hexdigest()
+
+
+def hashFile(fileName, digest=None):
+    """Returns the sha1 of the contents of fileName."""
+    digest = digest or hashlib.sha1()
+    with open(fileName, 'rb') as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _treeSize(path):
+    return sum(os.path.getsize(os.path.join(d, f)) for (d, _, fs) in os.walk(path) for f in fs)
+
+
+class BuildCache(object):
+    """
+    Directory of build entries, one sub-directory per key. Entries are
+    created atomically (copy to a temporary directory, then rename) and
+    evicted least recently used first once the cache grows beyond maxSize
+    bytes. The modification time of an entry directory records its last use.
+    """
+
+    def __init__(self, cacheDir=None, maxSize=2 * 1024 ** 3):
+        if cacheDir is None:
+            cacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'OMPython', 'builds')
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+
+    @staticmethod
+    def key(*parts):
+        digest = hashlib.sha1()
+        for p in parts:
+            digest.update(repr(p).encode('utf-8'))
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def entryDir(self, key):
+        return os.path.join(self.cacheDir, key)
+
+    def fetch(self, key, destDir):
+        """
+        Copies the files of the entry of key into destDir and returns their
+        names, or None on a cache miss.
+        """
+        entry = self.entryDir(key)
+        if not os.path.isdir(entry):
+            return None
+        files = sorted(os.listdir(entry))
+        for f in files:
+            shutil.copy2(os.path.join(entry, f), os.path.join(destDir, f))
+        os.utime(entry, None)
+        logger.info('Build cache hit {0}'.format(key))
+        return files
+
+    def store(self, key, files, srcDir):
+        """Copies files from srcDir into a new entry of key and evicts old entries."""
+        entry = self.entryDir(key)
+        if os.path.isdir(entry):
+            os.utime(entry, None)
+            return
+        tmp = os.path.join(self.cacheDir, '.tmp-' + uuid.uuid4().hex)
+        os.mkdir(tmp)
+        try:
+            for f in files:
+                shutil.copy2(os.path.join(srcDir, f), os.path.join(tmp, f))
+            os.rename(tmp, entry)
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict()
+
+    def entries(self):
+        """Returns (last use, size, key) of all entries, least recently used first."""
+        result = []
+        for key in os.listdir(self.cacheDir):
+            path = self.entryDir(key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            result.append((os.path.getmtime(path), _treeSize(path), key))
+        return sorted(result)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for (_, size, key) in entries:
+            if total <= self.maxSize:
+                break
+            shutil.rmtree(self.entryDir(key), ignore_errors=True)
+            total -= size
+            logger.info('Build cache evicted {0}'.format(key))
+
+    def clear(self):
+        for (_, _, key) in self.entries():
+            shutil.rmtree(self.entryDir(key), ignore_errors=True)
+
+
+class RunCache(object):
+    """
+    Directory of simulation results, one sub-directory per key, with a
+    SQLite catalog (catalog.db) recording size, creation and last use of
+    every entry and a JSON description of the run. Entries are evicted
+    least recently used first once the cache grows beyond maxSize bytes.
+    An entry is only listed in the catalog after its files are complete,
+    so an interrupted sweep can be resumed from the runs stored so far.
+    """
+
+    def __init__(self, cacheDir=None, maxSize=10 * 1024 ** 3):
+        if cacheDir is None:
+            cacheDir = os.path.join(os.path.expanduser('~'), '.cache', 'OMPython', 'runs')
+        self.cacheDir = cacheDir
+        self.maxSize = maxSize
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir)
+        with self._connect() as db:
+            db.execute('CREATE TABLE IF NOT EXISTS runs (key TEXT PRIMARY KEY, size INTEGER, '
+                       'created REAL, lastUsed REAL, info TEXT)')
+
+    key = staticmethod(BuildCache.key)
+
+    def _connect(self):
+        return _Catalog(os.path.join(self.cacheDir, 'catalog.db'))
+
+    def entryDir(self, key):
+        return os.path.join(self.cacheDir, key)
+
+    def lookup(self, key):
+        """
+        Returns the directory holding the files of the entry of key, or None
+        on a cache miss.
+        """
+        with self._connect() as db:
+            found = db.execute('SELECT key FROM runs WHERE key = ?', (key,)).fetchone()
+            if found is None:
+                return None
+            entry = self.entryDir(key)
+            if not os.path.isdir(entry):
+                db.execute('DELETE FROM runs WHERE key = ?', (key,))
+                return None
+            db.execute('UPDATE runs SET lastUsed = ? WHERE key = ?', (time.time(), key))
+        logger.info('Run cache hit {0}'.format(key))
+        return entry
+
+    def info(self, key):
+        """Returns the description stored with the entry of key, or None."""
+        with self._connect() as db:
+            found = db.execute('SELECT info FROM runs WHERE key = ?', (key,)).fetchone()
+        return json.loads(found[0]) if found is not None else None
+
+    def store(self, key, files, info=None):
+        """
+        Copies files (a dict of entry file name -> source path) into a new
+        entry of key, records it in the catalog and evicts old entries.
+        Returns the entry directory.
+        """
+        entry = self.entryDir(key)
+        if self.lookup(key) is not None:
+            return entry
+        tmp = os.path.join(self.cacheDir, '.tmp-' + uuid.uuid4().hex)
+        os.mkdir(tmp)
+        try:
+            for (name, path) in files.items():
+                shutil.copy2(path, os.path.join(tmp, name))
+            if os.path.isdir(entry):
+                # left behind by an interrupted store, never listed in the catalog
+                shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return self.lookup(key)
+        now = time.time()
+        with self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?)',
+                       (key, _treeSize(entry), now, now, json.dumps(info)))
+        self.evict()
+        return entry
+
+    def updateSize(self, key):
+        """
+        Records the size of the entry of key again after files were added to
+        its directory, e.g. a columnar store of its result, and evicts old
+        entries.
+        """
+        entry = self.entryDir(key)
+        if not os.path.isdir(entry):
+            return
+        with self._connect() as db:
+            db.execute('UPDATE runs SET size = ? WHERE key = ?', (_treeSize(entry), key))
+        self.evict()
+
+    def entries(self):
+        """Returns (last use, size, key) of all entries, least recently used first."""
+        with self._connect() as db:
+            return [tuple(r) for r in db.execute('SELECT lastUsed, size, key FROM runs ORDER BY lastUsed')]
+
+    def remove(self, key):
+        with self._connect() as db:
+            db.execute('DELETE FROM runs WHERE key = ?', (key,))
+        shutil.rmtree(self.entryDir(key), ignore_errors=True)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(e[1] for e in entries)
+        for (_, size, key) in entries:
+            if total <= self.maxSize:
+                break
+            self.remove(key)
+            total -= size
+            logger.info('Run cache evicted {0}'.format(key))
+
+    def clear(self):
+        for (_, _, key) in self.entries():
+            self.remove(key)
+
+
+class _Catalog(object):
+    """SQLite connection committing (or rolling back) and closing on exit of a with block."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.db = sqlite3.connect(self.path, timeout=60)
+        return self.db
+
+    def __exit__(self, excType, excValue, traceback):
+        try:
+            if excType is None:
+                self.db.commit()
+            else:
+                self.db.rollback()
+        finally:
+            self.db.close()
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Executors running the tasks of the batch APIs of ModelicaSystem (sweep,
+ensemble, linearizeBatch): local threads, a local process pool, or a
+work queue served to worker processes on other hosts.
+
+Every executor provides imapUnordered(function, args), yielding
+(index, result) pairs in the order tasks finish. function must be a
+module level function, so it can be pickled by reference.
+
+For QueueExecutor, start workers on the other hosts with
+
+    python -m OMPython.OMExecutor <host>:<port> <authkey>
+
+Their tasks refer to the simulation executable and init xml by path, so
+these have to be on a shared file system (or at the same path on every
+host); the tasks return arrays, not files.
+"""
+
+__license__ = """
+ This file is part of OpenModelica.
+
+ Copyright (c) 1998-CurrentYear, Open Source Modelica Consortium (OSMC),
+ c/o Linköpings universitet, Department of Computer and Information Science,
+ SE-58183 Linköping, Sweden.
+
+ All rights reserved.
+
+ THIS PROGRAM IS PROVIDED UNDER THE TERMS OF THE BSD NEW LICENSE OR THE
+ GPL VERSION 3 LICENSE OR THE OSMC PUBLIC LICENSE (OSMC-PL) VERSION 1.2.
+ ANY USE, REPRODUCTION OR DISTRIBUTION OF THIS PROGRAM CONSTITUTES
+ RECIPIENT'S ACCEPTANCE OF THE OSMC PUBLIC LICENSE OR THE GPL VERSION 3,
+ ACCORDING TO RECIPIENTS CHOICE.
+
+ The OpenModelica software and the OSMC (Open Source Modelica Consortium)
+ Public License (OSMC-PL) are obtained from OSMC, either from the above
+ address, from the URLs: http://www.openmodelica.org or
+ http://www.ida.liu.se/projects/OpenModelica, and in the OpenModelica
+ distribution. GNU version 3 is obtained from:
+ http://www.gnu.org/copyleft/gpl.html. The New BSD License is obtained from:
+ http://www.opensource.org/licenses/BSD-3-Clause.
+
+ This program is distributed WITHOUT ANY WARRANTY; without even the implied
+ warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE, EXCEPT AS
+ EXPRESSLY SET FORTH IN THE BY RECIPIENT SELECTED SUBSIDIARY LICENSE
+ CONDITIONS OF OSMC-PL.
+"""
+
+
+import sys
+import time
+import uuid
+import socket
+import threading
+import traceback
+import multiprocessing
+import multiprocessing.pool
+from multiprocessing.managers import BaseManager
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+class ExecutorError(Exception):
+    """Raised for a task that failed with an exception, or a queue without answer."""
+
+
+def _call(args):
+    (function, index, taskArgs) = args
+    return (index, function(taskArgs))
+
+
+class Executor(object):
+    """Base class, runs the tasks one after the other in this process."""
+
+    def imapUnordered(self, function, args):
+        for (index, a) in enumerate(args):
+            yield (index, function(a))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+class _PoolExecutor(Executor):
+
+    def imapUnordered(self, function, args):
+        return self.pool.imap_unordered(_call, ((function, i, a) for (i, a) in enumerate(args)))
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+
+class ThreadExecutor(_PoolExecutor):
+    """Runs tasks in a pool of threads, for tasks waiting for subprocesses or I/O."""
+
+    def __init__(self, workers=None):
+        self.pool = multiprocessing.pool.ThreadPool(workers or multiprocessing.cpu_count())
+
+
+class ProcessExecutor(_PoolExecutor):
+    """Runs tasks in a pool of local processes."""
+
+    def __init__(self, workers=None):
+        self.pool = multiprocessing.Pool(workers)
+
+
+# queues of the manager process of a QueueExecutor
+_queues = {}
+
+
+def _getQueue(name):
+    if name not in _queues:
+        _queues[name] = queue.Queue()
+    return _queues[name]
+
+
+def _getTasks():
+    return _getQueue('tasks')
+
+
+def _getResults():
+    return _getQueue('results')
+
+
+class _QueueManager(BaseManager):
+    pass
+
+
+_QueueManager.register('getTasks', callable=_getTasks)
+_QueueManager.register('getResults', callable=_getResults)
+
+
+class QueueExecutor(Executor):
+    """
+    Serves a task queue and a result queue at address (host, port) to
+    worker processes, see runWorker(), which may run on other hosts. At
+    most window tasks are queued at a time, so a generator of tasks is
+    consumed as workers keep up. Workers report every heartbeat seconds
+    on the task they run; a task whose worker has not reported for three
+    heartbeats (e.g. its host went down) is queued again, at most retries
+    times before ExecutorError is raised. Waiting longer than timeout
+    seconds for any result (e.g. without workers) raises ExecutorError.
+    """
+
+    def __init__(self, address=('', 0), authkey=None, window=1000, timeout=None, heartbeat=5.0, retries=3):
+        self.authkey = authkey or uuid.uuid4().hex
+        self.manager = _QueueManager(address=address, authkey=self.authkey.encode('ascii'))
+        self.manager.start()
+        host = address[0] or socket.gethostname()
+        self.address = (host, self.manager.address[1])
+        self.tasks = self.manager.getTasks()
+        self.results = self.manager.getResults()
+        self.window = window
+        self.timeout = timeout
+        self.heartbeat = heartbeat
+        self.retries = retries
+        self.workers = []
+
+    def startLocalWorkers(self, count):
+        """Starts count worker processes on this host, e.g. standing in for remote nodes."""
+        for _ in range(count):
+            worker = multiprocessing.Process(target=runWorker, args=(self.address, self.authkey))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+        return self.workers
+
+    def imapUnordered(self, function, args):
+        job = uuid.uuid4().hex
+        args = enumerate(args)
+        exhausted = False
+        # arguments of the tasks without result, last report of the running ones, times each was queued
+        (outstanding, running, queued) = ({}, {}, {})
+        lastResult = time.time()
+        while True:
+            while not exhausted and len(outstanding) < self.window:
+                try:
+                    (index, a) = next(args)
+                except StopIteration:
+                    exhausted = True
+                    break
+                self.tasks.put((job, index, function, a, self.heartbeat))
+                (outstanding[index], queued[index]) = (a, 1)
+            if not outstanding:
+                return
+            wait = self.heartbeat
+            if self.timeout is not None:
+                wait = max(0.0, min(wait, lastResult + self.timeout - time.time()))
+            try:
+                (resultJob, index, ok, result) = self.results.get(timeout=wait)
+            except queue.Empty:
+                resultJob = None
+            now = time.time()
+            # a result left over from an earlier, abandoned job or from a task that was queued again is dropped
+            if resultJob == job and index in outstanding:
+                if ok is None:
+                    running[index] = now
+                else:
+                    del outstanding[index]
+                    del queued[index]
+                    running.pop(index, None)
+                    lastResult = now
+                    if not ok:
+                        raise ExecutorError('task {0} failed on {1}'.format(index, result))
+                    yield (index, result)
+            for (index, reported) in list(running.items()):
+                if now - reported <= 3 * self.heartbeat:
+                    continue
+                if queued[index] > self.retries:
+                    raise ExecutorError('task {0} was lost {1} times, its workers stopped reporting'.format(index, queued[index]))
+                del running[index]
+                self.tasks.put((job, index, function, outstanding[index], self.heartbeat))
+                queued[index] += 1
+            if self.timeout is not None and now - lastResult > self.timeout:
+                raise ExecutorError('no result within {0} s, {1} tasks are outstanding'.format(self.timeout, len(outstanding)))
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        self.manager.shutdown()
+
+
+def _report(results, job, index, host, heartbeat, finished):
+    # tells the executor every heartbeat seconds that the task is still running
+    while not finished.wait(heartbeat):
+        try:
+            results.put((job, index, None, host))
+        except (EOFError, IOError, socket.error):
+            return
+
+
+def runWorker(address, authkey, idle=1.0):
+    """
+    Connects to the QueueExecutor at address (host, port) and runs its
+    tasks until it sends None or goes away. While a task runs the worker
+    reports on it, see QueueExecutor.
+    """
+    manager = _QueueManager(address=tuple(address), authkey=authkey.encode('ascii'))
+    manager.connect()
+    (tasks, results) = (manager.getTasks(), manager.getResults())
+    host = socket.gethostname()
+    while True:
+        try:
+            task = tasks.get(timeout=idle)
+        except queue.Empty:
+            continue
+        except (EOFError, IOError, socket.error):
+            return
+        if task is None:
+            return
+        (job, index, function, args, heartbeat) = task
+        results.put((job, index, None, host))
+        finished = threading.Event()
+        reporter = threading.Thread(target=_report, args=(results, job, index, host, heartbeat, finished))
+        reporter.daemon = True
+        reporter.start()
+        try:
+            results.put((job, index, True, function(args)))
+        except Exception:
+            results.put((job, index, False, '{0}: {1}'.format(host, traceback.format_exc())))
+        finally:
+            finished.set()
+            reporter.join()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python -m OMPython.OMExecutor <host>:<port> <authkey>')
+        sys.exit(1)
+    (host, port) = sys.argv[1].rsplit(':', 1)
+    runWorker((host, int(port)), sys.argv[2])
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""
+In-process runner for FMI 2.0 FMUs, e.g. exported with
+ModelicaSystem.convertMo2Fmu().
+
+The shared library of an FMU is loaded once with ctypes and can then be
+instantiated many times in the same process, for co-simulation (doStep)
+or model exchange (states, derivatives and event indicators driven by a
+fixed step integrator here). Values are read and written as numpy
+arrays of value references, so short simulations run without starting a
+process or writing result files.
+
+>>> fmu = FMU('BouncingBall.fmu')
+>>> inst = fmu.instantiate()
+>>> result = inst.simulate(0.0, 3.0, 0.01, outputs=['h'])
+"""
+
+__license__ = """
+ This file is part of OpenModelica.
+
+ Copyright (c) 1998-CurrentYear, Open Source Modelica Consortium (OSMC),
+ c/o Linköpings universitet, Department of Computer and Information Science,
+ SE-58183 Linköping, Sweden.
+
+ All rights reserved.
+
+ THIS PROGRAM IS PROVIDED UNDER THE TERMS OF THE BSD NEW LICENSE OR THE
+ GPL VERSION 3 LICENSE OR THE OSMC PUBLIC LICENSE (OSMC-PL) VERSION 1.2.
+ ANY USE, REPRODUCTION OR DISTRIBUTION OF THIS PROGRAM CONSTITUTES
+ RECIPIENT'S ACCEPTANCE OF THE OSMC PUBLIC LICENSE OR THE GPL VERSION 3,
+ ACCORDING TO RECIPIENTS CHOICE.
+
+ The OpenModelica software and the OSMC (Open Source Modelica Consortium)
+ Public License (OSMC-PL) are obtained from OSMC, either from the above
+ address, from the URLs: http://www.openmodelica.org or
+ http://www.ida.liu.se/projects/OpenModelica, and in the OpenModelica
+ distribution. GNU version 3 is obtained from:
+ http://www.gnu.org/copyleft/gpl.html. The New BSD License is obtained from:
+ http://www.opensource.org/licenses/BSD-3-Clause.
+
+ This program is distributed WITHOUT ANY WARRANTY; without even the implied
+ warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE, EXCEPT AS
+ EXPRESSLY SET FORTH IN THE BY RECIPIENT SELECTED SUBSIDIARY LICENSE
+ CONDITIONS OF OSMC-PL.
+"""
+
+
+import os
+import sys
+import ctypes
+import ctypes.util
+import shutil
+import zipfile
+import tempfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+fmi2OK, fmi2Warning, fmi2Discard, fmi2Error, fmi2Fatal, fmi2Pending = range(6)
+fmi2ModelExchange, fmi2CoSimulation = range(2)
+
+_Logger = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_char_p)
+_Allocate = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_size_t, ctypes.c_size_t)
+_Free = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
+_StepFinished = ctypes.CFUNCTYPE(None, ctypes.c_void_p, ctypes.c_int)
+
+
+class _CallbackFunctions(ctypes.Structure):
+    _fields_ = [('logger', _Logger), ('allocateMemory', _Allocate), ('freeMemory', _Free),
+                ('stepFinished', _StepFinished), ('componentEnvironment', ctypes.c_void_p)]
+
+
+class _EventInfo(ctypes.Structure):
+    _fields_ = [('newDiscreteStatesNeeded', ctypes.c_int), ('terminateSimulation', ctypes.c_int),
+                ('nominalsOfContinuousStatesChanged', ctypes.c_int), ('valuesOfContinuousStatesChanged', ctypes.c_int),
+                ('nextEventTimeDefined', ctypes.c_int), ('nextEventTime', ctypes.c_double)]
+
+
+_c = ctypes.cdll.msvcrt if sys.platform == 'win32' else ctypes.CDLL(ctypes.util.find_library('c'))
+_calloc = ctypes.cast(_c.calloc, _Allocate)
+_free = ctypes.cast(_c.free, _Free)
+
+# argument types of the FMI functions bound on first use, the component comes first
+_real = ctypes.POINTER(ctypes.c_double)
+_int = ctypes.POINTER(ctypes.c_int)
+_vr = ctypes.POINTER(ctypes.c_uint)
+_signatures = {
+    'fmi2SetupExperiment': [ctypes.c_int, ctypes.c_double, ctypes.c_double, ctypes.c_int, ctypes.c_double],
+    'fmi2EnterInitializationMode': [], 'fmi2ExitInitializationMode': [], 'fmi2Terminate': [], 'fmi2Reset': [],
+    'fmi2GetReal': [_vr, ctypes.c_size_t, _real], 'fmi2SetReal': [_vr, ctypes.c_size_t, _real],
+    'fmi2GetInteger': [_vr, ctypes.c_size_t, _int], 'fmi2SetInteger': [_vr, ctypes.c_size_t, _int],
+    'fmi2GetBoolean': [_vr, ctypes.c_size_t, _int], 'fmi2SetBoolean': [_vr, ctypes.c_size_t, _int],
+    'fmi2DoStep': [ctypes.c_double, ctypes.c_double, ctypes.c_int],
+    'fmi2SetTime': [ctypes.c_double], 'fmi2EnterEventMode': [], 'fmi2EnterContinuousTimeMode': [],
+    'fmi2NewDiscreteStates': [ctypes.POINTER(_EventInfo)],
+    'fmi2CompletedIntegratorStep': [ctypes.c_int, _int, _int],
+    'fmi2SetContinuousStates': [_real, ctypes.c_size_t], 'fmi2GetContinuousStates': [_real, ctypes.c_size_t],
+    'fmi2GetDerivatives': [_real, ctypes.c_size_t], 'fmi2GetEventIndicators': [_real, ctypes.c_size_t],
+}
+
+
+class FMUError(Exception):
+    """Raised when an FMI function returns fmi2Error or fmi2Fatal, or for an unusable FMU."""
+
+
+def _platform():
+    bits = '64' if sys.maxsize > 2 ** 32 else '32'
+    if sys.platform == 'win32':
+        return ('win' + bits, '.dll')
+    if sys.platform == 'darwin':
+        return ('darwin' + bits, '.dylib')
+    return ('linux' + bits, '.so')
+
+
+class ScalarVariable(object):
+    """Entry of the ModelVariables of a model description."""
+
+    def __init__(self, name, valueReference, type, causality, variability, start, derivative=None):
+        self.name = name
+        self.valueReference = valueReference
+        self.type = type
+        self.causality = causality
+        self.variability = variability
+        self.start = start
+        self.derivative = derivative #index (1 based) of the variable this is the derivative of
+
+
+class FMU(object):
+    """
+    An unpacked FMI 2.0 FMU with its model description and its shared
+    library, loaded once for all instances. unpackDir defaults to a
+    temporary directory that is removed by close().
+    """
+
+    def __init__(self, fmuFile, unpackDir=None):
+        self.fmuFile = fmuFile
+        self._ownsDir = unpackDir is None
+        self.unpackDir = tempfile.mkdtemp(prefix='fmu_') if unpackDir is None else unpackDir
+        with zipfile.ZipFile(fmuFile) as z:
+            z.extractall(self.unpackDir)
+        root = ET.parse(os.path.join(self.unpackDir, 'modelDescription.xml')).getroot()
+        if root.get('fmiVersion') != '2.0':
+            raise FMUError('{0}: FMI version {1} is not supported'.format(fmuFile, root.get('fmiVersion')))
+        self.modelName = root.get('modelName')
+        self.guid = root.get('guid')
+        self.numberOfEventIndicators = int(root.get('numberOfEventIndicators', 0))
+        self.kinds = {}
+        for (tag, kind) in (('ModelExchange', fmi2ModelExchange), ('CoSimulation', fmi2CoSimulation)):
+            element = root.find(tag)
+            if element is not None:
+                self.kinds[kind] = element
+        if not self.kinds:
+            raise FMUError('{0}: neither ModelExchange nor CoSimulation is supported'.format(fmuFile))
+        self.variables = []
+        for sv in root.find('ModelVariables'):
+            typed = [c for c in sv if c.tag in ('Real', 'Integer', 'Boolean', 'String', 'Enumeration')][0]
+            self.variables.append(ScalarVariable(sv.get('name'), int(sv.get('valueReference')), typed.tag,
+                                                 sv.get('causality', 'local'), sv.get('variability', 'continuous'),
+                                                 typed.get('start'), typed.get('derivative') and int(typed.get('derivative'))))
+        self.variableIndex = dict((v.name, v) for v in self.variables)
+        structure = root.find('ModelStructure')
+        derivatives = structure.find('Derivatives') if structure is not None else None
+        # the Derivatives unknowns list the continuous states in their order
+        self.stateNames = []
+        self.derivativeNames = []
+        for unknown in (derivatives if derivatives is not None else []):
+            der = self.variables[int(unknown.get('index')) - 1]
+            self.derivativeNames.append(der.name)
+            self.stateNames.append(self.variables[der.derivative - 1].name if der.derivative else None)
+        self.numberOfStates = len(self.derivativeNames)
+        self._libraries = {}
+        self._instances = 0
+
+    def library(self, kind):
+        """The ctypes library of kind (fmi2ModelExchange or fmi2CoSimulation), loaded once."""
+        if kind not in self.kinds:
+            raise FMUError('{0} does not support {1}'.format(self.fmuFile, ['ModelExchange', 'CoSimulation'][kind]))
+        identifier = self.kinds[kind].get('modelIdentifier')
+        if identifier not in self._libraries:
+            (platform, extension) = _platform()
+            path = os.path.join(self.unpackDir, 'binaries', platform, identifier + extension)
+            if not os.path.exists(path):
+                raise FMUError('{0} has no binary for {1}'.format(self.fmuFile, platform))
+            library = ctypes.CDLL(path)
+            library.fmi2Instantiate.restype = ctypes.c_void_p
+            library.fmi2Instantiate.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_char_p,
+                                                ctypes.POINTER(_CallbackFunctions), ctypes.c_int, ctypes.c_int]
+            library.fmi2FreeInstance.restype = None
+            library.fmi2FreeInstance.argtypes = [ctypes.c_void_p]
+            for (name, argtypes) in _signatures.items():
+                function = getattr(library, name, None)
+                if function is not None:
+                    function.restype = ctypes.c_int
+                    function.argtypes = [ctypes.c_void_p] + argtypes
+            self._libraries[identifier] = library
+        return self._libraries[identifier]
+
+    def valueReferences(self, names):
+        """Returns the value references of names as a uint32 array."""
+        try:
+            return np.array([self.variableIndex[n].valueReference for n in names], dtype=np.uint32)
+        except KeyError as e:
+            raise FMUError('{0} has no variable {1}'.format(self.modelName, e.args[0]))
+
+    def instantiate(self, instanceName=None, kind=None, loggingOn=False):
+        """
+        Returns a new FMUInstance; kind defaults to co-simulation when the
+        FMU supports it.
+        """
+        if kind is None:
+            kind = fmi2CoSimulation if fmi2CoSimulation in self.kinds else fmi2ModelExchange
+        element = self.kinds.get(kind)
+        if self._instances and element is not None and element.get('canBeInstantiatedOnlyOncePerProcess') == 'true':
+            raise FMUError('{0} can be instantiated only once per process'.format(self.modelName))
+        instance = FMUInstance(self, kind, instanceName or '{0}_{1}'.format(self.modelName, self._instances), loggingOn)
+        self._instances += 1
+        return instance
+
+    def close(self):
+        self._libraries = {}
+        if self._ownsDir:
+            shutil.rmtree(self.unpackDir, ignore_errors=True)
+
+
+class FMUInstance(object):
+    """
+    One instance of an FMU. get/set work on value references (arrays) or
+    on names; the FMI functions of the library are also available as
+    methods without the fmi2 prefix.
+    """
+
+    def __init__(self, fmu, kind, instanceName, loggingOn=False):
+        self.fmu = fmu
+        self.kind = kind
+        self.instanceName = instanceName
+        self.messages = []
+        self._library = fmu.library(kind)
+        # the callbacks must stay referenced as long as the instance lives
+        self._logger = _Logger(self._log)
+        self._callbacks = _CallbackFunctions(self._logger, _calloc, _free, _StepFinished(), None)
+        resources = 'file:///' + os.path.abspath(os.path.join(fmu.unpackDir, 'resources')).replace(os.sep, '/').lstrip('/')
+        self.component = self._library.fmi2Instantiate(instanceName.encode('utf-8'), kind, fmu.guid.encode('utf-8'),
+                                                      resources.encode('utf-8'), ctypes.byref(self._callbacks), 0,
+                                                      1 if loggingOn else 0)
+        if not self.component:
+            raise FMUError('fmi2Instantiate failed for {0}: {1}'.format(instanceName, '; '.join(self.messages)))
+        self.time = None
+
+    def _log(self, environment, instanceName, status, category, message):
+        self.messages.append(message.decode('utf-8', 'replace') if message else '')
+
+    def _call(self, name, *args):
+        status = getattr(self._library, name)(self.component, *args)
+        if status >= fmi2Error:
+            raise FMUError('{0} failed with status {1}: {2}'.format(name, status, '; '.join(self.messages[-5:])))
+        return status
+
+    def setupExperiment(self, startTime=0.0, stopTime=None, tolerance=None):
+        self.time = startTime
+        self._call('fmi2SetupExperiment', tolerance is not None, tolerance or 0.0, startTime,
+                   stopTime is not None, stopTime if stopTime is not None else 0.0)
+
+    def enterInitializationMode(self):
+        self._call('fmi2EnterInitializationMode')
+
+    def exitInitializationMode(self):
+        self._call('fmi2ExitInitializationMode')
+
+    def initialize(self, startTime=0.0, stopTime=None, tolerance=None, values=None):
+        """setupExperiment, values (a dict of start values), then initialization mode."""
+        self.setupExperiment(startTime, stopTime, tolerance)
+        if values:
+            self.set(list(values.keys()), list(values.values()))
+        self.enterInitializationMode()
+        self.exitInitializationMode()
+
+    def terminate(self):
+        self._call('fmi2Terminate')
+
+    def reset(self):
+        """Returns the instance to the state after instantiation, for the next run."""
+        self._call('fmi2Reset')
+        self.time = None
+
+    def free(self):
+        if self.component:
+            self._library.fmi2FreeInstance(self.component)
+            self.component = None
+
+    def __del__(self):
+        self.free()
+
+    def _access(self, what, ctype, dtype, vr, values=None):
+        vr = np.ascontiguousarray(vr, dtype=np.uint32)
+        if values is None:
+            values = np.empty(len(vr), dtype=dtype)
+            self._call('fmi2Get' + what, vr.ctypes.data_as(_vr), len(vr), values.ctypes.data_as(ctypes.POINTER(ctype)))
+            return values
+        values = np.ascontiguousarray(values, dtype=dtype)
+        self._call('fmi2Set' + what, vr.ctypes.data_as(_vr), len(vr), values.ctypes.data_as(ctypes.POINTER(ctype)))
+
+    def getReal(self, vr):
+        return self._access('Real', ctypes.c_double, np.float64, vr)
+
+    def setReal(self, vr, values):
+        self._access('Real', ctypes.c_double, np.float64, vr, values)
+
+    def getInteger(self, vr):
+        return self._access('Integer', ctypes.c_int, np.int32, vr)
+
+    def setInteger(self, vr, values):
+        self._access('Integer', ctypes.c_int, np.int32, vr, values)
+
+    def getBoolean(self, vr):
+        return self._access('Boolean', ctypes.c_int, np.int32, vr).astype(bool)
+
+    def setBoolean(self, vr, values):
+        self._access('Boolean', ctypes.c_int, np.int32, vr, values)
+
+    def _byType(self, names):
+        groups = {}
+        for (i, n) in enumerate(names):
+            if n not in self.fmu.variableIndex:
+                raise FMUError('{0} has no variable {1}'.format(self.fmu.modelName, n))
+            v = self.fmu.variableIndex[n]
+            groups.setdefault('Integer' if v.type == 'Enumeration' else v.type, []).append((i, v.valueReference))
+        if 'String' in groups:
+            raise FMUError('String variables are not supported')
+        return groups
+
+    def get(self, names):
+        """Returns the values of names (any of Real, Integer, Boolean) as a float64 array."""
+        values = np.empty(len(names), dtype=np.float64)
+        for (what, items) in self._byType(names).items():
+            (index, vr) = zip(*items)
+            values[list(index)] = getattr(self, 'get' + what)(vr)
+        return values
+
+    def set(self, names, values):
+        values = np.asarray(values, dtype=np.float64)
+        for (what, items) in self._byType(names).items():
+            (index, vr) = zip(*items)
+            getattr(self, 'set' + what)(vr, values[list(index)])
+
+    def doStep(self, currentTime, stepSize, noSetFMUStatePriorToCurrentPoint=True):
+        """Co-simulation step, returns False if the FMU discarded it."""
+        status = self._call('fmi2DoStep', currentTime, stepSize, noSetFMUStatePriorToCurrentPoint)
+        if status != fmi2Discard:
+            self.time = currentTime + stepSize
+        return status != fmi2Discard
+
+    def _vector(self, name, n):
+        values = np.empty(n, dtype=np.float64)
+        if n:
+            self._call(name, values.ctypes.data_as(_real), n)
+        return values
+
+    def getContinuousStates(self):
+        return self._vector('fmi2GetContinuousStates', self.fmu.numberOfStates)
+
+    def setContinuousStates(self, x):
+        x = np.ascontiguousarray(x, dtype=np.float64)
+        self._call('fmi2SetContinuousStates', x.ctypes.data_as(_real), len(x))
+
+    def getDerivatives(self):
+        return self._vector('fmi2GetDerivatives', self.fmu.numberOfStates)
+
+    def getEventIndicators(self):
+        return self._vector('fmi2GetEventIndicators', self.fmu.numberOfEventIndicators)
+
+    def setTime(self, time):
+        self.time = time
+        self._call('fmi2SetTime', time)
+
+    def _eventIteration(self):
+        # event mode until the discrete states are settled, returns the event info
+        info = _EventInfo()
+        info.newDiscreteStatesNeeded = 1
+        while info.newDiscreteStatesNeeded and not info.terminateSimulation:
+            self._call('fmi2NewDiscreteStates', ctypes.byref(info))
+        return info
+
+    def simulate(self, startTime=0.0, stopTime=1.0, stepSize=None, inputs=None, outputs=None, values=None):
+        """
+        Runs the instance from startTime to stopTime and returns an array
+        with time in its first row and one row per output, sampled every
+        stepSize (default: 500 intervals), like ModelicaSystem.getSolutions().
+        inputs maps input names to constants or functions of time, values
+        holds start/parameter values set before initialization.
+        Co-simulation uses doStep, model exchange a forward Euler step with
+        state and time events handled at the end of the step.
+        """
+        stepSize = stepSize or (stopTime - startTime) / 500.0
+        outputs = list(outputs or [v.name for v in self.fmu.variables if v.causality == 'output'])
+        inputs = inputs or {}
+        inputNames = list(inputs)
+        n = int(round((stopTime - startTime) / stepSize))
+        grid = startTime + stepSize * np.arange(n + 1)
+        result = np.empty((len(outputs) + 1, n + 1))
+        result[0] = grid
+        setInputs = lambda t: self.set(inputNames, [u(t) if callable(u) else u for u in (inputs[k] for k in inputNames)])
+        self.setupExperiment(startTime, stopTime)
+        if values:
+            self.set(list(values.keys()), list(values.values()))
+        setInputs(startTime)
+        self.enterInitializationMode()
+        self.exitInitializationMode()
+        if self.kind == fmi2ModelExchange:
+            info = self._eventIteration()
+            self._call('fmi2EnterContinuousTimeMode')
+            indicators = self.getEventIndicators()
+        result[1:, 0] = self.get(outputs)
+        for i in range(1, n + 1):
+            t = grid[i - 1]
+            setInputs(t)
+            if self.kind == fmi2CoSimulation:
+                if not self.doStep(t, grid[i] - t):
+                    raise FMUError('{0}: step at {1} was discarded'.format(self.instanceName, t))
+            else:
+                x = self.getContinuousStates()
+                x += (grid[i] - t) * self.getDerivatives()
+                self.setTime(grid[i])
+                self.setContinuousStates(x)
+                enterEventMode = ctypes.c_int(0)
+                terminate = ctypes.c_int(0)
+                self._call('fmi2CompletedIntegratorStep', 1, ctypes.byref(enterEventMode), ctypes.byref(terminate))
+                previous = indicators
+                indicators = self.getEventIndicators()
+                timeEvent = info.nextEventTimeDefined and info.nextEventTime <= grid[i]
+                if enterEventMode.value or timeEvent or np.any(np.sign(indicators) != np.sign(previous)):
+                    self._call('fmi2EnterEventMode')
+                    info = self._eventIteration()
+                    self._call('fmi2EnterContinuousTimeMode')
+                    indicators = self.getEventIndicators()
+                if terminate.value or info.terminateSimulation:
+                    result = result[:, :i + 1]
+                    result[1:, i] = self.get(outputs)
+                    break
+            result[1:, i] = self.get(outputs)
+        self.terminate()
+        return result
@@ -0,0 +1,841 @@
+# -*- coding: utf-8 -*-
+"""
+Readers for simulation result files written by OpenModelica executables.
+
+The MAT v4 result format (matrices Aclass, name, description, dataInfo,
+data_1 and data_2) is decoded directly from the file with memory maps, so
+results can be extracted without a running omc session.
+"""
+
+__license__ = """
+ This file is part of OpenModelica.
+
+ Copyright (c) 1998-CurrentYear, Open Source Modelica Consortium (OSMC),
+ c/o Linköpings universitet, Department of Computer and Information Science,
+ SE-58183 Linköping, Sweden.
+
+ All rights reserved.
+
+ THIS PROGRAM IS PROVIDED UNDER THE TERMS OF THE BSD NEW LICENSE OR THE
+ GPL VERSION 3 LICENSE OR THE OSMC PUBLIC LICENSE (OSMC-PL) VERSION 1.2.
+ ANY USE, REPRODUCTION OR DISTRIBUTION OF THIS PROGRAM CONSTITUTES
+ RECIPIENT'S ACCEPTANCE OF THE OSMC PUBLIC LICENSE OR THE GPL VERSION 3,
+ ACCORDING TO RECIPIENTS CHOICE.
+
+ The OpenModelica software and the OSMC (Open Source Modelica Consortium)
+ Public License (OSMC-PL) are obtained from OSMC, either from the above
+ address, from the URLs: http://www.openmodelica.org or
+ http://www.ida.liu.se/projects/OpenModelica, and in the OpenModelica
+ distribution. GNU version 3 is obtained from:
+ http://www.gnu.org/copyleft/gpl.html. The New BSD License is obtained from:
+ http://www.opensource.org/licenses/BSD-3-Clause.
+
+ This program is distributed WITHOUT ANY WARRANTY; without even the implied
+ warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE, EXCEPT AS
+ EXPRESSLY SET FORTH IN THE BY RECIPIENT SELECTED SUBSIDIARY LICENSE
+ CONDITIONS OF OSMC-PL.
+"""
+
+import os
+import re
+import json
+import zlib
+import bisect
+import time
+import shutil
+import struct
+
+import numpy as np
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# MAT v4 precision digit -> numpy type
+_matTypes = {0: 'f8', 1: 'f4', 2: 'i4', 3: 'i2', 4: 'u2', 5: 'u1'}
+
+# number of blocks of one decimation level merged into one block of the next level
+PYRAMID_FACTOR = 4
+
+
+class MatHeader(object):
+    """Location and layout of one matrix in a MAT v4 file."""
+
+    def __init__(self, name, dtype, rows, cols, offset, text):
+        self.name = name
+        self.dtype = dtype
+        self.rows = rows
+        self.cols = cols
+        self.offset = offset
+        self.text = text
+
+    @property
+    def size(self):
+        return self.rows * self.cols * self.dtype.itemsize
+
+
+def readMatHeaders(fileName):
+    """
+    Scans a MAT v4 file and returns a dict of matrix name -> MatHeader.
+    The data itself is not read. A trailing data_2 matrix that is still
+    being written is truncated to the number of complete columns on disk.
+    """
+    headers = {}
+    fileSize = os.path.getsize(fileName)
+    with open(fileName, 'rb') as f:
+        offset = 0
+        while offset + 20 <= fileSize:
+            f.seek(offset)
+            raw = f.read(20)
+            endian = '<'
+            (mopt, rows, cols, imagf, namelen) = struct.unpack('<5i', raw)
+            if mopt < 0 or mopt > 9999:
+                endian = '>'
+                (mopt, rows, cols, imagf, namelen) = struct.unpack('>5i', raw)
+            if mopt // 1000 > 1 or (mopt // 100) % 10 != 0 or namelen <= 0:
+                raise ValueError('{0}: not a MAT v4 file (offset {1})'.format(fileName, offset))
+            precision = (mopt // 10) % 10
+            if precision not in _matTypes:
+                raise ValueError('{0}: unsupported MAT v4 precision {1}'.format(fileName, precision))
+            dtype = np.dtype(endian + _matTypes[precision])
+            name = _decode(f.read(namelen)).rstrip('\0')
+            dataOffset = offset + 20 + namelen
+            header = MatHeader(name, dtype, rows, cols, dataOffset, mopt % 10 == 1)
+            if imagf:
+                raise ValueError('{0}: complex matrix {1} is not supported'.format(fileName, name))
+            if dataOffset + header.size > fileSize or (name == 'data_2' and cols == 0):
+                # result file of a running simulation: keep the complete columns only
+                rowSize = rows * dtype.itemsize
+                header.cols = (fileSize - dataOffset) // rowSize if rowSize else 0
+            headers[name] = header
+            offset = dataOffset + header.size
+    return headers
+
+
+def _decode(raw):
+    if not isinstance(raw, str):
+        raw = raw.decode('latin-1')
+    return raw
+
+
+class MatResult(object):
+    """
+    Memory-mapped reader for an OpenModelica MAT v4 result file.
+
+    >>> res = MatResult('BouncingBall_res.mat')
+    >>> (time, h) = res.getVariables(['time', 'h'])
+
+    Aliases share the column of the variable they alias; negated aliases
+    are returned with their sign flipped. Parameters (data_1) are returned
+    broadcast to the length of the time vector.
+    """
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.headers = readMatHeaders(fileName)
+        for m in ('name', 'dataInfo', 'data_2'):
+            if m not in self.headers:
+                raise ValueError('{0}: matrix {1} is missing'.format(fileName, m))
+        self.transposed = True
+        if 'Aclass' in self.headers:
+            aclass = self._readStrings(self.headers['Aclass'], False)
+            self.transposed = len(aclass) < 4 or aclass[3] != 'binNormal'
+        self.names = self._readStrings(self.headers['name'], self.transposed)
+        info = self._map(self.headers['dataInfo'])
+        self.dataInfo = np.array(info.T if not self.transposed else info, dtype=np.int64)
+        self._index = dict((n, i) for (i, n) in enumerate(self.names))
+        self._data1 = self._map(self.headers['data_1']) if 'data_1' in self.headers else None
+        self._data2 = self._map(self.headers['data_2'])
+        self._pyramids = {}
+
+    def _map(self, header):
+        # returns the matrix as a (columns, rows) view when transposed, i.e. one row per time point
+        if header.size == 0:
+            return np.zeros((header.cols, header.rows), dtype=header.dtype)
+        data = np.memmap(self.fileName, dtype=header.dtype, mode='r', offset=header.offset,
+                         shape=(header.cols, header.rows))
+        if not self.transposed and header.name.startswith('data_'):
+            return data.T
+        return data
+
+    def _readStrings(self, header, transposed):
+        data = np.memmap(self.fileName, dtype=header.dtype, mode='r', offset=header.offset,
+                         shape=(header.cols, header.rows)) if header.size else np.zeros((0, 0), 'u1')
+        if not transposed:
+            data = data.T
+        chars = np.asarray(data, dtype='u1')
+        return [_decode(row.tostring()).rstrip('\0').rstrip() for row in chars]
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __len__(self):
+        return self._data2.shape[0]
+
+    def close(self):
+        self._data1 = None
+        self._data2 = None
+        self._pyramids = {}
+
+    def _columnData(self, column):
+        # (mapped) values of a data_2 column, column 0 holds the time
+        return self._data2[:, column]
+
+    def _parameterValue(self, column):
+        return self._data1[0, column]
+
+    @property
+    def time(self):
+        return np.array(self._columnData(0), dtype=np.float64)
+
+    def timeSpan(self):
+        """Returns the first and last time stored in the file."""
+        if len(self) == 0:
+            return (None, None)
+        time = self._columnData(0)
+        return (float(time[0]), float(time[-1]))
+
+    def timeRange(self, start=None, stop=None):
+        """
+        Returns the row range (first, last) holding start <= time <= stop.
+        Uses a binary search on the mapped time column, so only O(log n)
+        samples are read.
+        """
+        time = self._columnData(0)
+        first = 0 if start is None else bisect.bisect_left(time, start)
+        last = len(time) if stop is None else bisect.bisect_right(time, stop)
+        return (first, max(first, last))
+
+    def _column(self, name):
+        if name not in self._index:
+            raise KeyError(name)
+        (matrix, index) = self.dataInfo[self._index[name]][:2]
+        return (matrix == 1, abs(index) - 1, index < 0)
+
+    def getVariable(self, name, first=0, last=None):
+        """
+        Returns the rows first:last of a variable. A float64 column that is
+        not negated is returned as a read-only view of the mapped file,
+        without a copy; other columns are converted into a new array.
+        """
+        (isParameter, column, negated) = self._column(name)
+        last = len(self) if last is None else last
+        if isParameter:
+            value = np.full(max(0, last - first), self._parameterValue(column), dtype=np.float64)
+        else:
+            data = self._columnData(column)[first:last]
+            if data.dtype == np.float64 and not negated:
+                return np.asarray(data)
+            value = np.array(data, dtype=np.float64)
+        if negated:
+            value = np.negative(value, out=value)
+        return value
+
+    def getVariables(self, varList, first=0, last=None):
+        return [self.getVariable(v, first, last) for v in varList]
+
+    def _pyramid(self, column):
+        # min/max decimation levels of a data_2 column, level k has blocks of PYRAMID_FACTOR**(k+1) rows
+        if column not in self._pyramids:
+            values = np.array(self._columnData(column), dtype=np.float64)
+            levels = []
+            while len(values) > 1:
+                starts = np.arange(0, len(values), PYRAMID_FACTOR)
+                if levels:
+                    (mins, maxs) = (np.minimum.reduceat(levels[-1][0], starts), np.maximum.reduceat(levels[-1][1], starts))
+                else:
+                    (mins, maxs) = (np.minimum.reduceat(values, starts), np.maximum.reduceat(values, starts))
+                levels.append((mins, maxs))
+                values = mins
+            self._pyramids[column] = levels
+        return self._pyramids[column]
+
+    def getDecimated(self, varList, first=0, last=None, maxPoints=1000):
+        """
+        Returns the rows first:last of the variables in varList reduced to
+        at most maxPoints samples. Every block of rows is represented by its
+        minimum followed by its maximum (for time: first and last sample of
+        the block), so peaks survive the reduction. Blocks are taken from a
+        min/max pyramid that is built once per variable and cached, hence a
+        query costs O(maxPoints) once the pyramid exists. Blocks at the
+        window edges may extend slightly beyond first:last. maxPoints must be
+        at least 2.
+        """
+        if maxPoints < 2:
+            raise ValueError('maxPoints must be at least 2, got {0}'.format(maxPoints))
+        last = len(self) if last is None else last
+        if last - first <= maxPoints:
+            return self.getVariables(varList, first, last)
+        # the blocks covering first:last, including the partial ones at the edges, must fit;
+        # the top level is a single block, so the search ends there at the latest
+        blockSize = PYRAMID_FACTOR
+        level = 0
+        while (-(-last // blockSize) - first // blockSize) * 2 > maxPoints:
+            blockSize *= PYRAMID_FACTOR
+            level += 1
+        (b0, b1) = (first // blockSize, -(-last // blockSize))
+        result = []
+        for v in varList:
+            (isParameter, column, negated) = self._column(v)
+            if isParameter:
+                result.append(np.full(2 * (b1 - b0), self._parameterValue(column), dtype=np.float64) * (-1 if negated else 1))
+                continue
+            (mins, maxs) = self._pyramid(column)[level]
+            (mins, maxs) = (mins[b0:b1], maxs[b0:b1])
+            if negated:
+                (mins, maxs) = (-maxs, -mins)
+            value = np.empty(2 * len(mins), dtype=np.float64)
+            value[0::2] = mins
+            value[1::2] = maxs
+            result.append(value)
+        return result
+
+
+def readMatResult(fileName, varList):
+    """Returns the variables of varList as a (len(varList), ntime) float64 array."""
+    res = MatResult(fileName)
+    try:
+        return np.array(res.getVariables(varList))
+    finally:
+        res.close()
+
+
+def resample(results, grid, varList=None, method='linear'):
+    """
+    Resamples many results onto the common time grid in one vectorized
+    pass and returns a dense (runs, len(grid), variables) float64 array.
+
+    Every item of results is either a result file name, whose 'time' and
+    varList columns are read, or an array with time as its first row and
+    one row per variable after it, as returned by
+    ModelicaSystem.getSolutions(['time', ...]). Runs may have different
+    time vectors. At events, where a time stamp is repeated, the value
+    after the event is used (right-continuous). Outside the time span of
+    a run its first or last value is held. method is 'linear' or
+    'previous' (zero-order hold).
+    """
+    grid = np.asarray(grid, dtype=np.float64)
+    runs = []
+    for r in results:
+        if isinstance(r, str):
+            if varList is None:
+                raise ValueError('varList is needed to read result files')
+            r = readMatResult(r, ['time'] + list(varList))
+        runs.append(np.asarray(r, dtype=np.float64))
+    nVars = set(len(r) - 1 for r in runs)
+    if len(nVars) > 1:
+        raise ValueError('all results need the same variables')
+    nVars = nVars.pop() if nVars else 0
+    result = np.full((len(runs), len(grid), nVars), np.nan)
+    # runs without samples stay nan
+    filled = [i for (i, r) in enumerate(runs) if r.shape[1] > 0]
+    if not filled or not len(grid):
+        return result
+    runs = [runs[i] for i in filled]
+    lengths = np.array([r.shape[1] for r in runs], dtype=np.int64)
+    ends = np.cumsum(lengths)
+    time = np.concatenate([r[0] for r in runs])
+    values = np.concatenate([r[1:].T for r in runs])
+    # (run, time) keys sort lexicographically as complex numbers, so one binary search over
+    # all runs finds the last sample at or before every grid point of every run
+    keys = np.repeat(np.arange(len(runs), dtype=np.float64), lengths) + 1j * time
+    queries = (np.arange(len(runs), dtype=np.float64)[:, np.newaxis] + 1j * grid[np.newaxis, :]).ravel()
+    index = np.searchsorted(keys, queries, side='right') - 1
+    last = np.repeat(ends - 1, len(grid))
+    index = np.clip(index, np.repeat(ends - lengths, len(grid)), last)
+    following = np.minimum(index + 1, last)
+    weight = np.zeros(len(index))
+    if method == 'linear':
+        dt = time[following] - time[index]
+        moving = dt > 0
+        weight[moving] = np.clip((np.tile(grid, len(runs))[moving] - time[index][moving]) / dt[moving], 0.0, 1.0)
+    elif method != 'previous':
+        raise ValueError('unknown method {0}'.format(method))
+    sampled = values[index] * (1.0 - weight)[:, np.newaxis] + values[following] * weight[:, np.newaxis]
+    result[filled] = sampled.reshape((len(runs), len(grid), nVars))
+    return result
+
+
+def _followMat(fileName, varList, blockRows):
+    # yields blocks of new rows of a growing binTrans MAT file, None while there are none
+    res = None
+    while res is None:
+        try:
+            if os.path.exists(fileName) and 'data_2' in readMatHeaders(fileName):
+                res = MatResult(fileName)
+        except (ValueError, IOError, struct.error):
+            # headers still being written
+            pass
+        if res is None:
+            yield None
+    if not res.transposed:
+        raise ValueError('{0}: only binTrans result files can be followed'.format(fileName))
+    columns = [res._column(v) for v in varList]
+    header = res.headers['data_2']
+    rowSize = header.rows * header.dtype.itemsize
+    position = 0
+    with open(fileName, 'rb') as f:
+        while True:
+            count = min((os.path.getsize(fileName) - header.offset) // rowSize - position, blockRows)
+            if count <= 0:
+                yield None
+                continue
+            f.seek(header.offset + position * rowSize)
+            block = np.frombuffer(f.read(count * rowSize), dtype=header.dtype).reshape((count, header.rows))
+            position += count
+            values = np.empty((len(varList), count), dtype=np.float64)
+            for (j, (isParameter, column, negated)) in enumerate(columns):
+                values[j] = res._parameterValue(column) if isParameter else block[:, column]
+                if negated:
+                    np.negative(values[j], out=values[j])
+            yield values
+
+
+def _followCsv(fileName, varList, blockRows):
+    # yields blocks of new rows of a growing csv result file, None while there are none
+    while not os.path.exists(fileName):
+        yield None
+    with open(fileName, 'r') as f:
+        (partial, lines, index) = ('', [], None)
+        while True:
+            if len(lines) < blockRows:
+                data = f.read(1 << 20)
+                if data:
+                    lines.extend((partial + data).split('\n'))
+                    partial = lines.pop()
+            if index is None and lines:
+                names = [n.strip().strip('"') for n in lines.pop(0).split(',')]
+                index = [names.index(v) if v in names else None for v in varList]
+                if None in index:
+                    raise KeyError(varList[index.index(None)])
+            # rows written by OpenModelica end with a ','
+            rows = [r.rstrip().rstrip(',').split(',') for r in lines[:blockRows] if r.strip()]
+            del lines[:blockRows]
+            if index is None or not rows:
+                yield None
+                continue
+            yield np.array(rows, dtype=np.float64)[:, index].T
+
+
+def followResult(fileName, varList, done=None, blockRows=4096, interval=0.05):
+    """
+    Follows a result file (MAT binTrans or csv) while a simulation
+    appends to it and yields the new rows of the variables in varList as
+    (len(varList), rows) arrays of at most blockRows rows, so memory does
+    not grow with the length of the result. done is a function returning
+    True once the writer has finished; the generator then reads the rows
+    still left and ends. Without done it ends at the current end of file.
+    """
+    finished = done or (lambda: True)
+    reader = (_followCsv if fileName.endswith('.csv') else _followMat)(fileName, varList, blockRows)
+    try:
+        while True:
+            # checked before reading, so rows written just before the writer finished are read as well
+            stopping = finished()
+            block = next(reader)
+            if block is not None:
+                yield block
+            elif stopping:
+                return
+            else:
+                time.sleep(interval)
+    finally:
+        reader.close()
+
+
+def columnStoreDir(fileName):
+    """Returns the directory of the columnar store of a result file."""
+    return os.path.splitext(fileName)[0] + '_columns'
+
+
+def isColumnStoreCurrent(storeDir, fileName):
+    """
+    True if storeDir holds a columnar store written from fileName as it
+    is now, or from a result file that has been removed since.
+    """
+    metadataFile = os.path.join(storeDir, 'metadata.json')
+    if not os.path.exists(metadataFile):
+        return False
+    if not os.path.exists(fileName):
+        return True
+    with open(metadataFile, 'r') as f:
+        source = json.load(f)['source']
+    stat = os.stat(fileName)
+    return source['size'] == stat.st_size and source['mtime'] == stat.st_mtime
+
+
+def _codec(compression):
+    if compression is None:
+        return None
+    if compression == 'zlib':
+        return (zlib.compress, zlib.decompress)
+    if compression == 'lzma':
+        if lzma is None:
+            raise ValueError('lzma compression needs the lzma module (backports.lzma on Python 2)')
+        return (lzma.compress, lzma.decompress)
+    raise ValueError('unknown compression {0}'.format(compression))
+
+
+def writeColumnStore(fileName, storeDir, compression=None, chunkRows=65536):
+    """
+    Converts the MAT result file fileName into a columnar store in
+    storeDir: metadata.json (names, dataInfo, row count and the size and
+    modification time of the source), data_1.npy with the parameter
+    values and one data_2_<column>.npy per column of data_2, column 0
+    being the time. With compression 'zlib' or 'lzma' every column is
+    instead stored as a sequence of compressed chunks of chunkRows rows.
+    The source is read chunkRows rows at a time and the store is written
+    next to storeDir and renamed into place when complete.
+    """
+    codec = _codec(compression)
+    res = MatResult(fileName)
+    try:
+        stat = os.stat(fileName)
+        (rows, columns) = res._data2.shape
+        dtype = res._data2.dtype
+        tmp = '{0}.tmp-{1}'.format(storeDir.rstrip(os.sep), os.getpid())
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        data1 = res._data1
+        np.save(os.path.join(tmp, 'data_1.npy'), np.array(data1[0] if data1 is not None and data1.size else [], dtype=np.float64))
+        chunks = [[] for _ in range(columns)]
+        if codec is None:
+            outputs = [np.lib.format.open_memmap(os.path.join(tmp, 'data_2_{0}.npy'.format(c)), 'w+', dtype, (rows,))
+                       for c in range(columns)]
+        for start in range(0, rows, chunkRows):
+            block = np.array(res._data2[start:start + chunkRows])
+            for c in range(columns):
+                if codec is None:
+                    outputs[c][start:start + len(block)] = block[:, c]
+                    continue
+                data = codec[0](np.ascontiguousarray(block[:, c]).tostring())
+                with open(os.path.join(tmp, 'data_2_{0}.{1}'.format(c, compression)), 'ab') as f:
+                    f.write(data)
+                chunks[c].append(len(data))
+        if codec is None:
+            for out in outputs:
+                out.flush()
+            del outputs
+        metadata = {'names': res.names, 'dataInfo': res.dataInfo.tolist(), 'rows': rows, 'dtype': dtype.str,
+                    'compression': compression, 'chunks': chunks if codec is not None else None,
+                    'source': {'size': stat.st_size, 'mtime': stat.st_mtime}}
+        with open(os.path.join(tmp, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f)
+    finally:
+        res.close()
+    shutil.rmtree(storeDir, ignore_errors=True)
+    os.rename(tmp, storeDir)
+    return storeDir
+
+
+class ColumnStore(MatResult):
+    """
+    Reader for a columnar store written by writeColumnStore(), with the
+    interface of MatResult. Uncompressed columns are memory-mapped on
+    first use, so reading a variable touches only its own file and
+    getVariable() returns contiguous views of it without copies.
+    Compressed columns are decompressed as a whole on first use.
+    """
+
+    def __init__(self, storeDir):
+        self.fileName = storeDir
+        with open(os.path.join(storeDir, 'metadata.json'), 'r') as f:
+            self.metadata = json.load(f)
+        self.transposed = True
+        self.names = [str(n) for n in self.metadata['names']]
+        self.dataInfo = np.array(self.metadata['dataInfo'], dtype=np.int64)
+        self._index = dict((n, i) for (i, n) in enumerate(self.names))
+        self._data1 = np.load(os.path.join(storeDir, 'data_1.npy'))[np.newaxis]
+        self._columns = {}
+        self._pyramids = {}
+
+    def __len__(self):
+        return self.metadata['rows']
+
+    def close(self):
+        self._columns = {}
+        self._pyramids = {}
+
+    def _columnData(self, column):
+        if column not in self._columns:
+            compression = self.metadata['compression']
+            if compression is None:
+                self._columns[column] = np.load(os.path.join(self.fileName, 'data_2_{0}.npy'.format(column)), mmap_mode='r')
+            else:
+                decompress = _codec(compression)[1]
+                with open(os.path.join(self.fileName, 'data_2_{0}.{1}'.format(column, compression)), 'rb') as f:
+                    data = b''.join(decompress(f.read(size)) for size in self.metadata['chunks'][column])
+                self._columns[column] = np.frombuffer(data, dtype=np.dtype(str(self.metadata['dtype'])))
+        return self._columns[column]
+
+
+_linearDimension = re.compile(r'parameter\s+Integer\s+([nmp])\s*=\s*(\d+)')
+_linearMatrix = re.compile(r'parameter\s+Real\s+([ABCD])\s*\[\s*\w+\s*,\s*\w+\s*\]\s*=\s*(\[.*?\]|zeros\s*\(.*?\)|\{.*?\})\s*;', re.S)
+_linearName = re.compile(r"Real\s+'?([xuy])_(.*?)'?\s*=\s*\1\s*\[\s*(\d+)\s*\]\s*;")
+
+
+def _parseLinearMatrix(text, shape):
+    text = text.strip()
+    if text.startswith('zeros') or shape[0] * shape[1] == 0:
+        return np.zeros(shape)
+    rows = [r for r in text.strip('[]{} \t\n').split(';') if r.strip()]
+    values = [[float(v) for v in r.replace('{', ' ').replace('}', ' ').split(',')] for r in rows]
+    return np.array(values, dtype=np.float64).reshape(shape)
+
+
+def readLinearModel(fileName):
+    """
+    Reads the linear_<model>.mo file written by a simulation executable
+    run with -l=<time> and returns (A, B, C, D, stateNames, inputNames,
+    outputNames) with the matrices as float64 arrays.
+    """
+    with open(fileName, 'r') as f:
+        text = f.read()
+    dims = dict((k, int(v)) for (k, v) in _linearDimension.findall(text))
+    (n, m, p) = (dims.get('n', 0), dims.get('m', 0), dims.get('p', 0))
+    shapes = {'A': (n, n), 'B': (n, m), 'C': (p, n), 'D': (p, m)}
+    matrices = dict((k, np.zeros(shapes[k])) for k in shapes)
+    for (k, body) in _linearMatrix.findall(text):
+        matrices[k] = _parseLinearMatrix(body, shapes[k])
+    names = {'x': [None] * n, 'u': [None] * m, 'y': [None] * p}
+    for (kind, name, index) in _linearName.findall(text):
+        names[kind][int(index) - 1] = name
+    return (matrices['A'], matrices['B'], matrices['C'], matrices['D'], names['x'], names['u'], names['y'])
+
+
+_statsTimer = re.compile(r'\|\s*([0-9.]+(?:e[-+]?\d+)?)s\s+(?:\[\s*[0-9.]+%\]\s+)?(\S.*?)\s*$')
+_statsCount = re.compile(r'\|\s*(\d+)\s+([a-zA-Z].*?)\s*$')
+_statsSolver = re.compile(r'solver:\s*(\S+)')
+
+
+class SimulationStats(object):
+    """
+    Statistics printed by a simulation executable run with -lv=LOG_STATS.
+
+    timers maps the timer names of the log (e.g. 'initialization',
+    'simulation', 'total') to seconds, counts maps the counter names
+    (e.g. 'steps taken', 'state events') to integers.
+    """
+
+    def __init__(self, timers=None, counts=None, solver=None, wallTime=None):
+        self.timers = timers or {}
+        self.counts = counts or {}
+        self.solver = solver
+        self.wallTime = wallTime
+
+    @property
+    def initTime(self):
+        return self.timers.get('pre-initialization', 0.0) + self.timers.get('initialization', 0.0)
+
+    @property
+    def integrationTime(self):
+        return self.timers.get('simulation')
+
+    @property
+    def outputTime(self):
+        return self.timers.get('creating output-file')
+
+    @property
+    def totalTime(self):
+        return self.timers.get('total')
+
+    @property
+    def steps(self):
+        return self.counts.get('steps taken')
+
+    @property
+    def functionEvaluations(self):
+        return self.counts.get('calls of functionODE')
+
+    @property
+    def jacobianEvaluations(self):
+        return self.counts.get('evaluations of jacobian')
+
+    @property
+    def stateEvents(self):
+        return self.counts.get('state events')
+
+    @property
+    def timeEvents(self):
+        return self.counts.get('time events')
+
+    @property
+    def rejectedSteps(self):
+        failures = [self.counts.get(c) for c in ('error test failures', 'convergence test failures')]
+        if all(f is None for f in failures):
+            return None
+        return sum(f for f in failures if f is not None)
+
+    def asDict(self):
+        names = ['solver', 'wallTime', 'initTime', 'integrationTime', 'outputTime', 'totalTime', 'steps',
+                 'functionEvaluations', 'jacobianEvaluations', 'stateEvents', 'timeEvents', 'rejectedSteps']
+        return dict((n, getattr(self, n)) for n in names)
+
+    def __repr__(self):
+        return 'SimulationStats({0})'.format(', '.join('{0}={1}'.format(k, v) for (k, v) in sorted(self.asDict().items())))
+
+
+def parseSimulationStats(lines, wallTime=None):
+    """Parses the ### STATISTICS ### block of a simulation log (a string or an iterable of lines)."""
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+    stats = SimulationStats(wallTime=wallTime)
+    inStats = False
+    for line in lines:
+        if '### STATISTICS ###' in line:
+            inStats = True
+            continue
+        if not inStats:
+            continue
+        if not line.startswith('|'):
+            # end of the indented block
+            inStats = False
+            continue
+        solver = _statsSolver.search(line)
+        if solver:
+            stats.solver = solver.group(1)
+            continue
+        timer = _statsTimer.search(line)
+        if timer:
+            stats.timers[timer.group(2)] = float(timer.group(1))
+            continue
+        count = _statsCount.search(line)
+        if count:
+            stats.counts[count.group(2)] = int(count.group(1))
+    return stats
+
+
+def readProfile(profFile, infoFile=None):
+    """
+    Reads the <prefix>_prof.json written by an executable built with
+    --profiling and returns its profiled equation blocks ranked by time,
+    as a list of dicts with id, time, ncall, maxTime and fraction (of the
+    total time). With the <prefix>_info.json of the build, each block also
+    gets the variables it defines, its section, tag and equation text.
+    """
+    with open(profFile, 'r') as f:
+        profile = json.load(f)
+    equations = {}
+    if infoFile is not None and os.path.exists(infoFile):
+        with open(infoFile, 'r') as f:
+            for eq in json.load(f).get('equations', []):
+                equations[eq.get('eqIndex')] = eq
+    totalTime = profile.get('totalTime') or 0.0
+    blocks = []
+    for block in profile.get('profileBlocks', []):
+        eq = equations.get(block['id'], {})
+        blocks.append({'id': block['id'], 'time': block.get('time', 0.0), 'ncall': block.get('ncall', 0),
+                       'maxTime': block.get('maxTime', 0.0),
+                       'fraction': block.get('time', 0.0) / totalTime if totalTime else None,
+                       'defines': eq.get('defines', []), 'section': eq.get('section'), 'tag': eq.get('tag'),
+                       'equation': ' '.join(eq.get('equation', []))})
+    blocks.sort(key=lambda b: (-b['time'], -b['ncall']))
+    return blocks
+
+
+class RunningStatistics(object):
+    """
+    Element-wise count, mean, variance, minimum and maximum of a stream of
+    equally shaped arrays (Welford's algorithm). Memory does not depend on
+    the number of arrays added.
+    """
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self._m2 = np.zeros(shape)
+        self.min = np.full(shape, np.inf)
+        self.max = np.full(shape, -np.inf)
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (values - self.mean)
+        np.minimum(self.min, values, out=self.min)
+        np.maximum(self.max, values, out=self.max)
+
+    @property
+    def variance(self):
+        """Sample variance (nan for less than two arrays)."""
+        if self.count < 2:
+            return np.full(self.mean.shape, np.nan)
+        return self._m2 / (self.count - 1)
+
+    @property
+    def std(self):
+        return np.sqrt(self.variance)
+
+
+class StreamingQuantiles(object):
+    """
+    Element-wise estimates of the quantiles levels of a stream of equally
+    shaped arrays with the P-square algorithm (Jain and Chlamtac, 1985):
+    five markers per level and element, updated by piecewise-parabolic
+    interpolation. Memory does not depend on the number of arrays added.
+    """
+
+    def __init__(self, shape, levels=(0.05, 0.5, 0.95)):
+        self.levels = np.asarray(levels, dtype=np.float64)
+        self.count = 0
+        p = self.levels.reshape((-1, 1) + (1,) * len(shape))
+        # marker increments and initial desired positions, one row per level
+        self._dn = np.concatenate([np.zeros_like(p), p / 2, p, (1 + p) / 2, np.ones_like(p)], axis=1)
+        self._initial = np.concatenate([np.ones_like(p), 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, np.full_like(p, 5.0)], axis=1)
+        self._first = np.empty((5,) + tuple(shape))
+        self._q = None
+        self._n = None
+        self._desired = None
+
+    def add(self, values):
+        x = np.asarray(values, dtype=np.float64)
+        if self.count < 5:
+            self._first[self.count] = x
+            self.count += 1
+            if self.count == 5:
+                markers = np.sort(self._first, axis=0)
+                nLevels = len(self.levels)
+                self._q = np.repeat(markers[np.newaxis], nLevels, axis=0)
+                self._n = np.ones_like(self._q) * np.arange(1.0, 6.0).reshape((1, 5) + (1,) * x.ndim)
+                self._desired = self._initial * np.ones_like(self._q)
+            return
+        self.count += 1
+        q = self._q
+        n = self._n
+        np.minimum(q[:, 0], x, out=q[:, 0])
+        np.maximum(q[:, 4], x, out=q[:, 4])
+        # cell k of x: q[k] <= x < q[k+1], markers above it move up by one
+        k = (x >= q[:, 1]).astype(np.int8) + (x >= q[:, 2]) + (x >= q[:, 3])
+        for i in range(1, 5):
+            n[:, i] += k < i
+        self._desired += self._dn
+        for i in range(1, 4):
+            d = self._desired[:, i] - n[:, i]
+            move = ((d >= 1) & (n[:, i + 1] - n[:, i] > 1)) | ((d <= -1) & (n[:, i - 1] - n[:, i] < -1))
+            if not move.any():
+                continue
+            d = np.sign(d) * move
+            nLow = n[:, i] - n[:, i - 1]
+            nHigh = n[:, i + 1] - n[:, i]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                parabolic = q[:, i] + d / (n[:, i + 1] - n[:, i - 1]) * (
+                    (nLow + d) * (q[:, i + 1] - q[:, i]) / nHigh + (nHigh - d) * (q[:, i] - q[:, i - 1]) / nLow)
+                linear = np.where(d > 0, q[:, i] + (q[:, i + 1] - q[:, i]) / nHigh,
+                                  q[:, i] - (q[:, i - 1] - q[:, i]) / -nLow)
+            inside = (q[:, i - 1] < parabolic) & (parabolic < q[:, i + 1])
+            q[:, i] = np.where(move, np.where(inside, parabolic, linear), q[:, i])
+            n[:, i] += d
+
+    @property
+    def quantiles(self):
+        """Estimates with the levels along the first axis (exact for up to five arrays)."""
+        if self.count == 0:
+            return np.full((len(self.levels),) + self._first.shape[1:], np.nan)
+        if self.count < 5:
+            return np.array([np.percentile(self._first[:self.count], 100 * p, axis=0) for p in self.levels])
+        return self._q[:, 2].copy()
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+"""
+Interactive stepping of simulations for closed-loop use.
+
+A stepping session keeps a simulation alive between control intervals:
+inputs are pushed, the model is advanced by dt and outputs are read back
+without starting a process, writing an input CSV or re-initializing the
+model for every interval.
+
+SteppingSession speaks a line protocol over TCP, one request per line,
+answered by one line starting with OK or ERR:
+
+    NAMES                     -> OK name ...      (variables of the model)
+    SET name value ...        -> OK
+    STEP dt                   -> OK time          (time after the step)
+    GET name ...              -> OK value ...
+    TIME                      -> OK time
+    QUIT                      -> OK               (ends the connection)
+
+SET checks every name before it applies any value. exchange() pipelines
+SET, STEP and GET, so one control interval costs a single network round
+trip. The lines of a pipelined request after the first are sent with a
+leading '+': once a line of the request has failed, the server skips
+them and answers each with ERR, so a rejected input never advances the
+model. SteppingServer serves the protocol for a
+Python model object, e.g. StateSpaceModel, and is the stand-in used to
+test controllers without a simulation executable.
+
+OPCUASession offers the same methods for the embedded OPC UA server of
+an OpenModelica executable (started with -embeddedServer=opc-ua, see
+ModelicaSystem.startStepping()) and needs the opcua package.
+"""
+
+__license__ = """
+ This file is part of OpenModelica.
+
+ Copyright (c) 1998-CurrentYear, Open Source Modelica Consortium (OSMC),
+ c/o Linköpings universitet, Department of Computer and Information Science,
+ SE-58183 Linköping, Sweden.
+
+ All rights reserved.
+
+ THIS PROGRAM IS PROVIDED UNDER THE TERMS OF THE BSD NEW LICENSE OR THE
+ GPL VERSION 3 LICENSE OR THE OSMC PUBLIC LICENSE (OSMC-PL) VERSION 1.2.
+ ANY USE, REPRODUCTION OR DISTRIBUTION OF THIS PROGRAM CONSTITUTES
+ RECIPIENT'S ACCEPTANCE OF THE OSMC PUBLIC LICENSE OR THE GPL VERSION 3,
+ ACCORDING TO RECIPIENTS CHOICE.
+
+ The OpenModelica software and the OSMC (Open Source Modelica Consortium)
+ Public License (OSMC-PL) are obtained from OSMC, either from the above
+ address, from the URLs: http://www.openmodelica.org or
+ http://www.ida.liu.se/projects/OpenModelica, and in the OpenModelica
+ distribution. GNU version 3 is obtained from:
+ http://www.gnu.org/copyleft/gpl.html. The New BSD License is obtained from:
+ http://www.opensource.org/licenses/BSD-3-Clause.
+
+ This program is distributed WITHOUT ANY WARRANTY; without even the implied
+ warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE, EXCEPT AS
+ EXPRESSLY SET FORTH IN THE BY RECIPIENT SELECTED SUBSIDIARY LICENSE
+ CONDITIONS OF OSMC-PL.
+"""
+
+
+import time
+import socket
+import threading
+
+import numpy as np
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+try:
+    import opcua
+except ImportError:
+    opcua = None
+
+
+class SteppingError(Exception):
+    """Raised for an ERR reply or a broken connection."""
+
+
+def _formatValue(value):
+    return repr(float(value))
+
+
+def _decodeLine(line):
+    return line if isinstance(line, str) else line.decode('ascii')
+
+
+class SteppingSession(object):
+    """
+    Client of the stepping line protocol.
+
+    >>> with SteppingSession('localhost', 4850) as s:
+    ...     y = s.exchange({'u': 1.0}, 0.1, ['y'])
+    """
+
+    def __init__(self, host='127.0.0.1', port=4850, timeout=10.0):
+        self.socket = socket.create_connection((host, port), timeout)
+        # requests are small and latency bound
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._reader = self.socket.makefile('rb')
+        self.time = None
+
+    def _send(self, lines):
+        self.socket.sendall(''.join(l + '\n' for l in lines).encode('ascii'))
+
+    def _reply(self):
+        """Returns the fields of the next reply, or a SteppingError for an ERR reply."""
+        line = _decodeLine(self._reader.readline())
+        if not line:
+            raise SteppingError('connection closed by the server')
+        fields = line.split()
+        if not fields or fields[0] != 'OK':
+            return SteppingError(line.strip()[4:] or 'malformed reply')
+        return fields[1:]
+
+    def request(self, *lines):
+        """
+        Sends the request lines at once and returns the fields of every
+        reply. The server skips the lines after a failing one. All replies
+        are read before the first ERR is raised, so the session stays in
+        step with the server.
+        """
+        self._send(lines[:1] + tuple('+' + l for l in lines[1:]))
+        replies = [self._reply() for _ in lines]
+        for r in replies:
+            if isinstance(r, SteppingError):
+                raise r
+        return replies
+
+    def names(self):
+        return self.request('NAMES')[0]
+
+    def setInputs(self, inputs):
+        """inputs is a dict or a list of (name, value) pairs."""
+        items = inputs.items() if isinstance(inputs, dict) else inputs
+        self.request('SET ' + ' '.join('{0} {1}'.format(n, _formatValue(v)) for (n, v) in items))
+
+    def step(self, dt):
+        """Advances the model by dt and returns the new time."""
+        self.time = float(self.request('STEP ' + _formatValue(dt))[0][0])
+        return self.time
+
+    def get(self, names):
+        return np.array(self.request('GET ' + ' '.join(names))[0], dtype=np.float64)
+
+    def exchange(self, inputs, dt, outputs):
+        """
+        Sets inputs, advances by dt and returns outputs, in one round trip.
+        If an input is rejected, neither an input is set nor the model advanced.
+        """
+        items = inputs.items() if isinstance(inputs, dict) else inputs
+        lines = ['STEP ' + _formatValue(dt), 'GET ' + ' '.join(outputs)]
+        if items:
+            lines.insert(0, 'SET ' + ' '.join('{0} {1}'.format(n, _formatValue(v)) for (n, v) in items))
+        replies = self.request(*lines)
+        self.time = float(replies[-2][0])
+        return np.array(replies[-1], dtype=np.float64)
+
+    def close(self):
+        if self.socket is None:
+            return
+        try:
+            self.request('QUIT')
+        except (SteppingError, socket.error):
+            pass
+        self._reader.close()
+        self.socket.close()
+        self.socket = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+class StateSpaceModel(object):
+    """
+    Model object for SteppingServer: dx/dt = A x + B u, y = C x + D u,
+    integrated with classic Runge-Kutta substeps of at most maxStep, e.g.
+    built from the matrices of ModelicaSystem.linearizeBatch(). States
+    can be read and inputs written by name; outputs can be read.
+    """
+
+    def __init__(self, A, B, C, D, stateNames, inputNames, outputNames, x0=None, maxStep=1e-3):
+        (self.A, self.B, self.C, self.D) = [np.atleast_2d(np.asarray(m, dtype=np.float64)) for m in (A, B, C, D)]
+        self.stateNames = list(stateNames)
+        self.inputNames = list(inputNames)
+        self.outputNames = list(outputNames)
+        self.x = np.zeros(len(self.stateNames)) if x0 is None else np.array(x0, dtype=np.float64)
+        self.u = np.zeros(len(self.inputNames))
+        self.time = 0.0
+        self.maxStep = maxStep
+        self.names = self.stateNames + self.inputNames + self.outputNames
+
+    def set(self, name, value):
+        if name not in self.inputNames:
+            raise KeyError(name)
+        self.u[self.inputNames.index(name)] = value
+
+    def get(self, name):
+        if name in self.stateNames:
+            return self.x[self.stateNames.index(name)]
+        if name in self.inputNames:
+            return self.u[self.inputNames.index(name)]
+        if name not in self.outputNames:
+            raise KeyError(name)
+        return (self.C.dot(self.x) + self.D.dot(self.u))[self.outputNames.index(name)]
+
+    def step(self, dt):
+        n = max(1, int(np.ceil(dt / self.maxStep)))
+        h = dt / n
+        f = lambda x: self.A.dot(x) + self.B.dot(self.u)
+        for _ in range(n):
+            k1 = f(self.x)
+            k2 = f(self.x + h / 2 * k1)
+            k3 = f(self.x + h / 2 * k2)
+            k4 = f(self.x + h * k3)
+            self.x = self.x + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        self.time += dt
+        return self.time
+
+
+def _setValues(model, fields):
+    # applies all name value pairs or, if one of them is rejected, none
+    if len(fields) % 2:
+        raise ValueError('SET needs name value pairs')
+    items = [(name, float(value)) for (name, value) in zip(fields[0::2], fields[1::2])]
+    applied = []
+    try:
+        for (name, value) in items:
+            previous = model.get(name)
+            model.set(name, value)
+            applied.append((name, previous))
+    except Exception:
+        for (name, previous) in reversed(applied):
+            model.set(name, previous)
+        raise
+
+
+class _SteppingHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        model = self.server.model
+        lock = self.server.lock
+        failed = False
+        while True:
+            line = _decodeLine(self.rfile.readline())
+            if not line:
+                return
+            # '+' continues a pipelined request, skipped once a line of it has failed
+            continued = line.startswith('+')
+            if continued and failed:
+                self.wfile.write(b'ERR skipped after an earlier error of the request\n')
+                continue
+            failed = False
+            fields = line.lstrip('+').split()
+            command = fields[0].upper() if fields else ''
+            try:
+                with lock:
+                    if command == 'NAMES':
+                        reply = model.names
+                    elif command == 'SET':
+                        _setValues(model, fields[1:])
+                        reply = []
+                    elif command == 'STEP':
+                        reply = [_formatValue(model.step(float(fields[1])))]
+                    elif command == 'GET':
+                        reply = [_formatValue(model.get(name)) for name in fields[1:]]
+                    elif command == 'TIME':
+                        reply = [_formatValue(model.time)]
+                    elif command == 'QUIT':
+                        self.wfile.write(b'OK\n')
+                        return
+                    else:
+                        raise ValueError('unknown command {0}'.format(command))
+                out = ' '.join(['OK'] + [str(r) for r in reply])
+            except KeyError as e:
+                out = 'ERR unknown variable {0}'.format(e.args[0])
+                failed = True
+            except (ValueError, IndexError) as e:
+                out = 'ERR {0}'.format(e)
+                failed = True
+            self.wfile.write((out + '\n').encode('ascii'))
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class SteppingServer(object):
+    """
+    Serves the stepping line protocol for a model object with names,
+    time, set(name, value), get(name) and step(dt), in a background
+    thread. port 0 picks a free port, see address.
+    """
+
+    def __init__(self, model, host='127.0.0.1', port=0):
+        self.server = _ThreadingTCPServer((host, port), _SteppingHandler)
+        self.server.model = model
+        self.server.lock = threading.Lock()
+        self.address = self.server.server_address
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, excType, excValue, traceback):
+        self.stop()
+
+
+class OPCUASession(object):
+    """
+    Stepping session for the embedded OPC UA server of an OpenModelica
+    executable, with the methods of SteppingSession. The control nodes
+    (step, time) and the model variables are looked up by browse name
+    among the children of the Objects folder. A step advances the
+    executable by one stepSize of the simulation, so dt is rounded to a
+    multiple of stepSize. process is the SimulationRun of the executable,
+    cancelled by close(). Connecting and every step of the executable
+    must finish within timeout seconds.
+    """
+
+    def __init__(self, port=4841, stepSize=None, process=None, host='localhost', timeout=10.0):
+        if opcua is None:
+            raise SteppingError('the embedded OPC UA server needs the opcua package')
+        self.stepSize = stepSize
+        self.process = process
+        self.timeout = timeout
+        self.client = opcua.Client('opc.tcp://{0}:{1}'.format(host, port), timeout=timeout)
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.client.connect()
+                break
+            except (socket.error, opcua.ua.UaError):
+                if time.time() > deadline or (process is not None and process.done()):
+                    raise SteppingError('cannot connect to the OPC UA server on port {0}'.format(port))
+                time.sleep(0.05)
+        children = self.client.get_objects_node().get_children()
+        self.nodes = dict((n.get_browse_name().Name, n) for n in children)
+        self.time = self.nodes['time'].get_value()
+
+    def names(self):
+        return sorted(n for n in self.nodes if n not in ('run', 'step', 'time', 'enableStopTime', 'realTimeScalingFactor'))
+
+    def setInputs(self, inputs):
+        items = inputs.items() if isinstance(inputs, dict) else inputs
+        for (name, value) in items:
+            self.nodes[name].set_value(opcua.ua.DataValue(opcua.ua.Variant(float(value), opcua.ua.VariantType.Double)))
+
+    def step(self, dt):
+        steps = max(1, int(round(dt / self.stepSize))) if self.stepSize else 1
+        for _ in range(steps):
+            before = self.time
+            self.nodes['step'].set_value(True)
+            deadline = time.time() + self.timeout
+            while True:
+                self.time = self.nodes['time'].get_value()
+                if self.time > before:
+                    break
+                if self.process is not None and self.process.done():
+                    raise SteppingError('the simulation has ended at time {0}'.format(self.time))
+                if time.time() > deadline:
+                    raise SteppingError('the simulation did not advance from time {0} within {1} s'.format(before, self.timeout))
+                time.sleep(0.001)
+        return self.time
+
+    def get(self, names):
+        return np.array([self.nodes[n].get_value() for n in names], dtype=np.float64)
+
+    def exchange(self, inputs, dt, outputs):
+        self.setInputs(inputs)
+        self.step(dt)
+        return self.get(outputs)
+
+    def close(self):
+        if self.client is None:
+            return
+        try:
+            self.client.disconnect()
+        finally:
+            self.client = None
+            if self.process is not None:
+                self.process.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
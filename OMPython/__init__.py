@@ -57,8 +57,16 @@ import sys
 import time
 import logging
 import uuid
+import re
+import hashlib
 import subprocess
 import tempfile
+import shutil
+import threading
+import itertools
+import pickle
+import multiprocessing
+import multiprocessing.pool
 import pyparsing
 from distutils import spawn
 
@@ -75,7 +83,7 @@ if sys.platform == 'darwin':
     sys.path.append('/opt/openmodelica/lib/python2.7/site-packages/')
 
 # TODO: replace this with the new parser
-from OMPython import OMTypedParser, OMParser
+from OMPython import OMTypedParser, OMParser, OMResult, OMCache, OMStepping, OMFMU, OMExecutor
 
 # Logger Defined
 logger = logging.getLogger('OMCSession')
@@ -468,17 +476,382 @@ class Quantity:
         self.variability = variability
         self.causality = causality
 		
+class SimulationRun(object):
+    """
+    Handle of a running simulation executable, see ModelicaSystem.simulate(wait=False).
+    stdout and stderr of the executable are captured in logFile.
+    """
+
+    def __init__(self, cmd, cwd=None, logFile=None):
+        self.cmd = cmd
+        if logFile is None:
+            (fd, logFile) = tempfile.mkstemp(prefix='simulation_', suffix='.log')
+            os.close(fd)
+        self.logFile = logFile
+        self._log = open(self.logFile, 'w')
+        self.startTime = time.time()
+        self.endTime = None
+        self.timedOut = False
+        try:
+            self.process = subprocess.Popen(cmd, cwd=cwd, stdout=self._log, stderr=subprocess.STDOUT)
+        except OSError:
+            self._log.close()
+            raise
+
+    @property
+    def returncode(self):
+        return self.poll()
+
+    def poll(self):
+        """Returns the exit code, or None while the executable is running."""
+        returncode = self.process.poll()
+        if returncode is not None and self.endTime is None:
+            self.endTime = time.time()
+            self._log.close()
+        return returncode
+
+    def done(self):
+        return self.poll() is not None
+
+    def wait(self, timeout=None, interval=0.01):
+        """
+        Waits until the executable exits or timeout seconds have passed.
+        Returns the exit code, or None on timeout.
+        """
+        if timeout is None:
+            self.process.wait()
+            return self.poll()
+        deadline = time.time() + timeout
+        while self.poll() is None:
+            if time.time() >= deadline:
+                return None
+            time.sleep(min(interval, max(0.0, deadline - time.time())))
+            interval = min(interval * 2, 0.25)
+        return self.poll()
+
+    def cancel(self):
+        """Kills the executable if it is still running."""
+        if self.poll() is None:
+            self.process.kill()
+            self.process.wait()
+            self.poll()
+
+    @property
+    def wallTime(self):
+        return (self.endTime or time.time()) - self.startTime
+
+    def log(self):
+        """Returns the output captured so far."""
+        with open(self.logFile, 'r') as f:
+            return f.read()
+
+    def stats(self):
+        """Returns the OMResult.SimulationStats of a run started with -lv=LOG_STATS."""
+        with open(self.logFile, 'r') as f:
+            return OMResult.parseSimulationStats(f, self.wallTime)
+
+#thread pool running the background builds of lazily constructed models
+_buildThreads = None
+def _buildPool():
+    global _buildThreads
+    if _buildThreads is None:
+        #the threads only wait for omc, the compilation itself runs in the omc processes
+        _buildThreads = multiprocessing.pool.ThreadPool(max(4, multiprocessing.cpu_count()))
+    return _buildThreads
+
+#to format a value for the -override flag of the simulation executable
+def _overrideValue(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, str):
+        return value
+    return repr(value)
+
+#to get a variableFilter regular expression matching exactly the given variable names
+#(',' separates -override settings, so it is matched with '.')
+def _variableFilter(names):
+    special = '\\.[]()*+?{}|^$'
+    return '|'.join(''.join('\\' + c if c in special else c for c in n).replace(',', '.') for n in names)
+
+#to get the command line of the simulation executable with -override settings and extra flags
+def _executableCommand(exeFile, xmlFile, overrides, flags=()):
+    cmd = [exeFile, '-f=' + xmlFile] + list(flags)
+    if overrides:
+        cmd.append('-override=' + ','.join('{}={}'.format(n, _overrideValue(v)) for (n, v) in overrides))
+    return cmd
+
+#to call a worker of _iterIsolated in its own working directory, a temporary directory created
+#(and removed again unless keepFiles) on the host running the task
+def _isolatedRun(args):
+    (worker, prefix, keepFiles, task) = args
+    runDir = tempfile.mkdtemp(prefix=prefix)
+    try:
+        return worker((runDir,) + tuple(task))
+    finally:
+        if not keepFiles:
+            shutil.rmtree(runDir, ignore_errors=True)
+
+#to run every task (tasks may be a generator), each one in its own working directory, with an
+#OMExecutor executor (default: a pool of workers local processes)
+#worker is called with (runDir,) + task and must be a module level function
+#yields (i, result) as tasks finish, the directory of a run is removed after it unless keepFiles
+def _iterIsolated(worker, tasks, workers=None, prefix='run_', keepFiles=False, executor=None):
+    ownExecutor = executor is None
+    if ownExecutor:
+        executor = OMExecutor.ProcessExecutor(workers)
+    try:
+        args = ((worker, '{}run{}_'.format(prefix, i), keepFiles, task) for (i, task) in enumerate(tasks))
+        for (i, r) in executor.imapUnordered(_isolatedRun, args):
+            yield (i, r)
+    finally:
+        if ownExecutor:
+            executor.close()
+
+#to run every task in its own working directory, see _iterIsolated, and return the results in task order
+#callback(i, result) is called in this process as soon as task i has finished
+def _runIsolated(worker, tasks, workers=None, prefix='run_', keepFiles=False, callback=None, executor=None):
+    results = [None] * len(tasks)
+    for (i, r) in _iterIsolated(worker, tasks, workers, prefix, keepFiles, executor):
+        results[i] = r
+        if callback is not None:
+            callback(i, r)
+    return results
+
+#to simulate in runDir recording only outputs, returns the result file or None if the run failed
+#csvInput is the contents of the input csv file (see ModelicaSystem.getCsvInput()), written into runDir
+def _simulateIsolated(runDir, exeFile, xmlFile, overrides, outputs, csvInput=''):
+    resFile = os.path.join(runDir, 'sweep_res.mat')
+    settings = [('outputFormat', 'mat'), ('variableFilter', _variableFilter(outputs))]
+    flags = ['-r=' + resFile]
+    if csvInput:
+        csvFile = os.path.join(runDir, 'inputs.csv')
+        with open(csvFile, 'w') as f:
+            f.write(csvInput)
+        flags.append('-csvInput=' + csvFile)
+    cmd = _executableCommand(exeFile, xmlFile, settings + list(overrides), flags)
+    with open(os.path.join(runDir, 'sweep.log'), 'w') as log:
+        returnCode = subprocess.call(cmd, cwd=runDir, stdout=log, stderr=subprocess.STDOUT)
+    if returnCode != 0 or not os.path.exists(resFile):
+        return None
+    return resFile
+
+#to run one simulation of a parameter sweep in its own working directory
+#returns the outputs and, with keepResult, the contents of the result file (for the run cache)
+def _sweepRun(args):
+    (runDir, exeFile, xmlFile, overrides, outputs, csvInput, keepResult) = args
+    resFile = _simulateIsolated(runDir, exeFile, xmlFile, overrides, outputs, csvInput)
+    if resFile is None:
+        return None
+    try:
+        varList = ['time'] + outputs
+        values = dict(zip(varList, OMResult.readMatResult(resFile, varList)))
+    except (ValueError, KeyError):
+        return None
+    if not keepResult:
+        return (values, None)
+    with open(resFile, 'rb') as f:
+        return (values, f.read())
+
+#to run one simulation of an ensemble and resample its outputs onto grid, returns a (time, outputs) array
+def _ensembleRun(args):
+    (runDir, exeFile, xmlFile, overrides, outputs, csvInput, grid) = args
+    resFile = _simulateIsolated(runDir, exeFile, xmlFile, overrides, outputs, csvInput)
+    if resFile is None:
+        return None
+    try:
+        values = OMResult.readMatResult(resFile, ['time'] + outputs)
+    except (ValueError, KeyError):
+        return None
+    return OMResult.resample([values], grid)[0]
+
+#to linearize the model at one operating point in its own working directory
+def _linearizeRun(args):
+    (runDir, exeFile, xmlFile, overrides, linearizeTime) = args
+    cmd = _executableCommand(exeFile, xmlFile, overrides, ['-l=' + repr(float(linearizeTime))])
+    with open(os.path.join(runDir, 'linearize.log'), 'w') as log:
+        returnCode = subprocess.call(cmd, cwd=runDir, stdout=log, stderr=subprocess.STDOUT)
+    linearFiles = [f for f in os.listdir(runDir) if f.startswith('linear_') and f.endswith('.mo')]
+    if returnCode != 0 or not linearFiles:
+        return None
+    try:
+        return OMResult.readLinearModel(os.path.join(runDir, linearFiles[0]))
+    except ValueError:
+        return None
+
+#tokens of multiStartOptimize calls that reached their target, in-process workers cancel their runs
+#(kept for executors passed by the caller, which may still hold tasks of the call)
+_cancelledOptimizations = set()
+
+#to run one optimization in its own working directory, returns (objective, trajectories) or None
+#if it failed or was cancelled
+def _optimizeRun(args):
+    (runDir, exeFile, xmlFile, overrides, flags, outputs, token) = args
+    if token in _cancelledOptimizations:
+        return None
+    resFile = os.path.join(runDir, 'optimize_res.mat')
+    cmd = _executableCommand(exeFile, xmlFile, overrides, ['-r=' + resFile] + list(flags))
+    run = SimulationRun(cmd, cwd=runDir, logFile=os.path.join(runDir, 'optimize.log'))
+    while run.poll() is None:
+        if token in _cancelledOptimizations:
+            run.cancel()
+            return None
+        time.sleep(0.01)
+    objective = _readObjective(run.log()) if run.returncode == 0 else None
+    if objective is None:
+        return None
+    try:
+        return (objective, dict(zip(['time'] + outputs, OMResult.readMatResult(resFile, ['time'] + outputs))))
+    except (IOError, ValueError, KeyError):
+        return None
+
+#to run (cmd, runDir) jobs concurrently, at most workers at a time; yields (index, SimulationRun)
+#as runs finish, closing the generator cancels the runs still in progress
+#runs taking longer than timeout seconds are cancelled and yielded with timedOut set
+def _iterRuns(jobs, workers, timeout=None):
+    pending = list(enumerate(jobs))[::-1]
+    running = []
+    try:
+        while pending or running:
+            while pending and len(running) < workers:
+                (i, (cmd, runDir)) = pending.pop()
+                running.append((i, SimulationRun(cmd, cwd=runDir, logFile=os.path.join(runDir, 'run.log'))))
+            for (i, run) in running:
+                if timeout is not None and run.poll() is None and run.wallTime > timeout:
+                    run.cancel()
+                    run.timedOut = True
+            finished = [item for item in running if item[1].poll() is not None]
+            if not finished:
+                time.sleep(0.01)
+                continue
+            for item in finished:
+                running.remove(item)
+                yield item
+    finally:
+        for (i, run) in running:
+            run.cancel()
+
+#final objective value reported by Ipopt (unscaled), None if not found
+_ipoptObjective = re.compile(r'^Objective\.*:\s*(\S+)\s+(\S+)', re.M)
+def _readObjective(log):
+    found = _ipoptObjective.findall(log)
+    if not found:
+        return None
+    return float(found[-1][1])
+
+#to stack a list of per-run arrays, padding failed runs with nan
+def _stackRuns(arrays):
+    lengths = set(len(a) for a in arrays if a is not None)
+    if len(lengths) == 1:
+        n = lengths.pop()
+        return np.vstack([a if a is not None else np.full(n, np.nan) for a in arrays])
+    stacked = np.empty(len(arrays), dtype=object)
+    for (i, a) in enumerate(arrays):
+        stacked[i] = a
+    return stacked
+
 #author = Sudeep Bajracharya
 #sudba156@student.liu.se
 #LIU(Department of Computer Science)
 class ModelicaSystem(object):
-    def __init__(self, fileName = None, modelName = None, lmodel = None):
+    #metadata lists derived from the init xml and the method computing each of them, see __getattr__
+    lazyAttributes = {'quantitiesList': 'createQuantitiesList', 'qNamesList': 'getQuantitiesNames',
+                      'cNamesList': 'getContinuousNames', 'pNamesList': 'getParameterNames',
+                      'iNamesList': 'getInputNames', 'inputsVal': 'setInputSize', 'oNamesList': 'getOutputNames',
+                      'cValuesList': 'getContinuousValues', 'pValuesList': 'getParameterValues',
+                      'oValuesList': 'getOutputValues', 'simValuesList': 'getSimulationValue'}
+
+    #attributes left out of a pickled instance: the omc session, the parsed init xml and the state of runs
+    unpickledAttributes = ('getconn', 'sessionUsers', 'buildFuture', 'tree', 'root', 'lastRun', '_resultReader',
+                           '_linearizationCache', '_csvInputKey')
+
+    #buildCache: optional OMCache.BuildCache (True for the default cache directory),
+    #reuses executables of unchanged models instead of rebuilding them
+    #runCache: optional OMCache.RunCache (True for the default cache directory),
+    #serves simulations that were run before from their stored result files
+    #lazy=True starts omc and builds the model in the background (see buildFuture) and
+    #derives the metadata lists on first access
+    def __init__(self, fileName = None, modelName = None, lmodel = None, buildCache = None, lazy = False, runCache = None):
         if fileName is None and modelName is None and lmodel is None: # all None 
             self.getconn = OMCSession()
             return
 			
         if fileName is None:
             return "File does not exist"			
+        self.setupAttributes(fileName, modelName, lmodel, buildCache, runCache)
+        self.buildFuture = None #AsyncResult of the background build for lazy construction
+        self.getconn = None if lazy else OMCSession() #started by the background build for lazy construction
+        if not os.path.exists(self.fileName): #if file does not eixt
+            print "Error: File does not exist!!!"
+            return
+			
+        (head, tail) = os.path.split(self.fileName)#to store directory/path and file)
+        self.currDir = os.getcwd()
+        self.modelDir = head
+        self.fileName_ = tail
+
+        if not self.modelDir:
+            file_ = os.path.exists(self.fileName_)
+            if(file_):#execution from path where file is located 
+                self.startLoadingModel(self.fileName_, lazy)
+            else:
+                print "Error: File does not exist!!!"
+
+        else:
+            os.chdir(self.modelDir)
+            file_ = os.path.exists(self.fileName_)
+            self.model = self.fileName_[:-3]
+            if(self.fileName_):#execution from different path
+                os.chdir(self.currDir)
+                self.startLoadingModel(self.fileName, lazy)
+            else:
+                print "Error: File does not exist!!!"
+
+    #to start omc, load and build the model, in a background thread for lazy construction
+    def startLoadingModel(self, fName, lazy=False):
+        if not lazy:
+            self.loadingModel(fName, self.modelName, self.lmodel)
+            return
+        #attributes set by the build are resolved by __getattr__, which waits for it
+        for attr in ['getconn', 'xmlFile', 'exeFile', 'tree'] + list(self.lazyAttributes):
+            self.__dict__.pop(attr, None)
+        self.buildFuture = _buildPool().apply_async(self.backgroundLoadingModel, (fName,))
+
+    def backgroundLoadingModel(self, fName):
+        self.getconn = OMCSession()
+        self.loadingModel(fName, self.modelName, self.lmodel, lazy=True)
+
+    #to wait for a background build and resolve every attribute it sets, before __dict__ is copied
+    def waitForBuild(self):
+        if self.__dict__.get('buildFuture') is None:
+            return
+        self.buildFuture.wait()
+        for attr in ['getconn', 'xmlFile', 'exeFile', 'tree', 'root'] + list(self.lazyAttributes):
+            try:
+                getattr(self, attr)
+            except AttributeError:
+                pass #the build failed, reported on access as for the instance itself
+
+    #only called for missing attributes: waits for a background build and derives metadata on first access
+    def __getattr__(self, name):
+        if name in ('tree', 'root') and self.__dict__.get('xmlFile') is not None and self.__dict__.get('buildFuture') is None:
+            #instance restored from a pickle, the init xml is parsed on first use
+            self.tree = ET.parse(self.xmlFile)
+            self.root = self.tree.getroot()
+            return self.__dict__[name]
+        future = self.__dict__.get('buildFuture')
+        if future is None or not (name in self.lazyAttributes or name in ('getconn', 'xmlFile', 'exeFile', 'tree', 'root')):
+            raise AttributeError(name)
+        future.wait()
+        if name in self.__dict__:
+            return self.__dict__[name]
+        if name not in self.lazyAttributes or 'tree' not in self.__dict__:
+            raise AttributeError("'{}' is not available, building {} failed".format(name, self.modelName))
+        self.__dict__[name] = []
+        getattr(self, self.lazyAttributes[name])()
+        return self.__dict__[name]
+
+    #to initialize the attributes shared by all construction paths
+    def setupAttributes(self, fileName, modelName, lmodel, buildCache=None, runCache=None):
         self.tree = None
         self.quantitiesList = [] #detail list of all Modelica quantity variables inc. name, changable, description, etc
         self.qNamesList = [] #for all quantities name list
@@ -496,46 +869,160 @@ class ModelicaSystem(object):
         self.optimizeOptionsValuesList = ['0.0', '1.0', '500', '0.002','1e-8',' ']
         self.linearizeOptionsNamesList = ['startTime', 'stopTime', 'numberOfIntervals', 'stepSize', 'tolerance', 'simflags']
         self.linearizeOptionsValuesList = ['0.0', '1.0', '500', '0.002','1e-8',' ']
-        self.getconn = OMCSession()
         self.xmlFile = None
+        self.exeFile = None #compiled simulation executable
+        self.buildCache = OMCache.BuildCache() if buildCache is True else buildCache
+        self.runCache = OMCache.RunCache() if runCache is True else runCache
         self.lmodel = lmodel #may be needed if model is derived from other model
         self.modelName = modelName #Model class name
+        self.filePrefix = modelName #prefix of the files written by simulate()
+        self.resultFile = '{}_res.mat'.format(modelName) #result file of simulate()
+        self.cachedResultFile = None #stored result file of the last simulate() served by the run cache
+        self.sharedXml = False #True while a clone still shares tree and quantitiesList of its origin
+        self.sharedXmlHash = None #sha1 of the shared init xml when it was shared, see getXmlFile()
+        self.sessionUsers = None #[count] of instances sharing getconn, see clone()
         self.fileName = fileName #Model file/package name
         #self.simFlag = False
         self.inputFlag = False #for model with input quantity
         self.csvFile = '' #for storing inputs condition
-        if not os.path.exists(self.fileName): #if file does not eixt
+        self.lastRun = None #SimulationRun of the last simulate() call
+
+    #to construct a model from prebuilt artifacts (simulation executable and its init xml), no omc is started
+    #the prebuilt init xml is never written: like a clone the instance writes parameters, options and
+    #inputs to its own copy on the first change, and its files get a unique prefix
+    @classmethod
+    def fromBuild(cls, exeFile, xmlFile, runCache=None):
+        if not os.path.exists(exeFile) or not os.path.exists(xmlFile):
             print "Error: File does not exist!!!"
             return
-			
-        (head, tail) = os.path.split(self.fileName)#to store directory/path and file)
-        self.currDir = os.getcwd()
-        self.modelDir = head
-        self.fileName_ = tail
-
-        if not self.modelDir:
-            file_ = os.path.exists(self.fileName_)
-            if(file_):#execution from path where file is located 
-                self.loadingModel(self.fileName_, self.modelName, self.lmodel)
-            else:
-                print "Error: File does not exist!!!"
-
-        else:
-            os.chdir(self.modelDir)
-            file_ = os.path.exists(self.fileName_)
-            self.model = self.fileName_[:-3]
-            if(self.fileName_):#execution from different path
-                os.chdir(self.currDir)
-                self.loadingModel(self.fileName, self.modelName, self.lmodel)
-            else:
-                print "Error: File does not exist!!!"
+        self = cls.__new__(cls)
+        self.getconn = None
+        modelName = ET.parse(xmlFile).getroot().get('modelName')
+        self.setupAttributes(None, modelName, None, runCache=runCache)
+        self.filePrefix = '{}_{}'.format(modelName, uuid.uuid4().hex[:8])
+        self.resultFile = '{}_res.mat'.format(self.filePrefix)
+        self.exeFile = os.path.abspath(exeFile)
+        self.loadXml(os.path.abspath(xmlFile))
+        self.shareXml()
+        return self
 
     def __del__(self):
         if self.getconn is not None:
+            #a session shared with clones is closed by the last instance using it
+            users = getattr(self, 'sessionUsers', None)
+            if users is not None:
+                users[0] -= 1
+                if users[0] > 0:
+                    return
             self.requestApi('quit')
 
+    #to create a lightweight instance sharing the compiled executable and the variable metadata
+    #parameters, inputs and options are copied; the init xml is copied on the first write (copy-on-write)
+    #by whichever of the two instances writes first, so the shared file is never changed again
+    #shareSession=True shares the omc session (closed with the last user), otherwise the clone has none
+    def clone(self, shareSession=False):
+        self.waitForBuild()
+        self.shareXml()
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        for attr in ['cValuesList', 'pValuesList', 'oValuesList', 'inputsVal', 'simValuesList',
+                     'optimizeOptionsValuesList', 'linearizeOptionsValuesList']:
+            setattr(clone, attr, list(getattr(self, attr)))
+        clone.filePrefix = '{}_{}'.format(self.modelName, uuid.uuid4().hex[:8])
+        clone.resultFile = '{}_res.mat'.format(clone.filePrefix)
+        clone.cachedResultFile = None
+        clone.csvFile = ''
+        clone._csvInputKey = None
+        clone._resultReader = None
+        clone.lastRun = None
+        if shareSession and self.getconn is not None:
+            if self.sessionUsers is None:
+                self.sessionUsers = [1]
+            clone.sessionUsers = self.sessionUsers
+            clone.sessionUsers[0] += 1
+        else:
+            clone.getconn = None
+            clone.sessionUsers = None
+        return clone
+
+    #to mark the init xml as shared with other instances: no instance writes it any more, each one
+    #detaches on its first write instead
+    def shareXml(self):
+        if not self.sharedXml or self.sharedXmlHash is None:
+            self.sharedXmlHash = OMCache.hashFile(self.xmlFile)
+        self.sharedXml = True
+
+    #init xml to run the executable with; a shared init xml that was changed since it was shared (by an
+    #instance in another process or by hand) is first replaced by an own copy, see restoreXml()
+    def getXmlFile(self):
+        if self.sharedXml and self.sharedXmlHash is not None and OMCache.hashFile(self.xmlFile) != self.sharedXmlHash:
+            self.restoreXml()
+        return os.path.abspath(self.xmlFile)
+
+    #to give an instance sharing its init xml its own copy and quantities before they are modified
+    def detachXml(self):
+        if not self.sharedXml:
+            return
+        self.tree = deepcopy(self.tree)
+        self.root = self.tree.getroot()
+        self.quantitiesList = [deepcopy(q) for q in self.quantitiesList]
+        xmlFile = '{}_init.xml'.format(self.filePrefix)
+        if os.path.abspath(xmlFile) == os.path.abspath(self.xmlFile):
+            #the origin of a clone keeps its prefix, but must not write the file it shares
+            xmlFile = '{}_{}_init.xml'.format(self.filePrefix, uuid.uuid4().hex[:8])
+        self.xmlFile = xmlFile
+        self.tree.write(self.xmlFile,  encoding='UTF-8', xml_declaration=True)
+        self.sharedXml = False
+        self.sharedXmlHash = None
+
+    #to pickle a built model without its omc session, e.g. for multiprocessing workers
+    #the state holds the artifact paths, the metadata and value lists and the inputs; the init xml is
+    #referenced by path and its sha1, so the artifacts must be reachable from the unpickling process
+    #like clone() this shares the init xml, later writes of the instance go to its own copy
+    def __getstate__(self):
+        self.waitForBuild()
+        if self.__dict__.get('exeFile') is None or self.__dict__.get('xmlFile') is None:
+            raise pickle.PicklingError('{} is not built, it cannot be pickled'.format(self.modelName))
+        self.shareXml()
+        state = dict((k, v) for (k, v) in self.__dict__.items() if k not in self.unpickledAttributes)
+        state['xmlFile'] = os.path.abspath(self.xmlFile)
+        if getattr(self, 'optimizeXmlFile', None) is not None:
+            state['optimizeXmlFile'] = os.path.abspath(self.optimizeXmlFile)
+        return state
+
+    #to restore a pickled model like a clone without session: it shares the init xml until the first
+    #write and writes its files under its own prefix
+    #if the init xml changes after pickling, the pickled values are written to an own copy before a run
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.getconn = None
+        self.sessionUsers = None
+        self.buildFuture = None
+        self.lastRun = None
+        self._resultReader = None
+        self._csvInputKey = None
+        self.filePrefix = '{}_{}'.format(self.modelName, uuid.uuid4().hex[:8])
+        self.resultFile = '{}_res.mat'.format(self.filePrefix)
+        self.cachedResultFile = None
+        self.csvFile = ''
+
+    #to write the start values of quantitiesList and the simulation options to an own copy of the init xml
+    def restoreXml(self):
+        self.detachXml()
+        starts = dict((q.name, q.start) for q in self.quantitiesList)
+        for sv in self.root.iter('ScalarVariable'):
+            start = starts.get(sv.get('name'))
+            if start is not None:
+                for attr in sv.getchildren():
+                    attr.set('start', str(start))
+        for sim in self.root.iter('DefaultExperiment'):
+            for (opt, value) in zip(self.simNamesList, self.simValuesList):
+                if value is not None:
+                    sim.set(opt, str(value))
+        self.tree.write(self.xmlFile,  encoding='UTF-8', xml_declaration=True)
+
     #for loading file/package, loading model and building model        
-    def loadingModel(self, fName, mName, lmodel):
+    def loadingModel(self, fName, mName, lmodel, lazy=False):
         #load file
         loadfileError = ''
         loadfileResult = self.requestApi("loadFile", fName)
@@ -561,15 +1048,34 @@ class ModelicaSystem(object):
         # build model 
         buildModelError = ''
         self.getconn.sendExpression("setCommandLineOptions(\"+d=initialization\")")
-        buildModelResult = self.requestApi("buildModel", mName)
-        buildModelError = self.requestApi("getErrorString")
-        if 'Expected end of text' not in buildModelError:
-            print buildModelError
-            return
+        buildModelResult = None
+        if self.buildCache is not None:
+            cacheKey = self.getBuildCacheKey(fName, mName, lmodel)
+            cachedFiles = self.buildCache.fetch(cacheKey, os.getcwd())
+            if cachedFiles:
+                buildModelResult = (mName, '{}_init.xml'.format(mName))
+        if buildModelResult is None:
+            buildModelResult = self.requestApi("buildModel", mName)
+            buildModelError = self.requestApi("getErrorString")
+            if 'Expected end of text' not in buildModelError:
+                print buildModelError
+                return
+            if self.buildCache is not None:
+                exeName = '{}.{}'.format(mName, "exe") if sys.platform == 'win32' else mName
+                cachedFiles = [f for f in [exeName, buildModelResult[1], '{}_info.json'.format(mName)] if os.path.exists(f)]
+                self.buildCache.store(cacheKey, cachedFiles, os.getcwd())
     
-        self.xmlFile = buildModelResult[1]
+        self.exeFile = os.path.abspath('{}.{}'.format(mName, "exe") if sys.platform == 'win32' else mName)
+        self.loadXml(buildModelResult[1], lazy)
+
+    #to read the init xml of the build and derive the quantity, value and option lists
+    #with lazy=True the lists are derived on first access instead, see __getattr__
+    def loadXml(self, xmlFile, lazy=False):
+        self.xmlFile = xmlFile
         self.tree = ET.parse(self.xmlFile)
         self.root = self.tree.getroot()
+        if lazy:
+            return
         self.createQuantitiesList() #initialize quantitiesList
         self.getQuantitiesNames() #initialize qNamesList
         self.getContinuousNames() #initialize cNamesList
@@ -585,6 +1091,32 @@ class ModelicaSystem(object):
         self.getSimulationValue() #initialize simulation value list
 
 
+    #key of the build cache: model sources, model name, loaded libraries, compiler flags and omc version
+    def getBuildCacheKey(self, fName, mName, lmodel):
+        libraryVersion = self.requestApi("getVersion", lmodel) if lmodel is not None else None
+        return OMCache.BuildCache.key(OMCache.hashModelFiles(fName), mName, lmodel, libraryVersion,
+                                      self.requestApi("getCommandLineOptions"), self.requestApi("getVersion"), sys.platform)
+
+    #sha1 of the simulation executable, recomputed only when the file has changed
+    def getBuildHash(self):
+        stat = os.stat(self.exeFile)
+        state = (self.exeFile, stat.st_mtime, stat.st_size)
+        cached = getattr(self, '_buildHash', None)
+        if cached is None or cached[0] != state:
+            cached = (state, OMCache.hashFile(self.exeFile))
+            self._buildHash = cached
+        return cached[1]
+
+    #key of the run cache: build, init xml (parameters, start values, options), inputs and flags
+    #the inputs are hashed from their values, so no csv file needs to be written first
+    def getRunCacheKey(self, *flags):
+        inputs = self.getInputKey() if self.inputFlag else None
+        return OMCache.RunCache.key(self.getBuildHash(), OMCache.hashFile(self.getXmlFile()), inputs, flags)
+
+    #result file read by getSolutions(): the stored result of a run cache hit or resultFile
+    def getResultFile(self):
+        return self.cachedResultFile or self.resultFile
+
     #request to OM
     def requestApi(self, apiName, entity=None, properties=None ):
         if (entity is not None and properties is not None):
@@ -850,33 +1382,375 @@ class ModelicaSystem(object):
             print linN, ' = ', linV
         
     
+    #to get the command line of the simulation executable for the current settings
+    #logFlags is a list of log streams passed with -lv, e.g. ['LOG_STATS', 'LOG_SOLVER']
+    #initFile/initTime start the run from the state stored at initTime in an earlier result file
+    #overrides is a list of (name, value) settings passed with -override, flags are appended as they are
+    def getSimulationCommand(self, logFlags=None, initFile=None, initTime=None, overrides=None, flags=None):
+        overrides = list(overrides or [])
+        cmd = [self.exeFile, '-f=' + self.getXmlFile(), '-r=' + self.resultFile]
+        if (self.inputFlag):#if model has input quantities
+            cmd.append("-csvInput=" + self.csvFile)
+        if logFlags:
+            cmd.append('-lv=' + ','.join(logFlags))
+        if initFile is not None:
+            cmd.append('-iif=' + os.path.abspath(initFile))
+            cmd.append('-iit=' + repr(float(initTime)))
+            overrides.append(('startTime', float(initTime)))
+        cmd.extend(flags or [])
+        if overrides:
+            cmd.append('-override=' + ','.join('{}={}'.format(n, _overrideValue(v)) for (n, v) in overrides))
+        return cmd
+
+    #to keep the current result file as a checkpoint that later simulations can start from
+    #returns the name of the checkpoint file, see simulate(initFile=..., initTime=...)
+    def checkpoint(self, fileName=None):
+        if not os.path.exists(self.getResultFile()):
+            print "Error: mat file does not exist"
+            return
+        if fileName is None:
+            fileName = '{}_checkpoint_{}.mat'.format(self.filePrefix, uuid.uuid4().hex[:8])
+        shutil.copyfile(self.getResultFile(), fileName)
+        return fileName
+
     #to simulate or re-simulate model
-    def simulate(self):
-        #if (self.inputFlag == True):
+    #wait=False returns a SimulationRun handle at once, otherwise waits at most timeout seconds
+    #the handle of the last run (exit code, captured log) is kept in self.lastRun
+    #stats=True enables LOG_STATS and returns the parsed OMResult.SimulationStats (also kept in
+    #self.simulationStats), logFlags adds further -lv log streams
+    #initFile (an earlier result file, see checkpoint()) and initTime warm-start the run at initTime
+    #from the state stored in initFile instead of recomputing the shared prefix from startTime
+    #outputs records only the given variables (and time) in the result file, numberOfIntervals sets
+    #the output grid and noEventEmit=True drops the extra output points at events
+    #with a run cache a blocking simulate() of a run done before only looks up its stored result
+    def simulate(self, wait=True, timeout=None, stats=False, logFlags=None, initFile=None, initTime=None,
+                 outputs=None, numberOfIntervals=None, noEventEmit=False):
+        self.closeResultReader() #the executable rewrites the result file
+        if self.exeFile is None or not os.path.exists(self.exeFile):
+            print "Error: application file not generated yet"
+            return
+        if initFile is not None:
+            if not os.path.exists(initFile):
+                print "Error: mat file does not exist"
+                return
+            if os.path.abspath(initFile) == os.path.abspath(self.resultFile):
+                print 'Error!!! the result file cannot be its own initial file, use checkpoint()'
+                return
+            (first, last) = OMResult.MatResult(initFile).timeSpan()
+            initTime = last if initTime is None else float(initTime)
+            if first is None or not first <= initTime <= last:
+                print '!!! initTime should be within the time span of', initFile
+                return
+            if self.simValuesList[1] is not None and initTime >= float(self.simValuesList[1]):
+                print '!!! initTime should be less than stopTime'
+                return
         if (self.inputFlag):#if model has input quantities
-            self.simInput()#create csv file
-            getExeFile = '{}.{}'.format(self.modelName, "exe")
-            check_exeFile_ = os.path.exists(getExeFile)
-            if(check_exeFile_):
-                cmd = getExeFile + " -csvInput=" + self.csvFile
-            
-                subprocess.call(cmd, shell = False)
+            if not self.simInput():#create csv file
                 return
-            else:
-                print "Error: application file not generated yet"
+        overrides = []
+        if outputs is not None:
+            if not self.checkAvailability(list(outputs), self.qNamesList):
                 return
-        else:
-            getExeFile = '{}.{}'.format(self.modelName, "exe")
-            check_exeFile_ = os.path.exists(getExeFile)
-            if(check_exeFile_):
-                cmd = getExeFile
-                subprocess.call(cmd, shell = False)
+            overrides.append(('variableFilter', _variableFilter(outputs)))
+        if numberOfIntervals is not None:
+            startTime = float(initTime) if initFile is not None else float(self.simValuesList[0])
+            overrides.append(('stepSize', (float(self.simValuesList[1]) - startTime) / int(numberOfIntervals)))
+        self.recordedOutputs = list(outputs) if outputs is not None else None
+        logFlags = list(logFlags or [])
+        if stats and 'LOG_STATS' not in logFlags:
+            logFlags.append('LOG_STATS')
+        flags = ['-noEventEmit'] if noEventEmit else []
+        cacheKey = None
+        if self.runCache is not None and wait:
+            initState = (OMCache.hashFile(initFile), float(initTime)) if initFile is not None else None
+            cacheKey = self.getRunCacheKey(initState, sorted(logFlags), overrides, flags)
+            entry = self.runCache.lookup(cacheKey)
+            if entry is not None:
+                self.lastRun = None
+                self.cachedResultFile = os.path.join(entry, 'result.mat')
+                if stats:
+                    with open(os.path.join(entry, 'simulate.log'), 'r') as f:
+                        self.simulationStats = OMResult.parseSimulationStats(f, self.runCache.info(cacheKey)['wallTime'])
+                    return self.simulationStats
                 return
-            else:
-                print "Error: application file not generated yet"
+        self.cachedResultFile = None
+        #so neither getSolutions() nor followResults() see the result of an earlier run
+        if os.path.exists(self.resultFile):
+            os.remove(self.resultFile)
+        shutil.rmtree(OMResult.columnStoreDir(self.resultFile), ignore_errors=True)
+        cmd = self.getSimulationCommand(logFlags, initFile, initTime, overrides, flags)
+        self.lastRun = SimulationRun(cmd, logFile='{}_simulate.log'.format(self.filePrefix))
+        if not wait:
+            return self.lastRun
+        if self.lastRun.wait(timeout) is None:
+            self.lastRun.cancel()
+            print 'Error: simulation timed out after', timeout, 's'
+        elif self.lastRun.returncode != 0:
+            print self.lastRun.log()
+        elif cacheKey is not None and os.path.exists(self.resultFile):
+            self.runCache.store(cacheKey, {'result.mat': self.resultFile, 'simulate.log': self.lastRun.logFile},
+                                {'model': self.modelName, 'wallTime': self.lastRun.wallTime})
+        if stats:
+            self.simulationStats = self.lastRun.stats()
+            return self.simulationStats
+
+    #to expand a parameter grid into the list of parameter combinations of a sweep
+    def expandParameterGrid(self, parameterGrid):
+        if isinstance(parameterGrid, dict):
+            names = sorted(parameterGrid.keys())
+            return [dict(zip(names, values)) for values in itertools.product(*[parameterGrid[n] for n in names])]
+        return [dict(p) for p in parameterGrid]
+
+    #to run the compiled model for every combination of a parameter grid in parallel
+    #parameterGrid is either a dict of name -> list of values (full factorial) or a list of dicts
+    #returns (runs, results) where runs[i] holds the parameters of run i and results maps
+    #'time' and every output name to an array indexed by run
+    #the inputs set with setInputValues() apply to every run
+    #with a run cache every finished run is stored at once, so an interrupted sweep started
+    #again only simulates the runs that are missing
+    #executor (see OMExecutor) runs the simulations, default is a pool of workers local processes
+    #keepFiles keeps the run directories, in the temporary directory of the host running each run
+    def sweep(self, parameterGrid, outputs=None, workers=None, keepFiles=False, executor=None):
+        if self.exeFile is None or not os.path.exists(self.exeFile):
+            print "Error: application file not generated yet"
+            return
+        runs = self.expandParameterGrid(parameterGrid)
+        if not runs:
+            print 'Error!!! empty parameter grid'
+            return
+        names = set()
+        for r in runs:
+            names.update(r.keys())
+        if not self.checkAvailability(list(names), self.pNamesList):
+            return
+        if outputs is None:
+            outputs = list(self.oNamesList)
+        if not self.checkAvailability(outputs, self.qNamesList):
+            return
+        csvInput = self.getCsvInput()
+        if csvInput is None:
+            return
+        xmlFile = self.getXmlFile()
+        tasks = [(self.exeFile, xmlFile, sorted(r.items()), outputs, csvInput, self.runCache is not None) for r in runs]
+        runResults = [None] * len(tasks)
+        missing = range(len(tasks))
+        if self.runCache is not None:
+            keys = [self.getRunCacheKey('sweep', t[2], outputs) for t in tasks]
+            missing = []
+            for (i, k) in enumerate(keys):
+                entry = self.runCache.lookup(k)
+                if entry is None:
+                    missing.append(i)
+                    continue
+                varList = ['time'] + outputs
+                runResults[i] = dict(zip(varList, OMResult.readMatResult(os.path.join(entry, 'result.mat'), varList)))
+        def storeRun(i, result):
+            if self.runCache is None or result is None:
+                return
+            (fd, resFile) = tempfile.mkstemp(suffix='_res.mat')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(result[1])
+            try:
+                self.runCache.store(keys[missing[i]], {'result.mat': resFile},
+                                    {'model': self.modelName, 'parameters': runs[missing[i]]})
+            finally:
+                os.remove(resFile)
+        if missing:
+            newResults = _runIsolated(_sweepRun, [tasks[i] for i in missing], workers,
+                                      '{}_sweep_'.format(self.modelName), keepFiles, storeRun, executor)
+            for (i, r) in zip(missing, newResults):
+                runResults[i] = r[0] if r is not None else None
+        failed = [i for (i, r) in enumerate(runResults) if r is None]
+        if failed:
+            print 'Error!!! simulation failed for runs ', failed
+        if len(failed) == len(runs):
+            return
+        results = {}
+        for v in ['time'] + outputs:
+            results[v] = _stackRuns([r[v] if r is not None else None for r in runResults])
+        return (runs, results)
     
+    #to draw the parameter values of runs simulations from distributions, see ensemble()
+    def sampleParameters(self, distributions, runs, seed=None):
+        rng = np.random.RandomState(seed)
+        names = sorted(distributions)
+        for _ in range(runs):
+            sample = []
+            for n in names:
+                d = distributions[n]
+                value = d(rng) if callable(d) else getattr(rng, d[0])(*d[1:])
+                sample.append((n, float(value)))
+            yield sample
+
+    #to run a Monte Carlo ensemble of the compiled model and get per time step statistics of outputs
+    #distributions maps parameter names to a function of a numpy RandomState returning one sample or
+    #to a tuple (RandomState method, arguments...), e.g. ('normal', 1.0, 0.1) or ('uniform', 0.0, 2.0)
+    #the inputs set with setInputValues() apply to every run
+    #every run is resampled onto grid (default: the output grid of the simulation options) and folded
+    #into running statistics as soon as it finishes, so memory does not grow with the number of runs
+    #returns a dict with 'time', 'outputs', 'count', 'failed' (run indices), 'mean', 'variance', 'std',
+    #'min' and 'max' of shape (time, outputs) and 'quantiles' of shape (levels, time, outputs)
+    #executor (see OMExecutor) runs the simulations, default is a pool of workers local processes
+    def ensemble(self, distributions, runs, outputs=None, grid=None, quantiles=(0.05, 0.5, 0.95), workers=None, seed=None,
+                 executor=None):
+        if self.exeFile is None or not os.path.exists(self.exeFile):
+            print "Error: application file not generated yet"
+            return
+        if not self.checkAvailability(list(distributions), self.pNamesList):
+            return
+        if outputs is None:
+            outputs = list(self.oNamesList)
+        if not self.checkAvailability(outputs, self.qNamesList):
+            return
+        if grid is None:
+            (start, stop, step) = [float(v) for v in self.simValuesList[:3]]
+            grid = np.linspace(start, stop, int(round((stop - start) / step)) + 1)
+        grid = np.asarray(grid, dtype=np.float64)
+        csvInput = self.getCsvInput()
+        if csvInput is None:
+            return
+        xmlFile = self.getXmlFile()
+        tasks = ((self.exeFile, xmlFile, sample, outputs, csvInput, grid) for sample in self.sampleParameters(distributions, runs, seed))
+        moments = OMResult.RunningStatistics((len(grid), len(outputs)))
+        estimates = OMResult.StreamingQuantiles((len(grid), len(outputs)), quantiles)
+        failed = []
+        for (i, r) in _iterIsolated(_ensembleRun, tasks, workers, '{}_ensemble_'.format(self.modelName), executor=executor):
+            if r is None:
+                failed.append(i)
+                continue
+            moments.add(r)
+            estimates.add(r)
+        if failed:
+            print 'Error!!! simulation failed for runs ', sorted(failed)
+        return {'time': grid, 'outputs': outputs, 'count': moments.count, 'failed': sorted(failed),
+                'mean': moments.mean, 'variance': moments.variance, 'std': moments.std,
+                'min': moments.min, 'max': moments.max, 'quantiles': estimates.quantiles}
+
+    #to linearize the compiled model at many operating points in parallel
+    #operatingPoints is a list of dicts of parameter/start values, the linearization time is the
+    #stopTime of the linearization options; build with "+generateSymbolicLinearization" for symbolic jacobians
+    #returns a dict with stacked 'A', 'B', 'C', 'D' arrays (first axis: operating point, nan if it
+    #failed) and 'stateNames', 'inputNames', 'outputNames'; results are cached per operating point
+    #executor (see OMExecutor) runs the linearizations, default is a pool of workers local processes
+    def linearizeBatch(self, operatingPoints, workers=None, executor=None):
+        if self.exeFile is None or not os.path.exists(self.exeFile):
+            print "Error: application file not generated yet"
+            return
+        names = set()
+        for op in operatingPoints:
+            names.update(op.keys())
+        if not self.checkAvailability(list(names), self.qNamesList):
+            return
+        if getattr(self, '_linearizationCache', None) is None:
+            self._linearizationCache = {}
+        options = dict(zip(self.linearizeOptionsNamesList, self.linearizeOptionsValuesList))
+        linearizeTime = float(options['stopTime'])
+        settings = [('startTime', float(options['startTime'])), ('stopTime', linearizeTime),
+                    ('stepSize', float(options['stepSize'])), ('tolerance', float(options['tolerance']))]
+        state = (self.exeFile, os.path.getmtime(self.exeFile), tuple(self.pValuesList), tuple(self.cValuesList), tuple(settings))
+        keys = [state + (tuple(sorted(op.items())),) for op in operatingPoints]
+        missing = sorted(set(k for k in keys if k not in self._linearizationCache), key=keys.index)
+        if missing:
+            xmlFile = self.getXmlFile()
+            tasks = [(self.exeFile, xmlFile, settings + list(k[-1]), linearizeTime) for k in missing]
+            linearized = _runIsolated(_linearizeRun, tasks, workers, '{}_linearize_'.format(self.modelName), executor=executor)
+            for (k, r) in zip(missing, linearized):
+                if r is not None:
+                    self._linearizationCache[k] = r
+        results = [self._linearizationCache.get(k) for k in keys]
+        failed = [i for (i, r) in enumerate(results) if r is None]
+        if failed:
+            print 'Error!!! linearization failed for operating points ', failed
+        if len(failed) == len(results):
+            return
+        first = [r for r in results if r is not None][0]
+        linear = {'stateNames': first[4], 'inputNames': first[5], 'outputNames': first[6]}
+        for (i, m) in enumerate(['A', 'B', 'C', 'D']):
+            linear[m] = np.array([r[i] if r is not None else np.full(first[i].shape, np.nan) for r in results])
+        return linear
+
+    #to get a (cached) reader for a result file, reopened when the file has changed
+    #an up to date columnar store of the file (see storeColumns()) is read instead of the file
+    def getResultReader(self, resFile):
+        storeDir = OMResult.columnStoreDir(resFile)
+        useStore = OMResult.isColumnStoreCurrent(storeDir, resFile)
+        path = os.path.join(storeDir, 'metadata.json') if useStore else resFile
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+        reader = getattr(self, '_resultReader', None)
+        if reader is None or reader[0] != key:
+            self.closeResultReader()
+            reader = (key, OMResult.ColumnStore(storeDir) if useStore else OMResult.MatResult(resFile))
+            self._resultReader = reader
+        return reader[1]
+
+    #to convert the result file into a columnar store with one memory-mappable .npy per variable,
+    #which getSolutions() then reads instead of the mat file (also after the mat file was removed)
+    #compression 'zlib' or 'lzma' stores compressed chunks for archival instead
+    def storeColumns(self, compression=None):
+        resFile = self.getResultFile()
+        if not os.path.exists(resFile):
+            print "Error: mat file does not exist"
+            return
+        self.closeResultReader()
+        try:
+            storeDir = OMResult.writeColumnStore(resFile, OMResult.columnStoreDir(resFile), compression)
+        except ValueError as e:
+            print 'Error!!! ', e
+            return
+        if self.cachedResultFile is not None:
+            #the store was written into the run cache entry, which has to be accounted for its new size
+            self.runCache.updateSize(os.path.basename(os.path.dirname(self.cachedResultFile)))
+        return storeDir
+
+    #to release the memory map of the cached result reader, e.g. before the file is rewritten
+    def closeResultReader(self):
+        reader = getattr(self, '_resultReader', None)
+        if reader is not None:
+            reader[1].close()
+        self._resultReader = None
+
+    #to start the executable with its embedded OPC UA server and advance it interactively, e.g. for MPC
+    #returns an OMStepping.OPCUASession (needs the opcua package) with setInputs(), step(dt), get()
+    #and exchange(); a step advances the model by stepSize (default: stepSize of the simulation options)
+    def startStepping(self, port=4841, stepSize=None, timeout=10.0):
+        if self.exeFile is None or not os.path.exists(self.exeFile):
+            print "Error: application file not generated yet"
+            return
+        if OMStepping.opcua is None:
+            print 'Error!!! interactive stepping needs the opcua package'
+            return
+        if (self.inputFlag):#if model has input quantities
+            if not self.simInput():#create csv file
+                return
+        stepSize = float(stepSize if stepSize is not None else self.simValuesList[2])
+        flags = ['-embeddedServer=opc-ua', '-embeddedServerPort={}'.format(port)]
+        cmd = self.getSimulationCommand(overrides=[('stepSize', stepSize)], flags=flags)
+        self.lastRun = SimulationRun(cmd, logFile='{}_stepping.log'.format(self.filePrefix))
+        try:
+            return OMStepping.OPCUASession(port, stepSize, self.lastRun, timeout=timeout)
+        except OMStepping.SteppingError as e:
+            self.lastRun.cancel()
+            print 'Error!!! ', e
+
+    #to read the result of a simulation started with simulate(wait=False) while it is written
+    #yields (len(varList), rows) arrays with at most blockRows new rows each and ends after the run
+    #has finished, e.g. for block in model.followResults(['time', 'h']): plot(block[0], block[1])
+    def followResults(self, varList, blockRows=4096, interval=0.05):
+        for v in varList:
+            if v != 'time' and v not in [l.name for l in self.quantitiesList]:
+                print '!!! ', v, ' does not exist\n'
+                return iter([])
+        run = self.lastRun
+        return OMResult.followResult(self.resultFile, varList, run.done if run is not None else None, blockRows, interval)
+
     #to extract simulation results
-    def getSolutions(self, varList):
+    #start/stop select a time window (binary search on the time column), maxPoints reduces the
+    #window to a min/max envelope of at most maxPoints samples for plotting
+    def getSolutions(self, varList, start=None, stop=None, maxPoints=None):
+        if maxPoints is not None and maxPoints < 2:
+            print '!!! maxPoints must be at least 2'
+            return
         if isinstance(varList, list):
             for v in varList:
                 if v == 'time':
@@ -884,19 +1758,29 @@ class ModelicaSystem(object):
                 if v not in [l.name for l in self.quantitiesList]:
                     print '!!! ', v, ' does not exist\n'
                     return 
-            res_mat = '_res.mat'
-            resFile = "".join([self.modelName, res_mat])
-            check_resFile_ = os.path.exists(resFile)
-            variables = ",".join(varList)
+            resFile = self.getResultFile()
+            check_resFile_ = os.path.exists(resFile) or OMResult.isColumnStoreCurrent(OMResult.columnStoreDir(resFile), resFile)
             #vars = []
             #results = []
 
             if(check_resFile_):
-                exp = "readSimulationResult(\"" + resFile + '",{' + variables + "})"
-                res = self.getconn.sendExpression(exp)
-                npRes = np.array(res)
-                exp2 = "closeSimulationResultFile()"
-                self.getconn.sendExpression(exp2)
+                #read the result file directly, no omc round trip needed
+                try:
+                    reader = self.getResultReader(resFile)
+                    missing = [v for v in varList if v not in reader]
+                    if missing:
+                        print '!!! ', missing, ' not recorded in the result file',
+                        print '(recorded outputs: {})'.format(self.recordedOutputs) if getattr(self, 'recordedOutputs', None) is not None else ''
+                        return
+                    (first, last) = reader.timeRange(start, stop)
+                    if maxPoints is None:
+                        #the variables are views of the mapped file, stacking them is the only copy
+                        npRes = np.array(reader.getVariables(varList, first, last))
+                    else:
+                        npRes = np.array(reader.getDecimated(varList, first, last, maxPoints))
+                except KeyError as e:
+                    print '!!! ', e.args[0], ' is not stored in the result file\n'
+                    return
                 return npRes
             else:
                 print "Error: mat file does not exist"
@@ -950,66 +1834,102 @@ class ModelicaSystem(object):
             print e
     
     #to set input quantities value
+    #inputsValList is a list of (time, value) tuples, an (n, 2) numpy array or a generator of (time, value) pairs
     def setInputValues(self, name, inputsValList):
         try:
             errMsgFormat = 'Error!!! Incorrect format'
             errMsgStr = 'Error!!! value should not be string'
             errMsgTime = 'Time values should be increasing order'
-            for i in inputsValList:
-                if len(i) != 2:#tuple length must be 2
-                    print errMsgFormat
-                    return
+            if not isinstance(inputsValList, (list, tuple, np.ndarray)):
+                inputsValList = list(inputsValList)
+            if any(isinstance(v, str) for i in inputsValList if isinstance(i, (list, tuple)) for v in i):
+                print errMsgStr
+                return
+            try:
+                values = np.array(inputsValList, dtype=np.float64)
+            except ValueError:
+                print errMsgFormat
+                return
+            if values.ndim != 2 or values.shape[1] != 2:#tuple length must be 2
+                print errMsgFormat
+                return
             checking = self.checkAvailability(name, self.iNamesList)
             if checking is False:
                 return
-            for v in inputsValList:
-                if isinstance(v[0], str) or isinstance(v[1], str):
-                    print errMsgStr
-                    return
-            if inputsValList != sorted(inputsValList):
+            if np.any(np.diff(values[:, 0]) < 0):
                 print errMsgTime
                 return
             index = self.iNamesList.index(name)
-            self.inputsVal[index] = inputsValList
+            self.inputsVal[index] = values
             self.inputFlag = True
         except Exception as e:
             print e
   
-    #to create csv file
+    #to create csv file, reusing the last written file when the inputs did not change
+    #returns False when the file cannot be written
     def simInput(self):
-        timestamps = set()
+        self.csvFile = '{}.csv'.format(self.filePrefix)
+        unset = [n for (n, i) in zip(self.iNamesList, self.inputsVal) if i is None]
+        if unset:
+            print 'Error!!! no values set for inputs ', unset
+            return False
+        inputKey = self.getInputKey()
+        if getattr(self, '_csvInputKey', None) == inputKey and os.path.exists(self.csvFile):
+            return True
+
+        #merge the timestamps of all inputs and interpolate every input on them at once
+        timestamps = np.unique(np.concatenate([i[:, 0] for i in self.inputsVal]))
+        interpolated_inputs = np.column_stack([np.interp(timestamps, i[:, 0], i[:, 1]) for i in self.inputsVal])
+
+        #every sample is followed by a row holding its value until the next timestamp
+        #(except for the last two samples)
+        n = len(timestamps)
+        k = max(n - 2, 0)
+        rows = np.zeros((n + k, len(self.inputsVal) + 2))
+        rows[0:2*k:2, 0] = timestamps[:k]
+        rows[1:2*k:2, 0] = timestamps[1:k+1]
+        rows[0:2*k:2, 1:-1] = interpolated_inputs[:k]
+        rows[1:2*k:2, 1:-1] = interpolated_inputs[:k]
+        rows[2*k:, 0] = timestamps[k:]
+        rows[2*k:, 1:-1] = interpolated_inputs[k:]
+
+        name = ','.join(['time'] + self.iNamesList + ['end'])
+        rowFormat = ','.join(['%.17g'] * rows.shape[1]) + '\n'
+        with open(self.csvFile, "w") as f:
+            f.write(name + '\n')
+            #write in chunks with one formatting operation each
+            for c in range(0, len(rows), 65536):
+                chunk = rows[c:c+65536]
+                f.write((rowFormat * len(chunk)) % tuple(chunk.ravel()))
+        self._csvInputKey = inputKey
+        return True
+
+    #sha1 of the input names and of the values set with setInputValues() (None for unset inputs)
+    def getInputKey(self):
+        digest = hashlib.sha1(','.join(self.iNamesList))
         for i in self.inputsVal:
-            for (t,x) in i:
-                timestamps.add(t)
-        timestamps=sorted(timestamps)
-        
-        interpolated_inputs = list(np.interp(timestamps, zip(*l)[0], zip(*l)[1]) for l in self.inputsVal)
-        name_ ='time'
-        
-        name = ','.join(self.iNamesList)
-        name = '{},{},{}'.format(name_,name,'end')
-        
-        a=''
-        l=[]
-        l.append(name)
-        for i in range(0,len(timestamps)):
-            a =("%s,%s" % (str(float(timestamps[i])),",".join(list(str(float(inp[i])) for inp in interpolated_inputs))))+',0'
-            l.append(a)
-            if(i<(len(timestamps)-2)):
-                a=("%s,%s" % (str(float(timestamps[i+1])),",".join(list(str(float(inp[i])) for inp in interpolated_inputs))))+',0'
-                l.append(a)
-          
-        self.csvFile = '{}.csv'.format(self.modelName)
-        
-        with open (self.csvFile, "w") as f:
-            writer=csv.writer(f, delimiter='\n')
-            writer.writerow(l)
-        return
+            if i is None:
+                digest.update('None')
+                continue
+            digest.update(repr(i.shape))
+            digest.update(np.ascontiguousarray(i).view(np.uint8))
+        return digest.hexdigest()
   
+    #to get the contents of the input csv file (written by simInput()) for runs in their own working
+    #directories, possibly on other hosts; '' without inputs, None when the file cannot be written
+    def getCsvInput(self):
+        if not self.inputFlag:
+            return ''
+        if not self.simInput():
+            return
+        with open(self.csvFile, 'r') as f:
+            return f.read()
+
     #to set values for continuous and parameter quantities
     def setValue(self, names, values, attrName, attrValue, namesList, valuesList):
         index = 0
         if(len(names) == len(values)):
+            self.detachXml()
             for n in names:
                 for l in self.quantitiesList:
                     if(l.name == n):
@@ -1056,6 +1976,8 @@ class ModelicaSystem(object):
     #to set options for simulation, optimization and linearization
     def setOptions(self, options, namesList, valuesList, index = None):
         try:
+            if index is not None:
+                self.detachXml()
             for opt in options: 
                 if opt in namesList: 
                     if opt == 'stopTime':
@@ -1087,6 +2009,19 @@ class ModelicaSystem(object):
     
         return translateModelFMUResult
     
+    #to load an FMU (default: the one written by convertMo2Fmu()) for in-process simulation
+    #returns an OMFMU.FMU, e.g. model.loadFMU().instantiate().simulate(0.0, 1.0, 0.01)
+    def loadFMU(self, fmuFile=None):
+        if fmuFile is None:
+            fmuFile = '{}.fmu'.format(self.modelName.replace('.', '_'))
+        if not os.path.exists(fmuFile):
+            print "Error: FMU file does not exist"
+            return
+        try:
+            return OMFMU.FMU(fmuFile)
+        except OMFMU.FMUError as e:
+            print 'Error!!! ', e
+
     #to convert FMU to Modelica model
     def convertFmu2Mo(self, fmuName):
         convertFmu2MoError = ''
@@ -1110,6 +2045,118 @@ class ModelicaSystem(object):
             return
         return optimizeResult
     
+    #to build the model with equation block profiling (as <model>_profile), simulate it with the current
+    #settings and return the profiled blocks ranked by time (see OMResult.readProfile), including
+    #the variables each block defines; the regular executable is left untouched
+    def profile(self, profiling='blocks+html', clock='RT'):
+        if self.getconn is None:
+            print 'Error!!! building needs an omc session'
+            return
+        prefix = '{}_profile'.format(self.modelName)
+        self.requestApi('setCommandLineOptions', '"--profiling={}"'.format(profiling))
+        try:
+            buildResult = self.requestApi('buildModel', self.modelName, 'fileNamePrefix="{}"'.format(prefix))
+            buildError = self.requestApi('getErrorString')
+        finally:
+            self.requestApi('setCommandLineOptions', '"--profiling=none"')
+        if not buildResult or not buildResult[0]:
+            print buildError
+            return
+        if (self.inputFlag):#if model has input quantities
+            if not self.simInput():#create csv file
+                return
+        exeFile = os.path.abspath('{}.{}'.format(prefix, "exe") if sys.platform == 'win32' else prefix)
+        cmd = [exeFile, '-f=' + self.getXmlFile(), '-r={}_res.mat'.format(prefix), '-clock=' + clock]
+        if (self.inputFlag):
+            cmd.append("-csvInput=" + self.csvFile)
+        run = SimulationRun(cmd, logFile='{}.log'.format(prefix))
+        if run.wait() != 0 or not os.path.exists('{}_prof.json'.format(prefix)):
+            print run.log()
+            return
+        return OMResult.readProfile('{}_prof.json'.format(prefix), '{}_info.json'.format(prefix))
+
+    #to build the optimization executable (<model>_optimize) once for multiStartOptimize
+    def buildOptimization(self):
+        if self.getconn is None:
+            print 'Error!!! building needs an omc session'
+            return
+        prefix = '{}_optimize'.format(self.modelName)
+        options = dict(zip(self.optimizeOptionsNamesList, self.optimizeOptionsValuesList))
+        properties = 'method="optimization", fileNamePrefix="{}", startTime={}, stopTime={}, numberOfIntervals={}, tolerance={}'.format(
+            prefix, options['startTime'], options['stopTime'], options['numberOfIntervals'], options['tolerance'])
+        buildResult = self.requestApi('buildModel', self.modelName, properties)
+        buildError = self.requestApi('getErrorString')
+        if not buildResult or not buildResult[0]:
+            print buildError
+            return
+        self.optimizeExeFile = os.path.abspath('{}.{}'.format(prefix, "exe") if sys.platform == 'win32' else prefix)
+        self.optimizeXmlFile = os.path.abspath(buildResult[1])
+        return self.optimizeExeFile
+
+    #to run optimizations concurrently from several start values and option sets (all combinations)
+    #startValues is a list of dicts of start/parameter values, optionSets a list of dicts of optimization
+    #options (startTime, stopTime, numberOfIntervals, tolerance, simflags); every run gets its own directory
+    #once a run reaches an objective <= target the remaining runs are cancelled
+    #returns a dict with 'objective' (ascending, nan for failed or cancelled runs), 'runs' (the
+    #(startValues, optionSet) of each ranked run) and 'time' plus every output as arrays indexed by rank
+    #executor (see OMExecutor) runs the optimizations, default is a pool of workers threads; runs of thread
+    #and serial executors are cancelled at the target, other executors finish the runs they already started
+    def multiStartOptimize(self, startValues, optionSets=None, outputs=None, workers=None, target=None, keepFiles=False,
+                           executor=None):
+        if getattr(self, 'optimizeExeFile', None) is None and self.buildOptimization() is None:
+            return
+        names = set()
+        for sv in startValues:
+            names.update(sv.keys())
+        if not self.checkAvailability(list(names), self.qNamesList):
+            return
+        if outputs is None:
+            outputs = [n for n in self.cNamesList if not n.startswith('der(')]
+        if not self.checkAvailability(outputs, self.qNamesList):
+            return
+        runs = list(itertools.product(startValues, optionSets or [{}]))
+        defaults = dict(zip(self.optimizeOptionsNamesList, self.optimizeOptionsValuesList))
+        token = uuid.uuid4().hex
+        tasks = []
+        for (sv, opt) in runs:
+            options = dict(defaults, **opt)
+            (start, stop) = (float(options['startTime']), float(options['stopTime']))
+            settings = [('startTime', start), ('stopTime', stop), ('tolerance', float(options['tolerance'])),
+                        ('stepSize', (stop - start) / float(options['numberOfIntervals']))]
+            flags = str(options.get('simflags') or '').split()
+            tasks.append((self.optimizeExeFile, self.optimizeXmlFile, settings + sorted(sv.items()), flags, outputs, token))
+        objectives = np.full(len(runs), np.nan)
+        trajectories = [None] * len(runs)
+        if executor is None:
+            #the runs are subprocesses, threads waiting for them suffice and can cancel them
+            executor = OMExecutor.ThreadExecutor(workers)
+            ownExecutor = True
+        else:
+            ownExecutor = False
+        finished = _iterIsolated(_optimizeRun, tasks, prefix='{}_optimize_'.format(self.modelName),
+                                 keepFiles=keepFiles, executor=executor)
+        try:
+            for (i, r) in finished:
+                if r is None:
+                    continue
+                (objectives[i], trajectories[i]) = r
+                if target is not None and r[0] <= target:
+                    _cancelledOptimizations.add(token)
+                    break
+        finally:
+            finished.close()
+            if ownExecutor:
+                executor.close()
+                _cancelledOptimizations.discard(token)
+        if all(t is None for t in trajectories):
+            print 'Error!!! no optimization run succeeded'
+            return
+        order = np.argsort(objectives, kind='mergesort') #nan is sorted last
+        results = {'objective': objectives[order], 'runs': [runs[i] for i in order]}
+        for v in ['time'] + outputs:
+            results[v] = _stackRuns([trajectories[i][v] if trajectories[i] is not None else None for i in order])
+        return results
+
     #to linearize model
     def linearize(self):
         cName = self.modelName
@@ -1121,4 +2168,197 @@ class ModelicaSystem(object):
         if linearizeError:
             print linearizeError
             return
-        return linearizeResult
\ No newline at end of file
+        return linearizeResult
+
+
+#to build, simulate and check all models of a library, e.g. before upgrading to a new version of it
+#models are found with getClassNames(recursive=true) and isModel (pattern filters their names),
+#built in several omc sessions at once and simulated in parallel with a timeout per model
+#results are compared with referenceDir/<model>.mat or .csv where present: every variable of the
+#reference is resampled onto its time points and passes if |value - reference| <= atol + rtol*|reference|
+class LibraryRegression(object):
+
+    def __init__(self, library, fileName=None, pattern=None, referenceDir=None, workDir=None,
+                 sessions=2, workers=None, timeout=600.0, rtol=1e-3, atol=1e-6):
+        self.library = library #top level class of the library
+        self.fileName = fileName #package.mo of the library, loaded with loadModel(library) if None
+        self.pattern = re.compile(pattern) if pattern is not None else None
+        self.referenceDir = referenceDir
+        self.workDir = os.path.abspath(workDir or tempfile.mkdtemp(prefix='{}_regression_'.format(library)))
+        self.sessions = sessions
+        self.workers = workers or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.rtol = rtol
+        self.atol = atol
+        self.report = [] #one dict per model, see run()
+
+    #to start an omc session working in workDir with the library loaded
+    def openSession(self, workDir):
+        session = OMCSession()
+        session.sendExpression('cd("{}")'.format(workDir.replace('\\', '/')))
+        if self.fileName is not None:
+            loaded = session.sendExpression('loadFile("{}")'.format(os.path.abspath(self.fileName).replace('\\', '/')))
+        else:
+            loaded = session.sendExpression('loadModel({})'.format(self.library))
+        if loaded is not True:
+            print 'Error!!! loading', self.library, 'failed:', session.sendExpression('getErrorString()')
+        return session
+
+    #to get the names of all non partial models of the library matching pattern
+    def discoverModels(self, session):
+        names = session.sendExpression('getClassNames({}, recursive=true)'.format(self.library)) or ()
+        models = []
+        for name in names:
+            name = '{}.{}'.format(self.library, name) if not name.startswith(self.library + '.') else name
+            if self.pattern is not None and not self.pattern.search(name):
+                continue
+            if session.sendExpression('isModel({})'.format(name)) and not session.sendExpression('isPartial({})'.format(name)):
+                models.append(name)
+        return models
+
+    #to build every model with one thread per omc session, each session in its own directory
+    #returns a dict model -> (exeFile, xmlFile, buildTime) for the models that could be built
+    def buildModels(self, models, firstSession=None):
+        queue = list(models)[::-1]
+        lock = threading.Lock()
+        builds = {}
+        def buildWorker(index):
+            session = firstSession if index == 0 and firstSession is not None else None
+            sessionDir = os.path.join(self.workDir, 'build{}'.format(index))
+            if not os.path.isdir(sessionDir):
+                os.makedirs(sessionDir)
+            if session is None:
+                session = self.openSession(sessionDir)
+            else:
+                session.sendExpression('cd("{}")'.format(sessionDir.replace('\\', '/')))
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    model = queue.pop()
+                start = time.time()
+                result = session.sendExpression('buildModel({})'.format(model))
+                buildTime = time.time() - start
+                exeFile = os.path.join(sessionDir, model + ('.exe' if sys.platform == 'win32' else ''))
+                if not result or not result[0] or not os.path.exists(exeFile):
+                    message = session.sendExpression('getErrorString()')
+                    with lock:
+                        self.setStatus(model, 'build failed', buildTime=buildTime, message=message)
+                    continue
+                with lock:
+                    builds[model] = (exeFile, os.path.join(sessionDir, result[1]), buildTime)
+        threads = multiprocessing.pool.ThreadPool(self.sessions)
+        try:
+            threads.map(buildWorker, range(self.sessions))
+        finally:
+            threads.close()
+            threads.join()
+        return builds
+
+    #to simulate the built models in parallel, returns a dict model -> result file
+    def simulateModels(self, builds):
+        models = sorted(builds)
+        jobs = []
+        for model in models:
+            (exeFile, xmlFile, buildTime) = builds[model]
+            runDir = os.path.join(self.workDir, 'runs', model)
+            if not os.path.isdir(runDir):
+                os.makedirs(runDir)
+            flags = ['-r=' + os.path.join(runDir, model + '_res.mat'), '-inputPath=' + os.path.dirname(xmlFile)]
+            jobs.append((_executableCommand(exeFile, xmlFile, [('outputFormat', 'mat')], flags), runDir))
+        results = {}
+        for (i, run) in _iterRuns(jobs, self.workers, self.timeout):
+            model = models[i]
+            entry = self.setStatus(model, 'simulated', buildTime=builds[model][2], simulationTime=run.wallTime)
+            if run.timedOut:
+                entry.update(status='timeout', message='cancelled after {} s'.format(self.timeout))
+            elif run.returncode != 0:
+                entry.update(status='simulation failed', message=run.log()[-2000:])
+            else:
+                results[model] = os.path.join(jobs[i][1], model + '_res.mat')
+        return results
+
+    #to read a reference result file (.mat or .csv) as (names, (variables, time) array), time first
+    def readReference(self, fileName):
+        if fileName.endswith('.mat'):
+            reader = OMResult.MatResult(fileName)
+            try:
+                names = ['time'] + [n for n in reader.names if n != 'time']
+                return (names, np.array(reader.getVariables(names)))
+            finally:
+                reader.close()
+        with open(fileName, 'r') as f:
+            names = [n.strip().strip('"') for n in f.readline().strip().rstrip(',').split(',')]
+            values = np.loadtxt(f, delimiter=',', usecols=range(len(names)), ndmin=2).T
+        return (names, values)
+
+    #to compare a result file with the reference of model, returns the fields of its report entry
+    def compareResult(self, model, resultFile):
+        references = [os.path.join(self.referenceDir, model + ext) for ext in ('.mat', '.csv')] if self.referenceDir else []
+        references = [r for r in references if os.path.exists(r)]
+        if not references:
+            return {'status': 'no reference'}
+        (names, reference) = self.readReference(references[0])
+        result = OMResult.MatResult(resultFile)
+        try:
+            variables = [n for n in names[1:] if n in result]
+            values = np.array(result.getVariables(['time'] + variables))
+        finally:
+            result.close()
+        missing = [n for n in names[1:] if n not in variables]
+        # all variables at once: (time, variables) arrays of result and reference
+        actual = OMResult.resample([values], reference[0])[0]
+        expected = reference[[names.index(v) for v in variables]].T
+        error = np.abs(actual - expected)
+        failed = np.any(error > self.atol + self.rtol * np.abs(expected), axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative = np.where(error > 0, error / np.maximum(np.abs(expected), self.atol), 0.0)
+        return {'status': 'failed' if failed.any() or missing else 'passed', 'compared': len(variables),
+                'failedVariables': [v for (v, f) in zip(variables, failed) if f], 'missingVariables': missing,
+                'maxRelativeError': float(relative.max()) if relative.size else 0.0}
+
+    #to add or update the report entry of model
+    def setStatus(self, model, status, **fields):
+        for entry in self.report:
+            if entry['model'] == model:
+                break
+        else:
+            entry = {'model': model, 'buildTime': None, 'simulationTime': None, 'compared': 0,
+                     'failedVariables': [], 'missingVariables': [], 'maxRelativeError': None, 'message': ''}
+            self.report.append(entry)
+        entry.update(fields)
+        entry['status'] = status
+        return entry
+
+    #to discover, build, simulate and compare all models; returns the report, a list with one dict
+    #per model: model, status (passed, failed, no reference, build failed, simulation failed, timeout),
+    #buildTime, simulationTime, compared, failedVariables, missingVariables, maxRelativeError, message
+    def run(self, models=None):
+        self.report = []
+        session = None
+        if models is None:
+            firstDir = os.path.join(self.workDir, 'build0')
+            if not os.path.isdir(firstDir):
+                os.makedirs(firstDir)
+            session = self.openSession(firstDir)
+            models = self.discoverModels(session)
+        builds = self.buildModels(models, session)
+        for (model, resultFile) in sorted(self.simulateModels(builds).items()):
+            fields = self.compareResult(model, resultFile)
+            self.setStatus(model, fields.pop('status'), **fields)
+        self.report.sort(key=lambda e: e['model'])
+        return self.report
+
+    #to write the report as csv with one row per model
+    def writeReport(self, fileName):
+        columns = ['model', 'status', 'buildTime', 'simulationTime', 'compared', 'failedVariables',
+                   'missingVariables', 'maxRelativeError', 'message']
+        with open(fileName, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for entry in self.report:
+                row = [entry[c] for c in columns]
+                row[5] = ' '.join(row[5])
+                row[6] = ' '.join(row[6])
+                row[8] = ' '.join(str(row[8]).split())[:500]
+                writer.writerow(row)
@@ -0,0 +1,165 @@
+/*
+ * Minimal FMI 2.0 FMU (model exchange and co-simulation) for the OMFMU tests:
+ *   der(x) = -k*x + u, y = 2*x, event indicator x - 0.5 counting its crossings.
+ * Only the types and functions used by OMFMU are declared, see modelDescription.xml.
+ */
+#include <stdlib.h>
+#include <string.h>
+
+typedef void *Component;
+typedef unsigned int ValueReference;
+
+typedef struct {
+  void (*logger)(void *, const char *, int, const char *, const char *, ...);
+  void *(*allocateMemory)(size_t, size_t);
+  void (*freeMemory)(void *);
+  void *stepFinished;
+  void *environment;
+} CallbackFunctions;
+
+typedef struct {
+  int newDiscreteStatesNeeded, terminateSimulation, nominalsChanged, valuesChanged, nextEventTimeDefined;
+  double nextEventTime;
+} EventInfo;
+
+typedef struct {
+  double x, k, u, time;
+  int crossings;
+  CallbackFunctions callbacks;
+} Model;
+
+enum { OK = 0, ERROR = 3 };
+
+static void start(Model *m) {
+  m->x = 1;
+  m->k = 1;
+  m->u = 0;
+  m->time = 0;
+  m->crossings = 0;
+}
+
+static double derivative(Model *m) { return -m->k * m->x + m->u; }
+
+static double get(Model *m, ValueReference vr) {
+  switch (vr) {
+  case 0: return m->x;
+  case 1: return derivative(m);
+  case 2: return m->k;
+  case 3: return m->u;
+  default: return 2 * m->x;
+  }
+}
+
+Component fmi2Instantiate(const char *name, int type, const char *guid, const char *resources,
+                          const CallbackFunctions *callbacks, int visible, int loggingOn) {
+  Model *m;
+  if (strcmp(guid, "{g}") != 0) {
+    callbacks->logger(callbacks->environment, name, ERROR, "error", "wrong guid");
+    return NULL;
+  }
+  m = (Model *)callbacks->allocateMemory(1, sizeof(Model));
+  start(m);
+  m->callbacks = *callbacks;
+  callbacks->logger(callbacks->environment, name, OK, "info", "instantiated");
+  return m;
+}
+
+void fmi2FreeInstance(Component c) { ((Model *)c)->callbacks.freeMemory(c); }
+
+int fmi2SetupExperiment(Component c, int toleranceDefined, double tolerance, double startTime,
+                        int stopTimeDefined, double stopTime) {
+  ((Model *)c)->time = startTime;
+  return OK;
+}
+
+int fmi2EnterInitializationMode(Component c) { return OK; }
+int fmi2ExitInitializationMode(Component c) { return OK; }
+int fmi2Terminate(Component c) { return OK; }
+
+int fmi2Reset(Component c) {
+  start((Model *)c);
+  return OK;
+}
+
+int fmi2GetReal(Component c, const ValueReference *vr, size_t n, double *values) {
+  size_t i;
+  for (i = 0; i < n; i++) {
+    if (vr[i] > 4) return ERROR;
+    values[i] = get((Model *)c, vr[i]);
+  }
+  return OK;
+}
+
+int fmi2SetReal(Component c, const ValueReference *vr, size_t n, const double *values) {
+  Model *m = (Model *)c;
+  size_t i;
+  for (i = 0; i < n; i++) {
+    if (vr[i] == 0) m->x = values[i];
+    else if (vr[i] == 2) m->k = values[i];
+    else if (vr[i] == 3) m->u = values[i];
+    else return ERROR;
+  }
+  return OK;
+}
+
+int fmi2GetInteger(Component c, const ValueReference *vr, size_t n, int *values) {
+  size_t i;
+  for (i = 0; i < n; i++) values[i] = ((Model *)c)->crossings;
+  return OK;
+}
+
+int fmi2SetInteger(Component c, const ValueReference *vr, size_t n, const int *values) { return ERROR; }
+int fmi2GetBoolean(Component c, const ValueReference *vr, size_t n, int *values) { return ERROR; }
+int fmi2SetBoolean(Component c, const ValueReference *vr, size_t n, const int *values) { return ERROR; }
+
+int fmi2DoStep(Component c, double currentTime, double stepSize, int noSetFMUStatePriorToCurrentPoint) {
+  Model *m = (Model *)c;
+  int i;
+  for (i = 0; i < 100; i++) m->x += stepSize / 100 * derivative(m);
+  m->time = currentTime + stepSize;
+  return OK;
+}
+
+int fmi2SetTime(Component c, double time) {
+  ((Model *)c)->time = time;
+  return OK;
+}
+
+int fmi2EnterEventMode(Component c) {
+  ((Model *)c)->crossings++;
+  return OK;
+}
+
+int fmi2NewDiscreteStates(Component c, EventInfo *info) {
+  memset(info, 0, sizeof(EventInfo));
+  return OK;
+}
+
+int fmi2EnterContinuousTimeMode(Component c) { return OK; }
+
+int fmi2CompletedIntegratorStep(Component c, int noSetFMUStatePriorToCurrentPoint, int *enterEventMode,
+                                int *terminateSimulation) {
+  *enterEventMode = 0;
+  *terminateSimulation = 0;
+  return OK;
+}
+
+int fmi2SetContinuousStates(Component c, const double *x, size_t n) {
+  ((Model *)c)->x = x[0];
+  return OK;
+}
+
+int fmi2GetContinuousStates(Component c, double *x, size_t n) {
+  x[0] = ((Model *)c)->x;
+  return OK;
+}
+
+int fmi2GetDerivatives(Component c, double *derivatives, size_t n) {
+  derivatives[0] = derivative((Model *)c);
+  return OK;
+}
+
+int fmi2GetEventIndicators(Component c, double *indicators, size_t n) {
+  indicators[0] = ((Model *)c)->x - 0.5;
+  return OK;
+}
@@ -0,0 +1,170 @@
+"""
+Helpers for tests that need no omc: a MAT v4 result file writer and a
+stand-in simulation executable with its init xml.
+"""
+
+import os
+import sys
+import stat
+import struct
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+
+def _matrix(f, name, mopt, data, rows, cols):
+    f.write(struct.pack('<5i', mopt, rows, cols, 0, len(name) + 1))
+    f.write(name.encode('latin-1') + b'\0')
+    f.write(data)
+
+
+def _text(strings):
+    width = max(len(s) for s in strings) or 1
+    return ''.join(s.ljust(width, '\0') for s in strings).encode('latin-1'), width
+
+
+def writeMat(fileName, variables, parameters=(), aliases=(), rows=None):
+    """
+    Writes an OpenModelica style (binTrans) MAT v4 result file.
+
+    variables is a list of (name, values) with time first, parameters a
+    list of (name, value) and aliases a list of (name, aliased variable,
+    negated). rows limits data_2 to its first rows complete rows, as in
+    the file of a running simulation.
+    """
+    time = np.asarray(variables[0][1], dtype='<f8')
+    names = [n for (n, _) in variables] + [n for (n, _) in parameters] + [n for (n, _, _) in aliases]
+    info = [[0, 1, 0, -1]]
+    info += [[2, i + 2, 0, -1] for i in range(len(variables) - 1)]
+    info += [[1, i + 2, 0, 0] for i in range(len(parameters))]
+    variableIndex = dict((n, i) for (i, (n, _)) in enumerate(variables))
+    for (_, target, negated) in aliases:
+        column = variableIndex[target] + 1
+        info.append([2, -column if negated else column, 0, -1])
+    data1 = np.array([[time[0]] + [v for (_, v) in parameters], [time[-1]] + [v for (_, v) in parameters]], dtype='<f8')
+    data2 = np.column_stack([np.asarray(v, dtype='<f8') for (_, v) in variables])
+    if rows is not None:
+        data2 = data2[:rows]
+    with open(fileName, 'wb') as f:
+        aclass = ['Atrajectory', '1.1', '', 'binTrans']
+        _matrix(f, 'Aclass', 51, ''.join(''.join(a[j] if j < len(a) else '\0' for a in aclass) for j in range(11)).encode('latin-1'), 4, 11)
+        (data, width) = _text(names)
+        _matrix(f, 'name', 51, data, width, len(names))
+        (data, width) = _text(['' for _ in names])
+        _matrix(f, 'description', 51, data, width, len(names))
+        _matrix(f, 'dataInfo', 20, np.array(info, dtype='<i4').tostring(), 4, len(names))
+        _matrix(f, 'data_1', 0, data1.tostring(), data1.shape[1], 2)
+        _matrix(f, 'data_2', 0, data2.tostring(), data2.shape[1], len(data2) if rows is None else len(time))
+
+
+INIT_XML = """<?xml version='1.0' encoding='UTF-8'?>
+<fmiModelDescription modelName="M">
+  <DefaultExperiment outputFormat="mat" solver="dassl" startTime="0.0" stepSize="0.1" stopTime="1.0" tolerance="1e-06" variableFilter=".*" />
+  <ModelVariables>
+  <ScalarVariable causality="local" isValueChangeable="true" name="x" valueReference="1000" variability="continuous"><Real fixed="true" start="1.0" /></ScalarVariable>
+  <ScalarVariable causality="local" isValueChangeable="false" name="der(x)" valueReference="1001" variability="continuous"><Real /></ScalarVariable>
+  <ScalarVariable causality="output" isValueChangeable="false" name="y" valueReference="1002" variability="continuous"><Real /></ScalarVariable>
+  <ScalarVariable causality="input" isValueChangeable="true" name="u" valueReference="1003" variability="continuous"><Real start="0.0" /></ScalarVariable>
+  <ScalarVariable causality="input" isValueChangeable="true" name="v" valueReference="1005" variability="continuous"><Real start="0.0" /></ScalarVariable>
+  <ScalarVariable causality="parameter" isValueChangeable="true" name="k" valueReference="1004" variability="parameter"><Real start="2.0" /></ScalarVariable>
+  <ScalarVariable causality="parameter" isValueChangeable="true" name="delay" valueReference="1006" variability="parameter"><Real start="0.0" /></ScalarVariable>
+  </ModelVariables>
+</fmiModelDescription>
+"""
+
+# x' = -k*x (+ the input u added to x when inputs are given), y = 2*x, reads its parameters from the init xml
+# reports the Ipopt objective (x(0) - 2)^2 + k and takes delay seconds
+# with -l=<time> it writes linear_M.mo of x' = -k*x + u, y = 2*x instead
+# with -lv=LOG_STATS it prints the statistics captured in data/M_stats.log
+# with -iif=<result file> -iit=<time> it starts from x stored at that time of the result file
+# it records time and the variables matching the variableFilter option
+FAKE_EXECUTABLE = """#!{python}
+import os
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+import numpy as np
+sys.path.insert(0, {testDir!r})
+import support
+LINEAR = '''model linear_M
+  parameter Integer n = 1;
+  parameter Integer m = 1;
+  parameter Integer p = 1;
+  parameter Real A[n, n] = [{{k!r}}];
+  parameter Real B[n, m] = [1];
+  parameter Real C[p, n] = [2];
+  parameter Real D[p, m] = zeros(1, 1);
+  Real 'x_x' = x[1];
+  Real 'u_u' = u[1];
+  Real 'y_y' = y[1];
+end linear_M;
+'''
+args = dict(a.split('=', 1) if '=' in a else (a, '') for a in sys.argv[1:])
+root = ET.parse(args['-f']).getroot()
+options = dict(root.find('DefaultExperiment').attrib)
+starts = dict((sv.get('name'), c.get('start')) for sv in root.iter('ScalarVariable') for c in sv)
+for kv in filter(None, args.get('-override', '').split(',')):
+    (name, value) = kv.split('=', 1)
+    if name in options:
+        options[name] = value
+    else:
+        starts[name] = value
+(k, x0) = (float(starts['k']), float(starts['x']))
+if '-l' in args:
+    with open('linear_M.mo', 'w') as f:
+        f.write(LINEAR.format(k=-k))
+    sys.exit(0)
+if '-iif' in args:
+    sys.path.insert(0, os.path.dirname({testDir!r}))
+    from OMPython import OMResult
+    (initTime, initX) = OMResult.readMatResult(args['-iif'], ['time', 'x'])
+    x0 = float(np.interp(float(args['-iit']), initTime, initX))
+(t0, t1, h) = (float(options['startTime']), float(options['stopTime']), float(options['stepSize']))
+t = np.arange(t0, t1 + h / 2, h)
+x = x0 * np.exp(-k * (t - t0))
+u = np.zeros_like(t)
+if '-csvInput' in args:
+    data = np.loadtxt(args['-csvInput'], delimiter=',', skiprows=1, ndmin=2)
+    u = np.interp(t, data[:, 0], data[:, 1])
+    x = x + u
+variables = [('time', t), ('x', x), ('der(x)', -k * x), ('y', 2 * x), ('u', u)]
+recorded = re.compile('(' + options['variableFilter'] + ')$')
+variables = variables[:1] + [(n, v) for (n, v) in variables[1:] if recorded.match(n)]
+time.sleep(float(starts['delay']))
+support.writeMat(args.get('-r', 'M_res.mat'), variables, [('k', k)])
+print('Objective...............:   {{0!r}}    {{1!r}}'.format(0.5 * ((x0 - 2) ** 2 + k), (x0 - 2) ** 2 + k))
+if 'LOG_STATS' in args.get('-lv', '').split(','):
+    with open({statsLog!r}) as f:
+        sys.stdout.write(f.read())
+else:
+    print('LOG_SUCCESS | info | The simulation finished successfully.')
+"""
+
+
+def writeFakeModel(directory):
+    """Writes the executable M and M_init.xml into directory and returns their paths."""
+    exeFile = os.path.join(directory, 'M')
+    xmlFile = os.path.join(directory, 'M_init.xml')
+    with open(exeFile, 'w') as f:
+        testDir = os.path.dirname(os.path.abspath(__file__))
+        f.write(FAKE_EXECUTABLE.format(python=sys.executable, testDir=testDir, statsLog=os.path.join(testDir, 'data', 'M_stats.log')))
+    os.chmod(exeFile, os.stat(exeFile).st_mode | stat.S_IXUSR)
+    with open(xmlFile, 'w') as f:
+        f.write(INIT_XML)
+    return (exeFile, xmlFile)
+
+
+class TemporaryDirectoryTestCase(unittest.TestCase):
+    """Runs every test in a fresh temporary working directory."""
+
+    def setUp(self):
+        self.oldDir = os.getcwd()
+        self.tmpDir = tempfile.mkdtemp(prefix='OMPythonTest_')
+        os.chdir(self.tmpDir)
+
+    def tearDown(self):
+        os.chdir(self.oldDir)
+        shutil.rmtree(self.tmpDir, ignore_errors=True)
@@ -0,0 +1,481 @@
+import os
+import re
+import sys
+import glob
+import time
+import tempfile
+import pickle
+import unittest
+import multiprocessing
+import multiprocessing.pool
+
+import numpy as np
+from StringIO import StringIO
+
+from support import TemporaryDirectoryTestCase, writeFakeModel, writeMat
+import OMPython
+from OMPython import ModelicaSystem, OMCache, OMExecutor
+
+
+def _simulateSnapshot(snapshot):
+    m = pickle.loads(snapshot)
+    m.simulate()
+    return m.getSolutions(['x'])[0][-1]
+
+
+class _CountingExecutor(OMExecutor.Executor):
+    """Serial executor counting its tasks, interrupted (as by Ctrl-C) after interruptAfter of them."""
+
+    def __init__(self, interruptAfter=None):
+        self.interruptAfter = interruptAfter
+        self.tasks = 0
+
+    def imapUnordered(self, function, args):
+        for (index, a) in enumerate(args):
+            if self.tasks == self.interruptAfter:
+                raise KeyboardInterrupt
+            self.tasks += 1
+            yield (index, function(a))
+
+
+class ModelicaSystemTest(TemporaryDirectoryTestCase):
+    """ModelicaSystem on a prebuilt stand-in executable, no omc needed."""
+
+    def setUp(self):
+        TemporaryDirectoryTestCase.setUp(self)
+        (self.exeFile, self.xmlFile) = writeFakeModel(self.tmpDir)
+        self.model = ModelicaSystem.fromBuild(self.exeFile, self.xmlFile)
+
+    def finalValue(self, model, name='x'):
+        return model.getSolutions([name])[0][-1]
+
+    def testFromBuildKeepsPrebuiltXml(self):
+        with open(self.xmlFile) as f:
+            prebuilt = f.read()
+        m = self.model
+        m.setParameterValues(['k'], [1])
+        m.setSimulationOptions(stopTime=2.0)
+        with open(self.xmlFile) as f:
+            self.assertEqual(f.read(), prebuilt)
+        self.assertNotEqual(os.path.abspath(m.xmlFile), self.xmlFile)
+        m.simulate()
+        self.assertAlmostEqual(self.finalValue(m), np.exp(-2.0))
+        other = ModelicaSystem.fromBuild(self.exeFile, self.xmlFile)
+        self.assertNotEqual(other.resultFile, m.resultFile)
+        other.simulate()
+        self.assertAlmostEqual(self.finalValue(other), np.exp(-2.0))
+
+    def testCloneIsolatedFromLaterWritesOfOrigin(self):
+        m = self.model
+        m.setParameterValues(['k'], [2])
+        m.detachXml()
+        c = m.clone()
+        m.setParameterValues(['k'], [1])
+        self.assertEqual(c.getParameterValues('k'), 2)
+        self.assertNotEqual(c.xmlFile, m.xmlFile)
+        c.simulate()
+        self.assertAlmostEqual(self.finalValue(c), np.exp(-2.0))
+        m.simulate()
+        self.assertAlmostEqual(self.finalValue(m), np.exp(-1.0))
+
+    def testOriginIsolatedFromWritesOfClone(self):
+        m = self.model
+        c = m.clone()
+        c.setParameterValues(['k'], [1])
+        self.assertEqual(float(m.getParameterValues('k')), 2.0)
+        m.simulate()
+        c.simulate()
+        self.assertAlmostEqual(self.finalValue(m), np.exp(-2.0))
+        self.assertAlmostEqual(self.finalValue(c), np.exp(-1.0))
+
+    def lazyModel(self):
+        #stands in for lazy=True: the attributes set by the build are filled in by a background thread
+        m = ModelicaSystem.fromBuild(self.exeFile, self.xmlFile)
+        for attr in ['getconn', 'xmlFile', 'exeFile', 'tree'] + list(m.lazyAttributes):
+            m.__dict__.pop(attr, None)
+        def build():
+            time.sleep(0.2)
+            m.getconn = None
+            m.exeFile = self.exeFile
+            m.loadXml(self.xmlFile, lazy=True)
+        self.pool = multiprocessing.pool.ThreadPool(1)
+        m.buildFuture = self.pool.apply_async(build)
+        return m
+
+    def testCloneDuringLazyBuild(self):
+        c = self.lazyModel().clone()
+        self.assertEqual(c.exeFile, self.exeFile)
+        self.assertEqual(float(c.getParameterValues('k')), 2.0)
+        c.simulate()
+        self.assertAlmostEqual(self.finalValue(c), np.exp(-2.0))
+
+    def testPickleDuringLazyBuild(self):
+        p = pickle.loads(pickle.dumps(self.lazyModel(), 2))
+        self.assertEqual(p.exeFile, self.exeFile)
+        self.assertEqual(float(p.getParameterValues('k')), 2.0)
+
+    def testSweepWithQueueWorkers(self):
+        runDirs = os.path.join(tempfile.gettempdir(), 'M_sweep_*')
+        before = set(glob.glob(runDirs))
+        with OMExecutor.QueueExecutor(('127.0.0.1', 0)) as executor:
+            executor.startLocalWorkers(2)
+            (runs, results) = self.model.sweep({'k': [1, 2, 3]}, outputs=['x'], executor=executor)
+        self.assertEqual(runs, [{'k': 1}, {'k': 2}, {'k': 3}])
+        np.testing.assert_allclose(results['x'][:, -1], np.exp(-np.array([1.0, 2.0, 3.0])))
+        self.assertEqual(set(glob.glob(runDirs)), before)
+
+    def setHeldInputs(self, m):
+        m.setInputValues('u', [(0.0, 5.0), (1.0, 5.0)])
+        m.setInputValues('v', [(0.0, 0.0)])
+
+    def testSweepWithInputs(self):
+        m = self.model
+        self.setHeldInputs(m)
+        m.simulate()
+        self.assertAlmostEqual(self.finalValue(m, 'u'), 5.0)
+        for executor in [None, OMExecutor.Executor()]:
+            (runs, results) = m.sweep({'k': [1, 2]}, outputs=['x', 'u'], executor=executor)
+            np.testing.assert_allclose(results['u'][:, -1], [5.0, 5.0])
+            np.testing.assert_allclose(results['x'][:, -1], 5.0 + np.exp(-np.array([1.0, 2.0])))
+
+    def testEnsembleWithInputs(self):
+        m = self.model
+        self.setHeldInputs(m)
+        stats = m.ensemble({'k': ('uniform', 1.0, 2.0)}, 8, outputs=['x', 'u'], workers=2, seed=0)
+        self.assertEqual((stats['count'], stats['failed']), (8, []))
+        np.testing.assert_allclose(stats['min'][:, 1], np.full(len(stats['time']), 5.0))
+        np.testing.assert_allclose(stats['max'][:, 1], np.full(len(stats['time']), 5.0))
+        #x(1) = u + exp(-k) with k drawn from [1, 2)
+        self.assertGreater(stats['min'][-1, 0], 5.0 + np.exp(-2.0))
+        self.assertLess(stats['max'][-1, 0], 5.0 + np.exp(-1.0) + 1e-9)
+
+    def testLinearizeBatch(self):
+        m = self.model
+        executor = _CountingExecutor()
+        linear = m.linearizeBatch([{'k': 1.0}, {'k': 2.0}, {'k': 1.0}], executor=executor)
+        self.assertEqual(executor.tasks, 2)
+        np.testing.assert_array_equal(linear['A'][:, 0, 0], [-1.0, -2.0, -1.0])
+        np.testing.assert_array_equal(linear['D'], np.zeros((3, 1, 1)))
+        self.assertEqual((linear['stateNames'], linear['inputNames'], linear['outputNames']), (['x'], ['u'], ['y']))
+        #operating points linearized before are served from the per-point cache
+        executor = _CountingExecutor()
+        linear = m.linearizeBatch([{'k': 2.0}, {'k': 3.0}], executor=executor)
+        self.assertEqual(executor.tasks, 1)
+        np.testing.assert_array_equal(linear['A'][:, 0, 0], [-2.0, -3.0])
+        #but not once a setting they depend on has changed
+        m.setLinearizationOptions(stopTime=2.0)
+        m.linearizeBatch([{'k': 2.0}], executor=executor)
+        self.assertEqual(executor.tasks, 2)
+
+    def testWarmStartFromCheckpoint(self):
+        m = self.model
+        m.simulate()
+        checkpoint = m.checkpoint()
+        self.assertTrue(os.path.exists(checkpoint))
+        #the first half is shared, the second half runs with another k
+        m.setParameterValues(['k'], [1])
+        m.simulate(initFile=checkpoint, initTime=0.5)
+        (time, x) = m.getSolutions(['time', 'x'])
+        self.assertAlmostEqual(time[0], 0.5)
+        self.assertAlmostEqual(x[0], np.exp(-1.0))
+        self.assertAlmostEqual(x[-1], np.exp(-1.5))
+        self.assertIn('-iif=' + os.path.abspath(checkpoint), m.lastRun.cmd)
+        self.assertIn('-iit=0.5', m.lastRun.cmd)
+
+    def testWarmStartChecks(self):
+        m = self.model
+        m.simulate()
+        checkpoint = m.checkpoint()
+        m.setSimulationOptions(stopTime=0.5)
+        for (initFile, initTime) in [('missing.mat', 0.2), (m.resultFile, 0.2), (checkpoint, 1.5), (checkpoint, -0.1),
+                                     (checkpoint, 0.5), (checkpoint, None)]:
+            m.lastRun = None
+            m.simulate(initFile=initFile, initTime=initTime)
+            self.assertIsNone(m.lastRun, (initFile, initTime))
+        #by default the run starts at the end of the checkpoint
+        m.setSimulationOptions(stopTime=2.0)
+        m.simulate(initFile=checkpoint)
+        self.assertAlmostEqual(m.getSolutions(['time'])[0][0], 1.0)
+        self.assertAlmostEqual(self.finalValue(m), np.exp(-4.0))
+
+    def testOutputs(self):
+        m = self.model
+        m.simulate(outputs=['der(x)'], numberOfIntervals=4, noEventEmit=True)
+        self.assertIn('-noEventEmit', m.lastRun.cmd)
+        (time, derx) = m.getSolutions(['time', 'der(x)'])
+        np.testing.assert_allclose(time, [0.0, 0.25, 0.5, 0.75, 1.0])
+        np.testing.assert_allclose(derx, -2 * np.exp(-2 * time))
+        (stdout, sys.stdout) = (sys.stdout, StringIO())
+        try:
+            self.assertIsNone(m.getSolutions(['x']))
+        finally:
+            (stdout, sys.stdout) = (sys.stdout, stdout)
+        self.assertIn("['x']  not recorded in the result file (recorded outputs: ['der(x)'])", stdout.getvalue())
+        m.simulate(outputs=['nope'])
+        self.assertEqual(m.recordedOutputs, ['der(x)'])
+
+    def testVariableFilter(self):
+        names = ['der(x)', 'a.b[1,2]', 'c$x', 'x']
+        pattern = re.compile('(' + OMPython._variableFilter(names) + ')$')
+        self.assertNotIn(',', OMPython._variableFilter(names))
+        self.assertTrue(all(pattern.match(n) for n in names))
+        self.assertFalse(any(pattern.match(n) for n in ['derx', 'a.b1,2', 'ab[1,2]', 'xx', 'c']))
+
+    def optimizationModel(self):
+        m = self.model
+        (m.optimizeExeFile, m.optimizeXmlFile) = (self.exeFile, self.xmlFile)
+        return m
+
+    def testMultiStartOptimize(self):
+        startValues = [{'x': x} for x in [0.0, 1.0, 2.0, 3.0]]
+        for executor in [None, OMExecutor.ProcessExecutor(2)]:
+            results = self.optimizationModel().multiStartOptimize(startValues, outputs=['x'], workers=2, executor=executor)
+            np.testing.assert_allclose(results['objective'], [2.0, 3.0, 3.0, 6.0])
+            self.assertEqual(results['runs'][0], ({'x': 2.0}, {}))
+            self.assertAlmostEqual(results['x'][0][0], 2.0)
+            if executor is not None:
+                executor.close()
+
+    def testMultiStartOptimizeCancelsAtTarget(self):
+        startValues = [{'x': 2.0, 'delay': 0.0}] + [{'x': 0.0, 'delay': 30.0}] * 3
+        started = time.time()
+        results = self.optimizationModel().multiStartOptimize(startValues, outputs=['x'], workers=4, target=2.5)
+        self.assertLess(time.time() - started, 15.0)
+        self.assertEqual(results['objective'][0], 2.0)
+        self.assertTrue(np.isnan(results['objective'][1:]).all())
+
+    def testPickledSnapshotIsolatedFromLaterWritesOfOrigin(self):
+        m = self.model
+        m.setParameterValues(['k'], [2])
+        p = pickle.loads(pickle.dumps(m, 2))
+        m.setParameterValues(['k'], [1])
+        self.assertEqual(p.getParameterValues('k'), 2)
+        p.simulate()
+        self.assertAlmostEqual(self.finalValue(p), np.exp(-2.0))
+        m.simulate()
+        self.assertAlmostEqual(self.finalValue(m), np.exp(-1.0))
+
+    def testPickledSnapshotRestoresChangedXml(self):
+        m = self.model
+        m.setParameterValues(['k'], [3])
+        p = pickle.loads(pickle.dumps(m, 2))
+        #another process rewrites the init xml the snapshot refers to
+        with open(p.xmlFile) as f:
+            xml = f.read()
+        with open(p.xmlFile, 'w') as f:
+            f.write(xml.replace('name="k" valueReference="1004" variability="parameter"><Real start="3"',
+                                'name="k" valueReference="1004" variability="parameter"><Real start="5"'))
+        p.simulate()
+        self.assertAlmostEqual(self.finalValue(p), np.exp(-3.0))
+
+    def testPickledSnapshotInWorkerProcesses(self):
+        m = self.model
+        snapshots = []
+        for k in [1, 2, 3]:
+            m.setParameterValues(['k'], [k])
+            snapshots.append(pickle.dumps(m, 2))
+        pool = multiprocessing.Pool(3)
+        try:
+            finals = pool.map(_simulateSnapshot, snapshots)
+        finally:
+            pool.close()
+            pool.join()
+        np.testing.assert_allclose(finals, np.exp(-np.array([1.0, 2.0, 3.0])))
+
+    def testInputsRewrittenWhenSamplesMove(self):
+        m = self.model
+        m.setInputValues('u', [(0.0, 1.0)])
+        m.setInputValues('v', [(1.0, 2.0), (2.0, 3.0)])
+        self.assertTrue(m.simInput())
+        with open(m.csvFile) as f:
+            first = f.read()
+        m.setInputValues('u', [(0.0, 1.0), (1.0, 2.0)])
+        m.setInputValues('v', [(2.0, 3.0)])
+        self.assertTrue(m.simInput())
+        with open(m.csvFile) as f:
+            self.assertNotEqual(f.read(), first)
+
+    def testSimulateWithUnsetInputs(self):
+        m = self.model
+        m.setInputValues('u', [(0.0, 1.0)])
+        self.assertFalse(m.simInput())
+        m.simulate()
+        self.assertIsNone(m.lastRun)
+        self.assertFalse(os.path.exists(m.resultFile))
+
+
+
+class RunCacheTest(TemporaryDirectoryTestCase):
+    """simulate() and sweep() with a run cache on the stand-in executable."""
+
+    def setUp(self):
+        TemporaryDirectoryTestCase.setUp(self)
+        (self.exeFile, self.xmlFile) = writeFakeModel(self.tmpDir)
+        self.cache = OMCache.RunCache(os.path.join(self.tmpDir, 'runs'))
+        self.model = ModelicaSystem.fromBuild(self.exeFile, self.xmlFile, runCache=self.cache)
+
+    def testRepeatedSimulateIsServedFromCache(self):
+        m = self.model
+        m.simulate()
+        self.assertIsNotNone(m.lastRun)
+        m.simulate()
+        self.assertIsNone(m.lastRun)
+        self.assertEqual(os.path.dirname(m.getResultFile()), self.cache.entryDir(self.cache.entries()[0][2]))
+        self.assertAlmostEqual(m.getSolutions(['x'])[0][-1], np.exp(-2.0))
+        m.setParameterValues(['k'], [1])
+        m.simulate()
+        self.assertIsNotNone(m.lastRun)
+        self.assertAlmostEqual(m.getSolutions(['x'])[0][-1], np.exp(-1.0))
+        self.assertEqual(len(self.cache.entries()), 2)
+
+    def testStatsOfCachedRun(self):
+        m = self.model
+        stats = m.simulate(stats=True)
+        self.assertEqual((stats.solver, stats.steps), ('dassl', 518))
+        self.assertEqual(stats.wallTime, m.lastRun.wallTime)
+        cached = m.simulate(stats=True)
+        self.assertIsNone(m.lastRun)
+        self.assertEqual(cached.asDict(), stats.asDict())
+        self.assertIs(m.simulationStats, cached)
+
+    def testSweepResumesAfterInterruption(self):
+        grid = {'k': [1, 2, 3, 4]}
+        self.assertRaises(KeyboardInterrupt, self.model.sweep, grid, outputs=['x'], executor=_CountingExecutor(2))
+        self.assertEqual(len(self.cache.entries()), 2)
+        executor = _CountingExecutor()
+        (runs, results) = self.model.sweep(grid, outputs=['x'], executor=executor)
+        self.assertEqual(executor.tasks, 2)
+        np.testing.assert_allclose(results['x'][:, -1], np.exp(-np.array([1.0, 2.0, 3.0, 4.0])))
+
+    def testSweepWithInputs(self):
+        m = self.model
+        m.setInputValues('u', [(0.0, 5.0)])
+        m.setInputValues('v', [(0.0, 0.0)])
+        (runs, results) = m.sweep({'k': [1, 2]}, outputs=['u'], executor=_CountingExecutor())
+        np.testing.assert_allclose(results['u'][:, -1], [5.0, 5.0])
+        executor = _CountingExecutor()
+        m.sweep({'k': [1, 2]}, outputs=['u'], executor=executor)
+        self.assertEqual(executor.tasks, 0)
+        m.setInputValues('u', [(0.0, 6.0)])
+        (runs, results) = m.sweep({'k': [1, 2]}, outputs=['u'], executor=executor)
+        self.assertEqual(executor.tasks, 2)
+        np.testing.assert_allclose(results['u'][:, -1], [6.0, 6.0])
+
+    def testColumnStoreOfCachedRunCountsAgainstMaxSize(self):
+        m = self.model
+        m.simulate()
+        m.simulate()
+        (_, size, key) = self.cache.entries()[0]
+        m.storeColumns()
+        self.assertGreater(self.cache.entries()[0][1], size)
+        self.assertEqual(self.cache.entries()[0][1], OMCache._treeSize(self.cache.entryDir(key)))
+
+    def testEviction(self):
+        m = self.model
+        m.simulate()
+        size = self.cache.entries()[0][1]
+        self.cache.maxSize = 2 * size
+        for k in [1, 3]:
+            m.setParameterValues(['k'], [k])
+            m.simulate()
+        #the run with k = 2 was used least recently
+        self.assertEqual(len(self.cache.entries()), 2)
+        m.setParameterValues(['k'], [2])
+        m.simulate()
+        self.assertIsNotNone(m.lastRun)
+
+
+# the models of the stand-in library Lib: (k, delay) of the stand-in executable, None if the build fails
+LIBRARY = {'Lib.Passes': (2.0, 0.0), 'Lib.Fails': (3.0, 0.0), 'Lib.Broken': None, 'Lib.Slow': (2.0, 30.0)}
+
+
+class _FakeLibrarySession(object):
+    """Answers the expressions LibraryRegression sends to omc, builds stand-in executables."""
+
+    def __init__(self, workDir):
+        self.workDir = workDir
+
+    def sendExpression(self, expression):
+        (function, argument) = re.match(r'(\w+)\((.*)\)$', expression).groups()
+        if function == 'cd':
+            self.workDir = argument.strip('"')
+        elif function in ('loadModel', 'isModel'):
+            return True
+        elif function == 'isPartial':
+            return argument == 'Lib.Base'
+        elif function == 'getClassNames':
+            return tuple(sorted(LIBRARY)) + ('Base',)
+        elif function == 'getErrorString':
+            return 'Error: Lib.Broken does not translate'
+        elif function == 'buildModel':
+            if LIBRARY[argument] is None:
+                return ('', '')
+            (exeFile, xmlFile) = writeFakeModel(self.workDir)
+            with open(xmlFile) as f:
+                xml = f.read()
+            for (name, value) in zip(['k', 'delay'], LIBRARY[argument]):
+                xml = re.sub(r'(name="{0}" .*start=")[^"]*'.format(name), r'\g<1>{0!r}'.format(value), xml)
+            os.remove(xmlFile)
+            with open(os.path.join(self.workDir, argument + '_init.xml'), 'w') as f:
+                f.write(xml)
+            os.rename(exeFile, os.path.join(self.workDir, argument))
+            return (os.path.join(self.workDir, argument), argument + '_init.xml')
+
+
+class _Regression(OMPython.LibraryRegression):
+
+    def openSession(self, workDir):
+        return _FakeLibrarySession(workDir)
+
+
+class LibraryRegressionTest(TemporaryDirectoryTestCase):
+    """LibraryRegression of the stand-in library Lib against references of x = exp(-2 t)."""
+
+    def setUp(self):
+        TemporaryDirectoryTestCase.setUp(self)
+        self.referenceDir = os.path.join(self.tmpDir, 'references')
+        os.mkdir(self.referenceDir)
+        for model in ['Lib.Passes', 'Lib.Fails', 'Lib.Slow']:
+            with open(os.path.join(self.referenceDir, model + '.csv'), 'w') as f:
+                f.write('"time","x",\n')
+                for t in np.linspace(0.0, 1.0, 6):
+                    f.write('{0!r},{1!r},\n'.format(t, np.exp(-2 * t)))
+
+    def testRun(self):
+        regression = _Regression('Lib', referenceDir=self.referenceDir, workDir=os.path.join(self.tmpDir, 'work'),
+                                 workers=4, timeout=5.0)
+        report = dict((e['model'], e) for e in regression.run())
+        self.assertEqual(sorted(report), sorted(LIBRARY))
+        self.assertEqual(report['Lib.Passes']['status'], 'passed')
+        self.assertEqual(report['Lib.Passes']['compared'], 1)
+        self.assertEqual(report['Lib.Fails']['status'], 'failed')
+        self.assertEqual(report['Lib.Fails']['failedVariables'], ['x'])
+        self.assertAlmostEqual(report['Lib.Fails']['maxRelativeError'], 1 - np.exp(-1.0))
+        self.assertEqual(report['Lib.Broken']['status'], 'build failed')
+        self.assertIn('does not translate', report['Lib.Broken']['message'])
+        self.assertEqual(report['Lib.Slow']['status'], 'timeout')
+        self.assertLess(report['Lib.Slow']['simulationTime'], 30.0)
+        regression.writeReport('report.csv')
+        with open('report.csv') as f:
+            self.assertEqual([l.split(',')[:2] for l in f.read().splitlines()[1:]],
+                             [['Lib.Broken', 'build failed'], ['Lib.Fails', 'failed'], ['Lib.Passes', 'passed'], ['Lib.Slow', 'timeout']])
+
+    def testCompareResultTolerance(self):
+        regression = OMPython.LibraryRegression('Lib', referenceDir=self.referenceDir, workDir=self.tmpDir, rtol=1e-3, atol=1e-6)
+        with open(os.path.join(self.referenceDir, 'Lib.Tolerance.csv'), 'w') as f:
+            f.write('time,x,y\n0,100,0\n1,-100,0\n')
+        def compare(x, y, names=('x', 'y')):
+            writeMat('result.mat', [('time', [0.0, 1.0])] + [(n, v) for (n, v) in zip(['x', 'y'], [x, y]) if n in names])
+            return regression.compareResult('Lib.Tolerance', 'result.mat')
+        # |value - reference| <= atol + rtol*|reference| on every time point
+        self.assertEqual(compare([100.1, -100.1], [1e-6, -1e-6])['status'], 'passed')
+        fields = compare([100.1, -100.2], [0.0, 2e-6])
+        self.assertEqual((fields['status'], fields['failedVariables']), ('failed', ['x', 'y']))
+        self.assertAlmostEqual(fields['maxRelativeError'], 2.0)
+        fields = compare([100.0, -100.0], [0.0, 0.0], names=('x',))
+        self.assertEqual((fields['status'], fields['missingVariables'], fields['compared']), ('failed', ['y'], 1))
+        self.assertEqual(regression.compareResult('Lib.Other', 'result.mat'), {'status': 'no reference'})
+
+
+if __name__ == '__main__':
+    unittest.main()
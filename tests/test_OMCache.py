@@ -0,0 +1,87 @@
+import os
+import shutil
+import unittest
+
+from support import TemporaryDirectoryTestCase
+from OMPython import OMCache
+
+
+def writeFile(fileName, text):
+    with open(fileName, 'w') as f:
+        f.write(text)
+
+
+class BuildCacheTest(TemporaryDirectoryTestCase):
+
+    def setUp(self):
+        TemporaryDirectoryTestCase.setUp(self)
+        self.cache = OMCache.BuildCache(os.path.join(self.tmpDir, 'builds'), maxSize=10000)
+        os.mkdir('src')
+        writeFile(os.path.join('src', 'M'), 'x' * 1000)
+        writeFile(os.path.join('src', 'M_init.xml'), '<xml/>')
+        self.files = ['M', 'M_init.xml']
+
+    def testKeyStability(self):
+        self.assertEqual(OMCache.BuildCache.key('a', 'M', None), OMCache.BuildCache.key('a', 'M', None))
+        self.assertNotEqual(OMCache.BuildCache.key('a', 'M', None), OMCache.BuildCache.key('a', 'M', 'Modelica'))
+        # the parts are separated, so moving a boundary changes the key
+        self.assertNotEqual(OMCache.BuildCache.key('ab', 'c'), OMCache.BuildCache.key('a', 'bc'))
+
+    def testModelFileHash(self):
+        os.makedirs(os.path.join('P', 'Sub'))
+        writeFile(os.path.join('P', 'package.mo'), 'package P end P;')
+        writeFile(os.path.join('P', 'Sub', 'package.mo'), 'package Sub end Sub;')
+        writeFile(os.path.join('P', 'notes.txt'), 'ignored')
+        first = OMCache.hashModelFiles(os.path.join('P', 'package.mo'))
+        self.assertEqual(OMCache.hashModelFiles(os.path.abspath(os.path.join('P', 'package.mo'))), first)
+        writeFile(os.path.join('P', 'notes.txt'), 'still ignored')
+        self.assertEqual(OMCache.hashModelFiles(os.path.join('P', 'package.mo')), first)
+        writeFile(os.path.join('P', 'Sub', 'package.mo'), 'package Sub constant Real c = 1; end Sub;')
+        self.assertNotEqual(OMCache.hashModelFiles(os.path.join('P', 'package.mo')), first)
+
+    def testFetchAndStore(self):
+        os.mkdir('dest')
+        self.assertIsNone(self.cache.fetch('k', 'dest'))
+        self.cache.store('k', self.files, 'src')
+        self.assertEqual(self.cache.fetch('k', 'dest'), self.files)
+        with open(os.path.join('dest', 'M')) as f:
+            self.assertEqual(f.read(), 'x' * 1000)
+        # storing an existing entry keeps it
+        writeFile(os.path.join('src', 'M'), 'changed')
+        self.cache.store('k', self.files, 'src')
+        with open(os.path.join(self.cache.entryDir('k'), 'M')) as f:
+            self.assertEqual(f.read(), 'x' * 1000)
+
+    def testStoreRace(self):
+        copy2 = shutil.copy2
+        def copyThenRace(src, dst):
+            copy2(src, dst)
+            # another process renames its complete entry into place first
+            entry = self.cache.entryDir('k')
+            if not os.path.isdir(entry):
+                os.mkdir(entry)
+                writeFile(os.path.join(entry, 'M'), 'other')
+        OMCache.shutil.copy2 = copyThenRace
+        try:
+            self.cache.store('k', self.files, 'src')
+        finally:
+            OMCache.shutil.copy2 = copy2
+        self.assertEqual(os.listdir(self.cache.cacheDir), ['k'])
+        with open(os.path.join(self.cache.entryDir('k'), 'M')) as f:
+            self.assertEqual(f.read(), 'other')
+
+    def testLeastRecentlyUsedEviction(self):
+        self.cache.maxSize = 3500
+        for (i, key) in enumerate(['a', 'b', 'c']):
+            self.cache.store(key, self.files, 'src')
+            os.utime(self.cache.entryDir(key), (1000 + i, 1000 + i))
+        os.mkdir('dest')
+        self.cache.fetch('a', 'dest')
+        self.cache.store('d', self.files, 'src')
+        self.assertEqual(sorted(e[2] for e in self.cache.entries()), ['a', 'c', 'd'])
+        self.cache.clear()
+        self.assertEqual(self.cache.entries(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from OMPython import OMExecutor
+
+
+def square(x):
+    return x * x
+
+
+def fail(x):
+    raise RuntimeError('task {0} failed'.format(x))
+
+
+def dieOnce(args):
+    # the first worker taking the task dies with it, as if its host went down
+    (marker, x) = args
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return x * x
+
+
+def die(x):
+    os._exit(1)
+
+
+class ExecutorTest(unittest.TestCase):
+
+    def check(self, executor):
+        with executor:
+            results = list(executor.imapUnordered(square, iter(range(50))))
+        self.assertEqual(sorted(results), [(i, i * i) for i in range(50)])
+
+    def testSerial(self):
+        self.check(OMExecutor.Executor())
+
+    def testThreads(self):
+        self.check(OMExecutor.ThreadExecutor(4))
+
+    def testProcesses(self):
+        self.check(OMExecutor.ProcessExecutor(2))
+
+    def testQueueWithLocalWorkers(self):
+        executor = OMExecutor.QueueExecutor(('127.0.0.1', 0), window=7, timeout=30)
+        executor.startLocalWorkers(3)
+        self.check(executor)
+
+    def testQueueReportsFailedTask(self):
+        with OMExecutor.QueueExecutor(('127.0.0.1', 0), timeout=30) as executor:
+            executor.startLocalWorkers(1)
+            self.assertRaises(OMExecutor.ExecutorError, list, executor.imapUnordered(fail, [1]))
+
+    def testQueueRequeuesTasksOfDeadWorkers(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            with OMExecutor.QueueExecutor(('127.0.0.1', 0), timeout=30, heartbeat=0.1) as executor:
+                executor.startLocalWorkers(2)
+                results = list(executor.imapUnordered(dieOnce, [(os.path.join(tmpDir, 'died'), 3)]))
+            self.assertEqual(results, [(0, 9)])
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def testQueueGivesUpOnLostTask(self):
+        with OMExecutor.QueueExecutor(('127.0.0.1', 0), timeout=30, heartbeat=0.1, retries=1) as executor:
+            executor.startLocalWorkers(2)
+            self.assertRaises(OMExecutor.ExecutorError, list, executor.imapUnordered(die, [1]))
+
+    def testQueueTimeout(self):
+        # no workers: the task is never answered
+        with OMExecutor.QueueExecutor(('127.0.0.1', 0), timeout=0.5) as executor:
+            self.assertRaises(OMExecutor.ExecutorError, list, executor.imapUnordered(square, [1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+import zipfile
+from distutils import spawn
+
+import numpy as np
+
+from OMPython import OMFMU
+
+FMU_SOURCES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fmu')
+COMPILER = spawn.find_executable('cc')
+
+
+@unittest.skipIf(COMPILER is None or os.name != 'posix', 'needs a C compiler to build the test FMU')
+class FMUTest(unittest.TestCase):
+    """In-process simulation of tests/fmu/M.c: der(x) = -k*x + u, y = 2*x."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpDir = tempfile.mkdtemp(prefix='OMPythonTest_')
+        (platform, extension) = OMFMU._platform()
+        library = os.path.join(cls.tmpDir, 'M' + extension)
+        subprocess.check_call([COMPILER, '-shared', '-fPIC', '-o', library, os.path.join(FMU_SOURCES, 'M.c')])
+        cls.fmuFile = os.path.join(cls.tmpDir, 'M.fmu')
+        with zipfile.ZipFile(cls.fmuFile, 'w') as z:
+            z.write(os.path.join(FMU_SOURCES, 'modelDescription.xml'), 'modelDescription.xml')
+            z.write(library, 'binaries/{0}/M{1}'.format(platform, extension))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpDir, ignore_errors=True)
+
+    def setUp(self):
+        self.fmu = OMFMU.FMU(self.fmuFile)
+
+    def tearDown(self):
+        self.fmu.close()
+
+    def testModelDescription(self):
+        self.assertEqual(self.fmu.modelName, 'M')
+        self.assertEqual(self.fmu.stateNames, ['x'])
+        self.assertEqual(self.fmu.derivativeNames, ['der(x)'])
+        self.assertEqual(sorted(self.fmu.kinds), [OMFMU.fmi2ModelExchange, OMFMU.fmi2CoSimulation])
+
+    def testCoSimulation(self):
+        instance = self.fmu.instantiate()
+        result = instance.simulate(0.0, 1.0, 0.1, values={'k': 2.0})
+        self.assertEqual(result.shape, (2, 11))
+        # the FMU integrates with forward Euler steps of stepSize / 100
+        self.assertAlmostEqual(result[1, -1], 2 * np.exp(-2.0), delta=2e-3)
+        # a reset instance starts again from the start values of the model
+        instance.reset()
+        result = instance.simulate(0.0, 1.0, 0.1, inputs={'u': lambda t: 1.0})
+        self.assertAlmostEqual(result[1, -1], 2.0, places=4)
+
+    def testModelExchangeEvents(self):
+        instance = self.fmu.instantiate(kind=OMFMU.fmi2ModelExchange)
+        result = instance.simulate(0.0, 1.0, 0.001, outputs=['y', 'crossings'])
+        self.assertAlmostEqual(result[1, -1], 2 * np.exp(-1.0), places=2)
+        # x crosses 0.5 once, at t = ln 2
+        self.assertEqual(result[2, -1], 1)
+        self.assertAlmostEqual(result[0][np.argmax(result[2] > 0)], np.log(2.0), places=2)
+
+    def testInstancesAreIndependent(self):
+        (a, b) = (self.fmu.instantiate(), self.fmu.instantiate())
+        a.set(['k'], [3.0])
+        self.assertEqual(list(b.get(['k'])), [1.0])
+
+    def testErrors(self):
+        instance = self.fmu.instantiate()
+        self.assertRaises(OMFMU.FMUError, instance.get, ['nope'])
+        self.assertRaises(OMFMU.FMUError, instance.getReal, [9])
+        self.fmu.guid = 'wrong'
+        self.assertRaises(OMFMU.FMUError, self.fmu.instantiate)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,225 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from support import TemporaryDirectoryTestCase, writeMat
+from OMPython import OMResult
+
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+class MatResultTest(TemporaryDirectoryTestCase):
+
+    def setUp(self):
+        TemporaryDirectoryTestCase.setUp(self)
+        self.time = np.linspace(0.0, 1.0, 1001)
+        self.x = np.sin(20 * self.time)
+        writeMat('R_res.mat', [('time', self.time), ('x', self.x)], [('k', 3.0)], [('a', 'x', False), ('b', 'x', True)])
+        self.res = OMResult.MatResult('R_res.mat')
+
+    def tearDown(self):
+        self.res.close()
+        TemporaryDirectoryTestCase.tearDown(self)
+
+    def testHeaders(self):
+        headers = OMResult.readMatHeaders('R_res.mat')
+        self.assertEqual(sorted(headers), ['Aclass', 'dataInfo', 'data_1', 'data_2', 'description', 'name'])
+        self.assertEqual((headers['data_2'].rows, headers['data_2'].cols), (2, 1001))
+        self.assertEqual(self.res.names, ['time', 'x', 'k', 'a', 'b'])
+        self.assertEqual(len(self.res), 1001)
+        self.assertEqual(self.res.timeSpan(), (0.0, 1.0))
+
+    def testVariables(self):
+        (time, x, k, a, b) = self.res.getVariables(['time', 'x', 'k', 'a', 'b'])
+        np.testing.assert_array_equal(time, self.time)
+        np.testing.assert_array_equal(x, self.x)
+        np.testing.assert_array_equal(k, np.full(1001, 3.0))
+        np.testing.assert_array_equal(a, self.x)
+        np.testing.assert_array_equal(b, -self.x)
+        self.assertRaises(KeyError, self.res.getVariable, 'y')
+
+    def testTimeRange(self):
+        (first, last) = self.res.timeRange(0.25, 0.5)
+        np.testing.assert_array_equal(self.res.getVariable('time', first, last), self.time[(self.time >= 0.25) & (self.time <= 0.5)])
+
+    def testDecimatedNegatedAlias(self):
+        (x, b) = self.res.getDecimated(['x', 'b'], 0, None, 50)
+        np.testing.assert_array_equal(np.sort(b), np.sort(-x))
+
+    def testColumnStore(self):
+        for compression in [None, 'zlib']:
+            storeDir = OMResult.writeColumnStore('R_res.mat', OMResult.columnStoreDir('R_res.mat'), compression, chunkRows=100)
+            self.assertTrue(OMResult.isColumnStoreCurrent(storeDir, 'R_res.mat'))
+            store = OMResult.ColumnStore(storeDir)
+            self.assertEqual(len(store), 1001)
+            for (expected, value) in zip(self.res.getVariables(['time', 'x', 'k', 'a', 'b']),
+                                         store.getVariables(['time', 'x', 'k', 'a', 'b'])):
+                np.testing.assert_array_equal(value, expected)
+            np.testing.assert_array_equal(store.getDecimated(['b'], 10, 900, 20)[0], self.res.getDecimated(['b'], 10, 900, 20)[0])
+            store.close()
+        os.utime('R_res.mat', (0, 0))
+        self.assertFalse(OMResult.isColumnStoreCurrent(storeDir, 'R_res.mat'))
+
+    def testViewsWithoutCopies(self):
+        storeDir = OMResult.writeColumnStore('R_res.mat', OMResult.columnStoreDir('R_res.mat'))
+        store = OMResult.ColumnStore(storeDir)
+        for reader in [self.res, store]:
+            x = reader.getVariable('x', 10, 20)
+            self.assertTrue(np.shares_memory(x, reader._columnData(1)))
+            self.assertFalse(x.flags.writeable)
+            self.assertFalse(np.shares_memory(reader.getVariable('b', 10, 20), reader._columnData(1)))
+        store.close()
+
+    def testDecimatedSize(self):
+        for (first, last) in [(0, 1001), (1, 1000), (3, 998), (500, 1001), (17, 400)]:
+            for maxPoints in [2, 3, 4, 5, 7, 10, 33, 100, 1000]:
+                (time, x) = self.res.getDecimated(['time', 'x'], first, last, maxPoints)
+                self.assertLessEqual(len(time), maxPoints)
+                self.assertEqual(len(time), len(x))
+                # the envelope keeps the peaks of the window
+                self.assertLessEqual(x.min(), self.x[first:last].min())
+                self.assertGreaterEqual(x.max(), self.x[first:last].max())
+
+    def testDecimatedTooFewPoints(self):
+        for maxPoints in [0, 1]:
+            self.assertRaises(ValueError, self.res.getDecimated, ['x'], 0, None, maxPoints)
+
+
+class FollowResultTest(TemporaryDirectoryTestCase):
+
+    def testFollowGrowingMat(self):
+        time = np.arange(10.0)
+        writeMat('F_res.mat', [('time', time), ('x', 2 * time)], aliases=[('b', 'x', True)], rows=4)
+        finished = [False]
+        blocks = OMResult.followResult('F_res.mat', ['time', 'b'], done=lambda: finished[0], blockRows=3)
+        first = [next(blocks), next(blocks)]
+        np.testing.assert_array_equal(np.hstack(first), [time[:4], -2 * time[:4]])
+        # the simulation appends the remaining rows and finishes
+        with open('F_res.mat', 'ab') as f:
+            f.write(np.column_stack([time[4:], 2 * time[4:]]).astype('<f8').tostring())
+        finished[0] = True
+        rest = list(blocks)
+        self.assertTrue(all(b.shape[1] <= 3 for b in rest))
+        np.testing.assert_array_equal(np.hstack(rest), [time[4:], -2 * time[4:]])
+
+    def testFollowCsv(self):
+        with open('F_res.csv', 'w') as f:
+            f.write('"time","x",\n')
+            for t in range(5):
+                f.write('{0},{1},\n'.format(float(t), 3.0 * t))
+        (time, x) = np.hstack(list(OMResult.followResult('F_res.csv', ['time', 'x'])))
+        np.testing.assert_array_equal(x, 3 * time)
+        self.assertEqual(len(time), 5)
+
+
+class ResampleTest(unittest.TestCase):
+
+    def testEventsAndHold(self):
+        runs = [np.array([[0.0, 1.0, 1.0, 2.0], [0.0, 1.0, 5.0, 6.0]]),
+                np.array([[0.0, 2.0], [10.0, 12.0]]),
+                np.zeros((2, 0))]
+        grid = [-1.0, 0.5, 1.0, 1.5, 3.0]
+        result = OMResult.resample(runs, grid)
+        self.assertEqual(result.shape, (3, 5, 1))
+        # right-continuous at the event at t = 1, held outside the time span
+        np.testing.assert_allclose(result[0, :, 0], [0.0, 0.5, 5.0, 5.5, 6.0])
+        np.testing.assert_allclose(result[1, :, 0], [10.0, 10.5, 11.0, 11.5, 12.0])
+        self.assertTrue(np.isnan(result[2]).all())
+        previous = OMResult.resample(runs[:1], grid, method='previous')
+        np.testing.assert_allclose(previous[0, :, 0], [0.0, 0.0, 5.0, 5.0, 6.0])
+
+    def testResultFiles(self):
+        tmpDir = tempfile.mkdtemp()
+        try:
+            fileName = os.path.join(tmpDir, 'R_res.mat')
+            writeMat(fileName, [('time', [0.0, 1.0]), ('x', [1.0, 3.0])])
+            np.testing.assert_allclose(OMResult.resample([fileName], [0.5], ['x'])[0, :, 0], [2.0])
+            self.assertRaises(ValueError, OMResult.resample, [fileName], [0.5])
+        finally:
+            shutil.rmtree(tmpDir)
+
+
+class LinearModelTest(unittest.TestCase):
+
+    def testReadLinearModel(self):
+        (A, B, C, D, stateNames, inputNames, outputNames) = OMResult.readLinearModel(os.path.join(DATA, 'linear_M.mo'))
+        np.testing.assert_array_equal(A, [[-1.0, 2.0], [0.0, -3.0]])
+        np.testing.assert_array_equal(B, [[0.0], [1.5]])
+        np.testing.assert_array_equal(C, [[2.0, 0.0], [0.0, 0.1]])
+        np.testing.assert_array_equal(D, np.zeros((2, 1)))
+        self.assertEqual((stateNames, inputNames, outputNames), (['tank.h', 'v'], ['valve.opening'], ['y', 'level']))
+
+
+class SimulationStatsTest(unittest.TestCase):
+
+    def testParseLogStats(self):
+        with open(os.path.join(DATA, 'M_stats.log')) as f:
+            stats = OMResult.parseSimulationStats(f, wallTime=0.5)
+        self.assertEqual(stats.solver, 'dassl')
+        self.assertEqual(stats.wallTime, 0.5)
+        self.assertAlmostEqual(stats.initTime, 0.000298 + 3.4e-05)
+        self.assertEqual((stats.integrationTime, stats.outputTime, stats.totalTime), (0.00737, 0.000522, 0.00861))
+        self.assertEqual(stats.timers['reading init.xml'], 0.00142)
+        self.assertEqual(stats.timers['time of jacobian evaluation'], 0.0)
+        self.assertEqual((stats.steps, stats.functionEvaluations, stats.jacobianEvaluations), (518, 734, 167))
+        self.assertEqual((stats.stateEvents, stats.timeEvents, stats.rejectedSteps), (9, 0, 4))
+
+    def testNoStatistics(self):
+        stats = OMResult.parseSimulationStats('LOG_SUCCESS       | info    | The simulation finished successfully.\n')
+        self.assertEqual((stats.timers, stats.counts, stats.solver, stats.rejectedSteps), ({}, {}, None, None))
+
+
+class ProfileTest(unittest.TestCase):
+
+    def testRankingAndEquations(self):
+        blocks = OMResult.readProfile(os.path.join(DATA, 'M_prof.json'), os.path.join(DATA, 'M_info.json'))
+        # ranked by time, ties by number of calls
+        self.assertEqual([b['id'] for b in blocks], [7, 11, 4, 9])
+        self.assertEqual([b['fraction'] for b in blocks], [0.4, 0.25, 0.05, 0.05])
+        self.assertEqual((blocks[0]['ncall'], blocks[0]['maxTime']), (1020, 0.0004))
+        self.assertEqual((blocks[0]['defines'], blocks[0]['tag']), (['z', 'w'], 'system'))
+        self.assertEqual(blocks[0]['equation'], 'z + w ^ 3 = x z - w = 1')
+        self.assertEqual((blocks[1]['defines'], blocks[1]['section']), (['der(x)'], 'regular'))
+        # block 9 is not described in the info file
+        self.assertEqual((blocks[3]['defines'], blocks[3]['tag'], blocks[3]['equation']), ([], None, ''))
+
+    def testWithoutInfoFile(self):
+        blocks = OMResult.readProfile(os.path.join(DATA, 'M_prof.json'), os.path.join(DATA, 'missing_info.json'))
+        self.assertEqual([b['id'] for b in blocks], [7, 11, 4, 9])
+        self.assertTrue(all(b['defines'] == [] for b in blocks))
+
+
+class AccumulatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.samples = np.random.RandomState(1).normal(size=(2000, 3)) * [1.0, 2.0, 0.5] + [0.0, 1.0, -1.0]
+
+    def testRunningStatistics(self):
+        stats = OMResult.RunningStatistics((3,))
+        self.assertTrue(np.isnan(stats.variance).all())
+        for s in self.samples:
+            stats.add(s)
+        self.assertEqual(stats.count, 2000)
+        np.testing.assert_allclose(stats.mean, self.samples.mean(axis=0))
+        np.testing.assert_allclose(stats.variance, self.samples.var(axis=0, ddof=1))
+        np.testing.assert_array_equal(stats.min, self.samples.min(axis=0))
+        np.testing.assert_array_equal(stats.max, self.samples.max(axis=0))
+
+    def testStreamingQuantiles(self):
+        levels = (0.05, 0.5, 0.95)
+        quantiles = OMResult.StreamingQuantiles((3,), levels)
+        for (i, s) in enumerate(self.samples):
+            quantiles.add(s)
+            if i == 3:
+                # exact while there are at most five samples
+                np.testing.assert_allclose(quantiles.quantiles,
+                                           [np.percentile(self.samples[:4], 100 * p, axis=0) for p in levels])
+        expected = np.array([np.percentile(self.samples, 100 * p, axis=0) for p in levels])
+        np.testing.assert_allclose(quantiles.quantiles, expected, atol=0.15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,199 @@
+import socket
+import unittest
+
+import numpy as np
+
+from support import TemporaryDirectoryTestCase, writeFakeModel
+from OMPython import ModelicaSystem, OMStepping
+
+
+def firstOrderModel():
+    # x' = -x + u, y = 2x
+    return OMStepping.StateSpaceModel([[-1.0]], [[1.0]], [[2.0]], [[0.0]], ['x'], ['u'], ['y'], x0=[1.0])
+
+
+class SteppingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = OMStepping.SteppingServer(firstOrderModel()).start()
+        self.session = OMStepping.SteppingSession(*self.server.address)
+
+    def tearDown(self):
+        self.session.close()
+        self.server.stop()
+
+    def testNames(self):
+        self.assertEqual(self.session.names(), ['x', 'u', 'y'])
+
+    def testExchange(self):
+        y = self.session.exchange({'u': 0.0}, 1.0, ['y', 'x'])
+        self.assertAlmostEqual(self.session.time, 1.0)
+        self.assertAlmostEqual(y[0], 2 * np.exp(-1.0), places=9)
+        self.assertAlmostEqual(y[1], np.exp(-1.0), places=9)
+        # u = 1 drives x towards 1
+        for _ in range(20):
+            x = self.session.exchange({'u': 1.0}, 1.0, ['x'])
+        self.assertAlmostEqual(x[0], 1.0, places=6)
+
+    def testRejectedInputDoesNotAdvance(self):
+        self.assertRaises(OMStepping.SteppingError, self.session.exchange, [('u', 3.0), ('bad', 1.0)], 0.5, ['y'])
+        # neither u is set nor the model advanced, and the session is still in step
+        self.assertEqual(list(self.session.get(['x', 'u'])), [1.0, 0.0])
+        self.assertEqual(float(self.session.request('TIME')[0][0]), 0.0)
+        self.assertRaises(OMStepping.SteppingError, self.session.setInputs, [('u', 3.0), ('y', 1.0)])
+        self.assertEqual(list(self.session.get(['u'])), [0.0])
+        self.assertAlmostEqual(self.session.exchange({'u': 0.0}, 0.5, ['x'])[0], np.exp(-0.5), places=9)
+
+    def testSkippedLinesAreAnswered(self):
+        self.session._send(['GET z', '+STEP 1.0', '+GET x', 'GET x'])
+        replies = [self.session._reply() for _ in range(4)]
+        self.assertTrue(all(isinstance(r, OMStepping.SteppingError) for r in replies[:3]))
+        self.assertEqual(replies[3], ['1.0'])
+
+    def testUnknownVariable(self):
+        self.assertRaises(OMStepping.SteppingError, self.session.get, ['z'])
+        self.assertEqual(self.session.names(), ['x', 'u', 'y'])
+
+    def testServerLeavesStdlibAlone(self):
+        self.assertFalse(OMStepping.socketserver.ThreadingTCPServer.allow_reuse_address)
+
+
+
+class _FakeOPCUAServer(object):
+    """The nodes of the embedded OPC UA server of an executable simulating x' = -x + u."""
+
+    def __init__(self, stepSize=0.5):
+        self.values = {'time': 0.0, 'step': False, 'run': False, 'x': 1.0, 'u': 0.0}
+        self.stepSize = stepSize
+        self.stalled = False
+        self.refusedConnects = 0
+
+    def set(self, name, value):
+        if name == 'step' and value and not self.stalled:
+            (x, u) = (self.values['x'], self.values['u'])
+            self.values['x'] = u + (x - u) * np.exp(-self.stepSize)
+            self.values['time'] += self.stepSize
+        else:
+            self.values[name] = value
+
+
+class _FakeNode(object):
+
+    def __init__(self, server, name):
+        (self.server, self.name) = (server, name)
+
+    def get_browse_name(self):
+        return type('QualifiedName', (object,), {'Name': self.name})
+
+    def get_value(self):
+        return self.server.values[self.name]
+
+    def set_value(self, value):
+        self.server.set(self.name, value)
+
+
+class _FakeOPCUA(object):
+    """Stands in for the opcua package: a client connected to one _FakeOPCUAServer."""
+
+    class ua(object):
+        class UaError(Exception):
+            pass
+
+        class VariantType(object):
+            Double = 'Double'
+
+        DataValue = staticmethod(lambda variant: variant)
+        Variant = staticmethod(lambda value, variantType: value)
+
+    def __init__(self):
+        self.server = _FakeOPCUAServer()
+        self.urls = []
+        fake = self
+
+        class Client(object):
+            def __init__(self, url, timeout):
+                fake.urls.append(url)
+
+            def connect(self):
+                if fake.server.refusedConnects:
+                    fake.server.refusedConnects -= 1
+                    raise socket.error('connection refused')
+
+            def get_objects_node(self):
+                return type('Objects', (object,), {'get_children': lambda s: [_FakeNode(fake.server, n) for n in fake.server.values]})()
+
+            def disconnect(self):
+                pass
+
+        self.Client = Client
+
+
+class _Process(object):
+
+    def __init__(self):
+        (self.finished, self.cancelled) = (False, False)
+
+    def done(self):
+        return self.finished
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class OPCUASessionTest(TemporaryDirectoryTestCase):
+
+    def setUp(self):
+        TemporaryDirectoryTestCase.setUp(self)
+        (self.opcua, OMStepping.opcua) = (OMStepping.opcua, _FakeOPCUA())
+        self.server = OMStepping.opcua.server
+
+    def tearDown(self):
+        OMStepping.opcua = self.opcua
+        TemporaryDirectoryTestCase.tearDown(self)
+
+    def testExchange(self):
+        self.server.refusedConnects = 2
+        process = _Process()
+        with OMStepping.OPCUASession(4841, 0.5, process, timeout=5.0) as session:
+            self.assertEqual(session.names(), ['u', 'x'])
+            (x,) = session.exchange({'u': 1.0}, 1.0, ['x'])
+            self.assertEqual(session.time, 1.0)
+            self.assertAlmostEqual(x, 1.0)
+        self.assertTrue(process.cancelled)
+
+    def testStalledStepTimesOut(self):
+        session = OMStepping.OPCUASession(4841, 0.5, _Process(), timeout=0.2)
+        self.server.stalled = True
+        self.assertRaises(OMStepping.SteppingError, session.step, 0.5)
+
+    def testEndedSimulation(self):
+        process = _Process()
+        session = OMStepping.OPCUASession(4841, 0.5, process, timeout=5.0)
+        (self.server.stalled, process.finished) = (True, True)
+        self.assertRaises(OMStepping.SteppingError, session.step, 0.5)
+
+    def testConnectTimesOut(self):
+        self.server.refusedConnects = 10 ** 6
+        self.assertRaises(OMStepping.SteppingError, OMStepping.OPCUASession, 4841, 0.5, _Process(), timeout=0.2)
+
+    def testStartStepping(self):
+        (exeFile, xmlFile) = writeFakeModel(self.tmpDir)
+        m = ModelicaSystem.fromBuild(exeFile, xmlFile)
+        m.setInputValues('u', [(0.0, 1.0)])
+        m.setInputValues('v', [(0.0, 0.0)])
+        self.server.stepSize = 0.1
+        session = m.startStepping(port=4850)
+        self.assertEqual(OMStepping.opcua.urls, ['opc.tcp://localhost:4850'])
+        self.assertEqual(session.stepSize, 0.1)
+        cmd = m.lastRun.cmd
+        self.assertIn('-embeddedServer=opc-ua', cmd)
+        self.assertIn('-embeddedServerPort=4850', cmd)
+        self.assertIn('-csvInput=' + m.csvFile, cmd)
+        self.assertAlmostEqual(session.step(0.5), 0.5)
+        session.close()
+        self.server.refusedConnects = 10 ** 6
+        self.assertIsNone(m.startStepping(timeout=0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()